@@ -23,24 +23,25 @@
 
 import threading
 import itertools
-from collections import defaultdict
-import random
+from collections import defaultdict, OrderedDict
 
 from . import bitcoin
-from .bitcoin import COINBASE_MATURITY, TYPE_ADDRESS, TYPE_PUBKEY, TYPE_DATA
+from .bitcoin import COINBASE_MATURITY, TYPE_ADDRESS, TYPE_PUBKEY
 from .util import PrintError, profiler, bfh, bh2u, VerifiedTxInfo, TxMinedStatus
-from . import transaction
-from .transaction import Transaction, TxOutput, TxOutPoint
+from .transaction import Transaction, TxOutput
+from .txindex import InternTable, TxiIndex, TxoIndex, SpentOutpoints
 from .synchronizer import Synchronizer
 from .verifier import SPV
 from .blockchain import hash_header
 from .i18n import _
-from . import constants
 
 TX_HEIGHT_LOCAL = -2
 TX_HEIGHT_UNCONF_PARENT = -1
 TX_HEIGHT_UNCONFIRMED = 0
 
+# number of Transaction objects kept by TxStore
+TX_CACHE_SIZE = 1000
+
 class AddTransactionException(Exception):
     pass
 
@@ -50,6 +51,88 @@ class UnrelatedTransactionException(AddTransactionException):
         return _("Transaction is unrelated to this wallet.")
 
 
+class TxStore:
+    """
+    txid -> Transaction mapping that only keeps the raw transactions.
+    The raw hex strings are the ones read from storage, so nothing is
+    copied; Transaction objects are created on access and a bounded
+    number of them is kept, in LRU order.
+    """
+
+    def __init__(self, raw_txs=None):
+        self.lock = threading.Lock()
+        self._raw = raw_txs if raw_txs is not None else {}  # txid -> raw hex
+        self._cache = OrderedDict()  # txid -> Transaction, LRU order
+
+    def __contains__(self, txid):
+        return txid in self._raw
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __iter__(self):
+        return iter(list(self._raw))
+
+    def keys(self):
+        return list(self._raw)
+
+    def __getitem__(self, txid):
+        tx = self.get(txid)
+        if tx is None:
+            raise KeyError(txid)
+        return tx
+
+    def get(self, txid, default=None):
+        with self.lock:
+            tx = self._cache.get(txid)
+            if tx is not None:
+                self._cache.move_to_end(txid)
+                return tx
+            raw = self._raw.get(txid)
+            if raw is None:
+                return default
+            tx = Transaction(raw)
+            self._add_to_cache(txid, tx)
+            return tx
+
+    def __setitem__(self, txid, tx):
+        raw = str(tx)
+        with self.lock:
+            self._raw[txid] = raw
+            self._cache.pop(txid, None)
+            self._add_to_cache(txid, tx)
+
+    def pop(self, txid, default=None):
+        with self.lock:
+            tx = self._cache.pop(txid, None)
+            raw = self._raw.pop(txid, None)
+            if raw is None:
+                return default
+            return tx if tx is not None else Transaction(raw)
+
+    def items(self):
+        for txid in self.keys():
+            tx = self.get(txid)
+            if tx is not None:
+                yield txid, tx
+
+    def values(self):
+        for txid, tx in self.items():
+            yield tx
+
+    def get_raw(self, txid):
+        return self._raw.get(txid)
+
+    def raw_dict(self):
+        with self.lock:
+            return dict(self._raw)
+
+    def _add_to_cache(self, txid, tx):
+        self._cache[txid] = tx
+        if len(self._cache) > TX_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+
 class AddressSynchronizer(PrintError):
     """
     inherited by wallet
@@ -65,11 +148,6 @@ class AddressSynchronizer(PrintError):
         self.lock = threading.RLock()
         self.transaction_lock = threading.RLock()
         # address -> list(txid, height)
-        # KYC pubkeys reigstered to the blockchain by the policy node, but not yet assigned to a user
-        unassigned_kyc_pubkeys = storage.get('unassigned_kyc_pubkeys', {})
-        self.unassigned_kyc_pubkeys = {}
-        for key, (txid, n) in unassigned_kyc_pubkeys.items():
-            self.unassigned_kyc_pubkeys[key] = TxOutPoint(txid, n)
         self.kyc_pubkey = storage.get('kyc_pubkey', None)
         self.onboard_address = storage.get('onboard_address', None)
         self.history = storage.get('addr_history',{})
@@ -87,9 +165,6 @@ class AddressSynchronizer(PrintError):
 
         self.load_and_cleanup()
 
-    def is_unassigned_kyc_pubkey(self, pubkey):
-        return pubkey in self.unassigned_kyc_pubkeys.keys()
-
     def set_kyc_pubkey(self, pubkey):
         self.kyc_pubkey=pubkey
         
@@ -103,14 +178,15 @@ class AddressSynchronizer(PrintError):
         return self.onboard_address
 
     def get_unassigned_kyc_pubkey(self):
-        if len(self.unassigned_kyc_pubkeys) is 0:
+        # KYC pubkeys are tracked by the network, for all wallets
+        if self.network is None:
             return None
-        #remove a random pubkey from the set.
-        return random.sample(self.unassigned_kyc_pubkeys.keys(), 1)[0]
+        return self.network.policy_tracker.get_unassigned_kyc_pubkey()
 
     def load_and_cleanup(self):
         self.load_transactions()
         self.load_local_history()
+        self.load_utxo_index()
         self.check_history()
         self.load_unverified_transactions()
         self.remove_local_transactions_we_dont_have()
@@ -139,25 +215,13 @@ class AddressSynchronizer(PrintError):
         addr = txi.get('address')
         if addr and addr != "(pubkey)":
             return addr
-        prevout_hash = txi.get('prevout_hash')
-        prevout_n = txi.get('prevout_n')
-        dd = self.txo.get(prevout_hash, {})
-        for addr, l in dd.items():
-            for n, v, a, is_cb, scriptPubKey in l:
-                if n == prevout_n:
-                    return addr
-        return None
+        prevout = self.txo.get_output(txi.get('prevout_hash'), txi.get('prevout_n'))
+        return prevout[0] if prevout else None
 
     def get_txin_asset(self, txi):
         asset = txi.get('asset')
-        prevout_hash = txi.get('prevout_hash')
-        prevout_n = txi.get('prevout_n')
-        dd = self.txo.get(prevout_hash, {})
-        for addr, l in dd.items():
-            for n, v, a, is_cb, scriptPubKey in l:
-                if n == prevout_n:
-                    return asset
-        return None
+        prevout = self.txo.get_output(txi.get('prevout_hash'), txi.get('prevout_n'))
+        return asset if prevout else None
 
     def get_txout_address(self, txo: TxOutput):
         if txo.type == TYPE_ADDRESS:
@@ -196,23 +260,14 @@ class AddressSynchronizer(PrintError):
             self.storage.put('stored_height', self.get_local_height())
         self.save_transactions()
         self.save_verified_tx()
-        self.save_unassigned_kyc_pubkeys()
-        self.storage.write()
+        # fold the journal into the wallet file, so it can be copied alone
+        self.storage.write(compact=True)
 
     def add_address(self, address):
         if address not in self.history:
             self.history[address] = []
             self.set_up_to_date(False)
         if self.synchronizer:
-            self.synchronizer.remove_whitelist(address)
-            self.synchronizer.add(address)
-
-    def add_whitelist_address(self, address):
-        if address not in self.history:
-            self.history[address] = []
-            self.set_up_to_date(False)
-        if self.synchronizer:
-            self.synchronizer.add_whitelist(address)
             self.synchronizer.add(address)
 
     def get_conflicting_transactions(self, tx):
@@ -228,7 +283,7 @@ class AddressSynchronizer(PrintError):
                     continue
                 prevout_hash = txin['prevout_hash']
                 prevout_n = txin['prevout_n']
-                spending_tx_hash = self.spent_outpoints[prevout_hash].get(prevout_n)
+                spending_tx_hash = self.spent_outpoints.get(prevout_hash, prevout_n)
                 if spending_tx_hash is None:
                     continue
                 # this outpoint has already been spent, by spending_tx
@@ -255,14 +310,13 @@ class AddressSynchronizer(PrintError):
             # being is_mine, as we roll the gap_limit forward
             is_coinbase = tx.inputs()[0]['type'] == 'coinbase'
             tx_height = self.get_tx_height(tx_hash).height
-            is_whitelist = tx.is_whitelist()
             if not allow_unrelated:
                 # note that during sync, if the transactions are not properly sorted,
                 # it could happen that we think tx is unrelated but actually one of the inputs is is_mine.
                 # this is the main motivation for allow_unrelated
                 is_mine = any([self.is_mine(self.get_txin_address(txin)) for txin in tx.inputs()])
                 is_for_me = any([self.is_mine(self.get_txout_address(txo)) for txo in tx.outputs()])
-                if not is_mine and not is_for_me and not is_whitelist:
+                if not is_mine and not is_for_me:
                     raise UnrelatedTransactionException()
             # Find all conflicting transactions.
             # In case of a conflict,
@@ -292,84 +346,65 @@ class AddressSynchronizer(PrintError):
                     to_remove |= self.get_depending_transactions(conflicting_tx_hash)
                 for tx_hash2 in to_remove:
                     self.remove_transaction(tx_hash2)
+            # txi and txo of this tx are rebuilt below
+            self._remove_tx_from_utxo_index(tx_hash)
             # add inputs
             def add_value_from_prev_output():
-                dd = self.txo.get(prevout_hash, {})
-                # note: this nested loop takes linear time in num is_mine outputs of prev_tx
-                for addr, outputs in dd.items():
-                    # note: instead of [(n, v, is_cb), ...]; we could store: {n -> (v, is_cb)}
-                    for n, v, a, is_cb, scriptPubKey in outputs:
-                        if n == prevout_n:
-                            if addr and (self.is_mine(addr) or is_whitelist):
-                                if d.get(addr) is None:
-                                    d[addr] = set()
-                                d[addr].add((ser, v, a))
-                            return
-            self.txi[tx_hash] = d = {}
+                prevout = self.txo.get_output(prevout_hash, prevout_n)
+                if prevout is None:
+                    return
+                addr, v, a, is_cb, scriptPubKey = prevout
+                if addr and self.is_mine(addr):
+                    if d.get(addr) is None:
+                        d[addr] = set()
+                    d[addr].add((ser, v, a))
+            d = {}
             for txi in tx.inputs():
                 if txi['type'] == 'coinbase':
                     continue
                 prevout_hash = txi['prevout_hash']
                 prevout_n = txi['prevout_n']
                 ser = prevout_hash + ':%d' % prevout_n
-                self.spent_outpoints[prevout_hash][prevout_n] = tx_hash
+                self.spent_outpoints.add(prevout_hash, prevout_n, tx_hash)
                 add_value_from_prev_output()
+            self.txi[tx_hash] = d
             # add outputs
-            self.txo[tx_hash] = d = {}
+            d = {}
             for n, txo in enumerate(tx.outputs()):
                 v = txo[2]
                 a = txo[4]
                 ser = tx_hash + ':%d'%n
                 addr = self.get_txout_address(txo)
-                if addr and (self.is_mine(addr) or is_whitelist):
+                if addr and self.is_mine(addr):
                     if d.get(addr) is None:
                         d[addr] = []
                     d[addr].append((n, v, a, is_coinbase, txo.scriptPubKey))
                     # give v to txi that spends me
-                    next_tx = self.spent_outpoints[tx_hash].get(n)
-                    if next_tx is not None:
-                        dd = self.txi.get(next_tx, {})
-                        if dd.get(addr) is None:
-                            dd[addr] = set()
-                        if (ser, v, a) not in dd[addr]:
-                            dd[addr].add((ser, v, a))
+                    next_tx = self.spent_outpoints.get(tx_hash, n)
+                    if next_tx is not None and next_tx in self.txi:
+                        if self.txi.add(next_tx, addr, ser, v, a):
+                            self._spent_coins[addr][ser] = next_tx
                         self._add_tx_to_local_history(next_tx)
+            self.txo[tx_hash] = d
             # add to local history
             self._add_tx_to_local_history(tx_hash)
+            self._add_tx_to_utxo_index(tx_hash)
             # save
             self.transactions[tx_hash] = tx
             return True
 
     def remove_transaction(self, tx_hash):
-        def remove_from_spent_outpoints():
-            # undo spends in spent_outpoints
-            if tx is not None:  # if we have the tx, this branch is faster
-                for txin in tx.inputs():
-                    if txin['type'] == 'coinbase':
-                        continue
-                    prevout_hash = txin['prevout_hash']
-                    prevout_n = txin['prevout_n']
-                    self.spent_outpoints[prevout_hash].pop(prevout_n, None)
-                    if not self.spent_outpoints[prevout_hash]:
-                        self.spent_outpoints.pop(prevout_hash)
-            else:  # expensive but always works
-                for prevout_hash, d in list(self.spent_outpoints.items()):
-                    for prevout_n, spending_txid in d.items():
-                        if spending_txid == tx_hash:
-                            self.spent_outpoints[prevout_hash].pop(prevout_n, None)
-                            if not self.spent_outpoints[prevout_hash]:
-                                self.spent_outpoints.pop(prevout_hash)
-            # Remove this tx itself; if nothing spends from it.
-            # It is not so clear what to do if other txns spend from it, but it will be
-            # removed when those other txns are removed.
-            if not self.spent_outpoints[tx_hash]:
-                self.spent_outpoints.pop(tx_hash)
-
         with self.transaction_lock:
             self.print_error("removing tx from history", tx_hash)
-            tx = self.transactions.pop(tx_hash, None)
-            remove_from_spent_outpoints()
+            self.transactions.pop(tx_hash, None)
+            # undo spends in spent_outpoints.
+            # Spends of the outputs of this tx itself are kept.
+            # It is not so clear what to do if other txns spend from it, but they
+            # will be removed when those other txns are removed.
+            self.spent_outpoints.remove_spender(tx_hash)
             self._remove_tx_from_local_history(tx_hash)
+            self._remove_tx_from_utxo_index(tx_hash)
+            self._tx_confirmed.pop(tx_hash, None)
             self.txi.pop(tx_hash, None)
             self.txo.pop(tx_hash, None)
 
@@ -380,7 +415,7 @@ class AddressSynchronizer(PrintError):
         self.add_transaction(tx_hash, tx, allow_unrelated=True)
 
 
-    def receive_history_callback(self, addr, hist, tx_fees, is_whitelist: bool = False):
+    def receive_history_callback(self, addr, hist, tx_fees):
         with self.lock:
             old_hist = self.get_address_history(addr)
             for tx_hash, height in old_hist:
@@ -388,14 +423,14 @@ class AddressSynchronizer(PrintError):
                     # make tx local
                     self.unverified_tx.pop(tx_hash, None)
                     self.verified_tx.pop(tx_hash, None)
+                    self._update_tx_confirmed(tx_hash)
                     if self.verifier:
                         self.verifier.remove_spv_proof_for_tx(tx_hash)
             self.history[addr] = hist
 
         for tx_hash, tx_height in hist:
             # add it in case it was previously unconfirmed
-            if not is_whitelist:
-                self.add_unverified_tx(tx_hash, tx_height)
+            self.add_unverified_tx(tx_hash, tx_height)
             # if addr is new, we have to recompute txi and txo
             tx = self.transactions.get(tx_hash)
             if tx is None:
@@ -408,28 +443,23 @@ class AddressSynchronizer(PrintError):
     @profiler
     def load_transactions(self):
         # load txi, txo, tx_fees
-        self.txi = self.storage.get('txi', {})
-        for txid, d in list(self.txi.items()):
-            for addr, lst in d.items():
-                self.txi[txid][addr] = set([tuple(x) for x in lst])
-        self.txo = self.storage.get('txo', {})
+        self.load_tx_index(self.storage.get('txi', {}), self.storage.get('txo', {}))
         self.tx_fees = self.storage.get('tx_fees', {})
         tx_list = self.storage.get('transactions', {})
-        # load transactions
-        self.transactions = {}
-        for tx_hash, raw in tx_list.items():
-            tx = Transaction(raw)
-            self.transactions[tx_hash] = tx
+        # load transactions; they are only parsed when accessed
+        for tx_hash in list(tx_list):
             if self.txi.get(tx_hash) is None and self.txo.get(tx_hash) is None:
                 self.print_error("removing unreferenced tx", tx_hash)
-                self.transactions.pop(tx_hash)
+                tx_list.pop(tx_hash)
+        self.transactions = TxStore(tx_list)
         # load spent_outpoints
-        _spent_outpoints = self.storage.get('spent_outpoints', {})
-        self.spent_outpoints = defaultdict(dict)
-        for prevout_hash, d in _spent_outpoints.items():
-            for prevout_n_str, spending_txid in d.items():
-                prevout_n = int(prevout_n_str)
-                self.spent_outpoints[prevout_hash][prevout_n] = spending_txid
+        self.spent_outpoints = SpentOutpoints(self.storage.get('spent_outpoints', {}))
+
+    def load_tx_index(self, txi, txo):
+        # addresses, assets and scripts are shared by txi and txo
+        table = InternTable()
+        self.txi = TxiIndex(table, txi)
+        self.txo = TxoIndex(table, txo)
 
     @profiler
     def load_local_history(self):
@@ -454,6 +484,15 @@ class AddressSynchronizer(PrintError):
                 if tx is not None:
                     self.add_transaction(tx_hash, tx, allow_unrelated=True)
                     save = True
+        if self.storage.get('unassigned_kyc_pubkeys') is not None:
+            # policy transactions used to be synchronized by each wallet;
+            # they are now tracked by the network
+            self.storage.put('unassigned_kyc_pubkeys', None)
+            for txid in set(self.txi) | set(self.txo):
+                addrs = set(self.txi.get(txid, {})) | set(self.txo.get(txid, {}))
+                if addrs and not any(self.is_mine(addr) for addr in addrs):
+                    self.remove_transaction(txid)
+            save = True
         if save:
             self.save_transactions()
 
@@ -467,15 +506,12 @@ class AddressSynchronizer(PrintError):
     @profiler
     def save_transactions(self, write=False):
         with self.transaction_lock:
-            tx = {}
-            for k,v in self.transactions.items():
-                tx[k] = str(v)
-            self.storage.put('transactions', tx)
-            self.storage.put('txi', self.txi)
-            self.storage.put('txo', self.txo)
+            self.storage.put('transactions', self.transactions.raw_dict())
+            self.storage.put('txi', self.txi.to_json())
+            self.storage.put('txo', self.txo.to_json())
             self.storage.put('tx_fees', self.tx_fees)
             self.storage.put('addr_history', self.history)
-            self.storage.put('spent_outpoints', self.spent_outpoints)
+            self.storage.put('spent_outpoints', self.spent_outpoints.to_json())
             self.storage.put('kyc_pubkey', self.kyc_pubkey)
             self.storage.put('onboard_address', self.onboard_address)
             if write:
@@ -487,23 +523,16 @@ class AddressSynchronizer(PrintError):
             if write:
                 self.storage.write()
 
-    def save_unassigned_kyc_pubkeys(self, write=False):
-        with self.lock:
-            self.storage.put('unassigned_kyc_pubkeys', self.unassigned_kyc_pubkeys)
-            if write:
-                self.storage.write()
-
-                
     def clear_history(self):
         with self.lock:
             with self.transaction_lock:
-                self.txi = {}
-                self.txo = {}
+                self.load_tx_index({}, {})
                 self.tx_fees = {}
-                self.spent_outpoints = defaultdict(dict)
+                self.spent_outpoints = SpentOutpoints()
                 self.history = {}
                 self.verified_tx = {}
-                self.transactions = {}
+                self.transactions = TxStore()
+                self.load_utxo_index()
                 self.save_transactions()
 
     def get_txpos(self, tx_hash):
@@ -591,7 +620,138 @@ class AddressSynchronizer(PrintError):
                 else:
                     self._history_local[addr] = cur_hist
 
+    @profiler
+    def load_utxo_index(self):
+        # address -> {ser: (tx_hash, n, v, asset, is_cb)}, outputs received
+        self._received_coins = defaultdict(dict)
+        # address -> {ser: spending tx_hash}, outputs spent per txi
+        self._spent_coins = defaultdict(dict)
+        # address -> asset -> {ser: (tx_hash, n, v, asset, is_cb)}, received and not spent
+        self._utxos = defaultdict(lambda: defaultdict(dict))
+        # address -> set(ser) of received coinbase outputs
+        self._coinbase_coins = defaultdict(set)
+        # address -> {tx_hash: {asset: net value}}, coinbase outputs excluded
+        self._tx_net = defaultdict(dict)
+        # address -> {asset: [confirmed, unconfirmed]} sums of _tx_net
+        self._balances = defaultdict(dict)
+        # tx_hash -> whether its _tx_net is counted as confirmed
+        self._tx_confirmed = {}
+        with self.transaction_lock:
+            for txid in itertools.chain(self.txi, self.txo):
+                self._add_tx_to_utxo_index(txid)
+
+    def _add_tx_net(self, addr, txid, coin, sign):
+        if txid not in self._tx_confirmed:
+            self._tx_confirmed[txid] = self.get_tx_height(txid).height > 0
+        asset, delta = coin[3], sign * coin[2]
+        nets = self._tx_net[addr].setdefault(txid, {})
+        net = nets.get(asset, 0) + delta
+        if net:
+            nets[asset] = net
+        else:
+            nets.pop(asset, None)
+            if not nets:
+                self._tx_net[addr].pop(txid)
+        self._add_balance(addr, asset, self._tx_confirmed[txid], delta)
+
+    def _add_balance(self, addr, asset, confirmed, delta):
+        balances = self._balances[addr]
+        balance = balances.setdefault(asset, [0, 0])
+        balance[0 if confirmed else 1] += delta
+        if balance == [0, 0]:
+            balances.pop(asset)
+
+    def _add_utxo(self, addr, ser, coin):
+        self._utxos[addr][coin[3]][ser] = coin
+
+    def _remove_utxo(self, addr, ser, coin):
+        utxos = self._utxos[addr]
+        utxos[coin[3]].pop(ser, None)
+        if not utxos[coin[3]]:
+            utxos.pop(coin[3])
+
+    def _add_tx_to_utxo_index(self, txid):
+        with self.transaction_lock:
+            for addr, outputs in self.txo.get(txid, {}).items():
+                received = self._received_coins[addr]
+                spent = self._spent_coins[addr]
+                for n, v, a, is_cb, scriptPubKey in outputs:
+                    ser = txid + ':%d' % n
+                    if ser in received:
+                        continue
+                    received[ser] = coin = (txid, n, v, a, is_cb)
+                    if is_cb:
+                        self._coinbase_coins[addr].add(ser)
+                    else:
+                        self._add_tx_net(addr, txid, coin, 1)
+                    if ser in spent:
+                        self._add_tx_net(addr, spent[ser], coin, -1)
+                    else:
+                        self._add_utxo(addr, ser, coin)
+            for addr, inputs in self.txi.get(txid, {}).items():
+                received = self._received_coins[addr]
+                spent = self._spent_coins[addr]
+                for ser, v, a in inputs:
+                    if spent.get(ser) == txid:
+                        continue
+                    coin = received.get(ser)
+                    if coin is not None:
+                        if ser in spent:
+                            self._add_tx_net(addr, spent[ser], coin, 1)
+                        else:
+                            self._remove_utxo(addr, ser, coin)
+                        self._add_tx_net(addr, txid, coin, -1)
+                    spent[ser] = txid
+
+    def _remove_tx_from_utxo_index(self, txid):
+        with self.transaction_lock:
+            for addr, inputs in self.txi.get(txid, {}).items():
+                received = self._received_coins[addr]
+                spent = self._spent_coins[addr]
+                for ser, v, a in inputs:
+                    if spent.get(ser) != txid:
+                        continue
+                    spent.pop(ser)
+                    coin = received.get(ser)
+                    if coin is not None:
+                        self._add_tx_net(addr, txid, coin, 1)
+                        self._add_utxo(addr, ser, coin)
+            for addr, outputs in self.txo.get(txid, {}).items():
+                received = self._received_coins[addr]
+                spent = self._spent_coins[addr]
+                for n, v, a, is_cb, scriptPubKey in outputs:
+                    ser = txid + ':%d' % n
+                    coin = received.pop(ser, None)
+                    if coin is None:
+                        continue
+                    if is_cb:
+                        self._coinbase_coins[addr].discard(ser)
+                    else:
+                        self._add_tx_net(addr, txid, coin, -1)
+                    if ser in spent:
+                        self._add_tx_net(addr, spent[ser], coin, 1)
+                    else:
+                        self._remove_utxo(addr, ser, coin)
+
+    def _update_tx_confirmed(self, txid):
+        '''Moves the balance effect of txid after its height changed.'''
+        with self.transaction_lock:
+            was_confirmed = self._tx_confirmed.get(txid)
+            if was_confirmed is None:
+                return
+            confirmed = self.get_tx_height(txid).height > 0
+            if confirmed == was_confirmed:
+                return
+            self._tx_confirmed[txid] = confirmed
+            for addr in set(itertools.chain(self.txi.get(txid, []), self.txo.get(txid, []))):
+                for asset, net in self._tx_net[addr].get(txid, {}).items():
+                    self._add_balance(addr, asset, was_confirmed, -net)
+                    self._add_balance(addr, asset, confirmed, net)
+
     def add_unverified_tx(self, tx_hash, tx_height):
+        if tx_hash in self.verified_tx and tx_height not in (TX_HEIGHT_UNCONFIRMED, TX_HEIGHT_UNCONF_PARENT):
+            # nothing to do; this also avoids parsing every tx on startup
+            return
         tx = self.transactions.get(tx_hash)
         if tx:
             if tx.is_whitelist():
@@ -600,12 +760,14 @@ class AddressSynchronizer(PrintError):
             if tx_height in (TX_HEIGHT_UNCONFIRMED, TX_HEIGHT_UNCONF_PARENT):
                 with self.lock:
                     self.verified_tx.pop(tx_hash)
+                    self._update_tx_confirmed(tx_hash)
                 if self.verifier:
                     self.verifier.remove_spv_proof_for_tx(tx_hash)
         else:
             with self.lock:
                 # tx will be verified only if height > 0
                 self.unverified_tx[tx_hash] = tx_height
+                self._update_tx_confirmed(tx_hash)
             # to remove pending proof requests:
             if self.verifier:
                 self.verifier.remove_spv_proof_for_tx(tx_hash)
@@ -615,30 +777,10 @@ class AddressSynchronizer(PrintError):
         with self.lock:
             self.unverified_tx.pop(tx_hash, None)
             self.verified_tx[tx_hash] = info
+            self._update_tx_confirmed(tx_hash)
         tx_mined_status = self.get_tx_height(tx_hash)
         self.network.trigger_callback('verified', tx_hash, tx_mined_status)
 
-    def add_unassigned_kyc_pubkey(self, key: str, outpoint: TxOutPoint):
-        # Remove from the unverified map and add to the verified map
-        with self.lock:
-            self.unassigned_kyc_pubkeys.pop(key, None)
-            self.unassigned_kyc_pubkeys[key] = outpoint
-            self.set_up_to_date(False)
-
-    def remove_unassigned_kyc_pubkey(self, key: str = None, outpoint: TxOutPoint = None):
-        with self.lock:
-            if key and outpoint:
-                return
-            if key:
-                self.unassigned_kyc_pubkeys.pop(key, None)
-            elif outpoint:
-                for k in self.unassigned_kyc_pubkeys:
-                    o = self.unassigned_kyc_pubkeys[k]
-                    if o == outpoint:
-                        if o.txid == outpoint.txid and o.n == outpoint.n:
-                            self.unassigned_kyc_pubkeys.pop(k, None)
-            self.set_up_to_date(False)
-        
     def get_unverified_txs(self):
         '''Returns a map from tx hash to transaction height'''
         with self.lock:
@@ -664,6 +806,7 @@ class AddressSynchronizer(PrintError):
                         # into unverified_tx with the old height, and if we get
                         # a status update, that will overwrite it.
                         self.unverified_tx[tx_hash] = tx_height
+                        self._update_tx_confirmed(tx_hash)
                         txs.add(tx_hash)
         return txs
 
@@ -697,7 +840,6 @@ class AddressSynchronizer(PrintError):
             # otherwise it will persist its results when it finishes
             if self.verifier and self.verifier.is_up_to_date():
                 self.save_verified_tx(write=True)
-                self.save_unassigned_kyc_pubkeys(write=True)
 
     def is_up_to_date(self):
         with self.lock: return self.up_to_date
@@ -730,56 +872,6 @@ class AddressSynchronizer(PrintError):
                 delta += v
         return delta
 
-    # Parse policy transactions, e.g. whitelist token transactions.
-    def parse_whitelist_tx(self, tx):
-        data = []
-        datatype = None
-        v_out=0
-
-        for txin in tx.inputs():
-            addr = self.get_txin_address(txin)
-            #Check inputs for address data (unassign)
-            prevout_hash=txin['prevout_hash']
-            d = self.txo.get(prevout_hash, {}).get(addr, [])
-            prevout_n=txin['prevout_n']
-            for n, v, a, cb, scriptPubKey in d:
-                if n == prevout_n:
-                    if a == constants.net.WHITELISTASSET:
-                        op = TxOutPoint(prevout_hash, prevout_n)
-                        self.remove_unassigned_kyc_pubkey(outpoint=op)
-
-        #Check outputs for address data (assign)
-        addresses = set()
-        n_output=-1
-        for output in tx.outputs():
-            n_output=n_output+1
-            script = output.scriptPubKey
-            if output.asset != constants.net.WHITELISTASSET:
-                continue
-            if output.type == transaction.TYPE_ADDRESS or  output.type == transaction.TYPE_PUBKEY:
-                if output.address != constants.net.WHITELISTCOINSADDRESS:
-                    if not self.is_mine(output.address):
-                        self.add_whitelist_address(output.address)
-                
-            datatype, payload = transaction.get_data_from_policy_output_script(bfh(script))
-            
-            if datatype != TYPE_DATA:
-                continue
-            #Reverse after this number of bytes
-            nrev=3
-            if len(payload) > nrev:   
-                data=bytes(32)
-                ba1=bytearray(payload[:nrev])
-                ba2=bytearray(payload[nrev:])
-                ba2.reverse()
-                data = bh2u(ba1+ba2)
-
-            outpoint = TxOutPoint(tx.txid(), n_output)    
-            self.add_unassigned_kyc_pubkey(data, outpoint)
-
-        return (datatype==TYPE_DATA)
-
-
     def get_wallet_delta(self, tx):
         """ effect of tx on wallet """
         is_relevant = False  # "related to wallet?"
@@ -792,13 +884,8 @@ class AddressSynchronizer(PrintError):
             if self.is_mine(addr):
                 is_mine = True
                 is_relevant = True
-                d = self.txo.get(txin['prevout_hash'], {}).get(addr, [])
-                for n, v, a, cb, scriptPubKey in d:
-                    if n == txin['prevout_n']:
-                        value = v
-                        break
-                else:
-                    value = None
+                prevout = self.txo.get_output(txin['prevout_hash'], txin['prevout_n'])
+                value = prevout[1] if prevout and prevout[0] == addr else None
                 if value is None:
                     is_pruned = True
                 else:
@@ -846,56 +933,68 @@ class AddressSynchronizer(PrintError):
                 sent[txi] = height
         return received, sent
 
-    def get_addr_utxo(self, address):
-        coins, spent = self.get_addr_io(address)
-        for txi in spent:
-            coins.pop(txi)
+    def get_addr_utxo(self, address, asset=None):
         out = {}
-        for txo, v in coins.items():
-            tx_height, value, asset, is_cb = v
-            prevout_hash, prevout_n = txo.split(':')
-            x = {
-                'address':address,
-                'value':value,
-                'asset': asset,
-                'prevout_n':int(prevout_n),
-                'prevout_hash':prevout_hash,
-                'height':tx_height,
-                'coinbase':is_cb,
-                'issuance': None
-            }
-            out[txo] = x
+        with self.lock, self.transaction_lock:
+            utxos = self._utxos.get(address, {})
+            if asset is None:
+                coins = itertools.chain.from_iterable(d.items() for d in utxos.values())
+            else:
+                coins = utxos.get(asset, {}).items()
+            for txo, (prevout_hash, prevout_n, value, asset_id, is_cb) in coins:
+                x = {
+                    'address':address,
+                    'value':value,
+                    'asset': asset_id,
+                    'prevout_n':prevout_n,
+                    'prevout_hash':prevout_hash,
+                    'height':self.get_tx_height(prevout_hash).height,
+                    'coinbase':is_cb,
+                    'issuance': None
+                }
+                out[txo] = x
         return out
 
     # return the total amount ever received by an address
     def get_addr_received(self, address):
-        received, sent = self.get_addr_io(address)
-        return sum([v for height, v, a, is_cb in received.values()])
+        with self.transaction_lock:
+            return sum([coin[2] for coin in self._received_coins.get(address, {}).values()])
 
     @with_local_height_cached
+    def get_addr_asset_balance(self, address):
+        """Return the balance of a bitcoin address per asset:
+        asset -> (confirmed and matured, unconfirmed, unmatured)
+        """
+        with self.lock, self.transaction_lock:
+            out = {asset: [c, u, 0] for asset, (c, u) in self._balances.get(address, {}).items()}
+            # coinbase outputs move between buckets as the chain grows
+            received = self._received_coins.get(address, {})
+            local_height = self.get_local_height()
+            for txo in self._coinbase_coins.get(address, ()):
+                tx_hash, n, v, asset, is_cb = received[txo]
+                tx_height = self.get_tx_height(tx_hash).height
+                balance = out.setdefault(asset, [0, 0, 0])
+                if tx_height + COINBASE_MATURITY > local_height:
+                    balance[2] += v
+                elif tx_height > 0:
+                    balance[0] += v
+                else:
+                    balance[1] += v
+        return {asset: tuple(balance) for asset, balance in out.items()}
+
     def get_addr_balance(self, address):
         """Return the balance of a bitcoin address:
         confirmed and matured, unconfirmed, unmatured
         """
-        received, sent = self.get_addr_io(address)
         c = u = x = 0
-        local_height = self.get_local_height()
-        for txo, (tx_height, v, a, is_cb) in received.items():
-            if is_cb and tx_height + COINBASE_MATURITY > local_height:
-                x += v
-            elif tx_height > 0:
-                c += v
-            else:
-                u += v
-            if txo in sent:
-                if sent[txo] > 0:
-                    c -= v
-                else:
-                    u -= v
+        for cc, uu, xx in self.get_addr_asset_balance(address).values():
+            c += cc
+            u += uu
+            x += xx
         return c, u, x
 
     @with_local_height_cached
-    def get_utxos(self, domain=None, excluded=None, mature=False, confirmed_only=False):
+    def get_utxos(self, domain=None, excluded=None, mature=False, confirmed_only=False, asset=None):
         coins = []
         if domain is None:
             domain = self.get_addresses()
@@ -903,7 +1002,7 @@ class AddressSynchronizer(PrintError):
         if excluded:
             domain = set(domain) - excluded
         for addr in domain:
-            utxos = self.get_addr_utxo(addr)
+            utxos = self.get_addr_utxo(addr, asset)
             for x in utxos.values():
                 if confirmed_only and x['height'] <= 0:
                     continue
@@ -913,6 +1012,7 @@ class AddressSynchronizer(PrintError):
                 continue
         return coins
 
+    @with_local_height_cached
     def get_balance(self, domain=None):
         if domain is None:
             domain = self.get_addresses()
@@ -925,6 +1025,20 @@ class AddressSynchronizer(PrintError):
             xx += x
         return cc, uu, xx
 
+    @with_local_height_cached
+    def get_asset_balance(self, domain=None):
+        """Return asset -> (confirmed, unconfirmed, unmatured) over domain."""
+        if domain is None:
+            domain = self.get_addresses()
+        domain = set(domain)
+        out = defaultdict(lambda: [0, 0, 0])
+        for addr in domain:
+            for asset, balance in self.get_addr_asset_balance(addr).items():
+                total = out[asset]
+                for i in range(3):
+                    total[i] += balance[i]
+        return {asset: tuple(balance) for asset, balance in out.items()}
+
     def is_used(self, address):
         h = self.history.get(address,[])
         return len(h) != 0
@@ -0,0 +1,230 @@
+# Electrum - lightweight Ocean client
+# Copyright (C) 2018 The Electrum Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import base64
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from threading import Thread
+
+import requests
+
+from . import bitcoin, constants, ecc
+from .util import ThreadJob, make_dir
+
+
+# seconds before a failed mapping request is retried
+MAPPING_RETRY_INTERVAL = 150
+# seconds before a fetched mapping is fetched again
+MAPPING_REFRESH_INTERVAL = 600
+
+
+class AssetMapping(ThreadJob):
+    """The asset mapping published by the controllers, which maps token
+    ids to physical assets.
+
+    The mapping is fetched in a thread at startup, whenever the
+    mapping_hash of the current header changes, and every
+    MAPPING_REFRESH_INTERVAL, and its signatures are checked once per
+    fetch. The mapping cannot be checked against mapping_hash, so the
+    verified mappings cached on disk by mapping_hash are only used when
+    the first fetch of a session fails. Once a mapping is verified, a
+    failed or unverified refresh keeps it, along with its status, until
+    reset(). Listeners are notified with the 'asset_mapping' network
+    callback.
+    """
+
+    def __init__(self, config, network):
+        self.config = config
+        self.network = network
+        self.cache_dir = os.path.join(config.path, 'cache')
+        make_dir(self.cache_dir)
+        self.lock = threading.Lock()
+        # None until the first attempt, then 'connected' or the error
+        self.status = None
+        self.verified = False
+        self.mapping_hash = None  # of the current mapping
+        self.requested = False  # a request is in flight
+        self.refresh_time = 0  # of the next fetch for the same mapping_hash
+        self.amap = {}
+        self.by_tokenid = {}  # tokenid -> [entries], in mapping order
+        self.mass_by_ref = {}  # ref -> total mass
+
+    def is_enabled(self):
+        return bool(self.config.get('get_map'))
+
+    def get_url(self):
+        return self.config.get('mapping_url', constants.net.MAPPING_URL)
+
+    def reset(self):
+        """Fetch the mapping again, e.g. after the url changed."""
+        with self.lock:
+            self.status = None
+            self.verified = False
+            self.refresh_time = 0
+
+    def get_header_mapping_hash(self):
+        if not self.network:
+            return None
+        header = self.network.blockchain().read_header(self.network.get_local_height())
+        return header.get('mapping_hash') if header else None
+
+    def run(self):
+        if not self.is_enabled():
+            return
+        mapping_hash = self.get_header_mapping_hash()
+        with self.lock:
+            if self.requested:
+                return
+            if (self.status is not None and mapping_hash == self.mapping_hash
+                    and time.time() < self.refresh_time):
+                return
+            self.requested = True
+        t = Thread(target=self.update_safe, args=(mapping_hash,))
+        t.setDaemon(True)
+        t.start()
+
+    def cache_path(self, mapping_hash):
+        return os.path.join(self.cache_dir, 'asset_mapping_' + mapping_hash)
+
+    def read_cache(self, mapping_hash):
+        if not mapping_hash:
+            return None
+        try:
+            with open(self.cache_path(mapping_hash), 'r', encoding='utf-8') as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def write_cache(self, mapping_hash, amap):
+        if not mapping_hash:
+            return
+        try:
+            with open(self.cache_path(mapping_hash), 'w', encoding='utf-8') as f:
+                f.write(json.dumps(amap))
+        except OSError as e:
+            self.print_error('cannot save asset mapping', e)
+
+    def fetch(self):
+        try:
+            r = requests.request('GET', self.get_url(), timeout=10)
+            r.raise_for_status()
+        except requests.exceptions.HTTPError:
+            return None, 'http_error'
+        except requests.exceptions.ConnectionError:
+            return None, 'connection_error'
+        except requests.exceptions.Timeout:
+            return None, 'timeout_error'
+        except requests.exceptions.RequestException:
+            return None, 'request_exception'
+        try:
+            return r.json(), 'connected'
+        except ValueError:
+            return None, 'json_error'
+
+    def update_safe(self, mapping_hash):
+        try:
+            self.print_error("requesting asset mapping")
+            amap, status = self.fetch()
+            verified = amap is not None and self.verify_mapping_sig(amap)
+            if verified:
+                self.write_cache(mapping_hash, amap)
+            elif status != 'connected' and self.status is None:
+                # offline at startup: fall back to the last verified mapping
+                cached = self.read_cache(mapping_hash)
+                if cached is not None:
+                    amap, status, verified = cached, 'connected', True
+            self.print_error("asset mapping", status, "verified" if verified else "not verified")
+            with self.lock:
+                self.mapping_hash = mapping_hash
+                if self.verified and not verified:
+                    # a refresh failed, keep the verified mapping
+                    self.refresh_time = time.time() + MAPPING_RETRY_INTERVAL
+                    return
+                self.status = status
+                self.verified = verified
+                if status == 'connected':
+                    self.set_mapping(amap)
+                    self.refresh_time = time.time() + MAPPING_REFRESH_INTERVAL
+                else:
+                    self.refresh_time = time.time() + MAPPING_RETRY_INTERVAL
+        finally:
+            with self.lock:
+                self.requested = False
+        if self.network:
+            self.network.trigger_callback('asset_mapping')
+
+    def set_mapping(self, amap):
+        by_tokenid = defaultdict(list)
+        mass_by_ref = defaultdict(float)
+        if isinstance(amap, dict) and isinstance(amap.get("assets"), dict):
+            for entry in amap["assets"].values():
+                by_tokenid[entry["tokenid"]].append(entry)
+                mass_by_ref[entry["ref"]] += entry["mass"]
+        self.amap = amap
+        self.by_tokenid = dict(by_tokenid)
+        self.mass_by_ref = dict(mass_by_ref)
+
+    @classmethod
+    def verify_mapping_sig(cls, amap):
+        try:
+            nsig = len(amap["sigs"])
+            if nsig < amap["n"]:
+                return False
+            jsonstring = json.dumps(amap["assets"],sort_keys=True)
+            jsonstring += str(amap["n"]) + str(amap["m"]) + str(amap["time"]) + str(amap["height"])
+            sigs = [base64.b64decode(j) for j in amap["sigs"].values()]
+        except Exception:
+            return False
+        message = jsonstring.encode('utf-8')
+        controller_pubkeys = [constants.net.CONTROLER1, constants.net.CONTROLER2, constants.net.CONTROLER3]
+        nvalid = 0
+        for key in controller_pubkeys:
+            address = bitcoin.pubkey_to_address('p2pkh', key)
+            for sig in sigs:
+                if ecc.verify_message_with_address(address, sig, message):
+                    nvalid += 1
+        return nvalid >= amap["n"]
+
+    def get_mass_assetid(self, ref):
+        return self.mass_by_ref.get(ref, 0.0)
+
+    def get_owned_assets(self, asset_balance, tokrat):
+        """Returns [(ref, total mass, owned tokens)] of the assets the
+        tokens in asset_balance ({tokenid: amount}) are allocated to."""
+        with self.lock:
+            ownassets = {}
+            for tokenid, amount in asset_balance.items():
+                tokens = float(amount)
+                for j in self.by_tokenid.get(tokenid, []):
+                    if j["ref"] in ownassets:
+                        ownassets[j["ref"]] += tokens
+                    else:
+                        ownassets[j["ref"]] = tokens
+                    if j["mass"] < tokens*tokrat/1.0E+8:
+                        tokens -= j["mass"]*1.0E+8/tokrat
+                    else:
+                        tokens = 0
+            return [(ref, self.get_mass_assetid(ref), owned) for ref, owned in ownassets.items()]
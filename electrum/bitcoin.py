@@ -629,18 +629,38 @@ def CKD_pub(cK, c, n):
 # note: 's' does not need to fit into 32 bits here! (c.f. trustedcoin billing)
 def _CKD_pub(cK, c, s):
     I = hmac_oneshot(c, cK + s, hashlib.sha512)
-    pubkey = ecc.ECPrivkey(I[0:32]) + ecc.ECPubkey(cK)
-    if pubkey.is_at_infinity():
+    I_left = ecc.string_to_number(I[0:32])
+    if not ecc.is_secret_within_curve_range(I_left):
         raise ecc.InvalidECPointException()
-    cK_n = pubkey.get_public_key_bytes(compressed=True)
+    cK_n, = ecc.pubkey_tweak_add(cK, [I_left])
     c_n = I[32:]
     return cK_n, c_n
 
+def CKD_pub_range(cK, c, start, end, tweak: bytes=None):
+    """Public keys of the non-hardened children start..end-1 of (cK, c).
+    If tweak is given, it is added to every child key as in tweak_pub,
+    within the same point operation."""
+    if start < 0: raise ValueError('the bip32 index needs to be non-negative')
+    if end > BIP32_PRIME: raise Exception()
+    tweak_num = 0
+    if tweak is not None:
+        tweak_num = ecc.string_to_number(tweak)
+        if not ecc.is_secret_within_curve_range(tweak_num):
+            raise ecc.InvalidECPointException()
+    scalars = []
+    for n in range(start, end):
+        I = hmac_oneshot(c, cK + n.to_bytes(4, 'big'), hashlib.sha512)
+        I_left = ecc.string_to_number(I[0:32])
+        if not ecc.is_secret_within_curve_range(I_left):
+            raise ecc.InvalidECPointException()
+        scalars.append((I_left + tweak_num) % ecc.CURVE_ORDER)
+    return ecc.pubkey_tweak_add(cK, scalars)
+
 def tweak_pub(cK, tweak: bytes):
-    pubkey = ecc.ECPrivkey(tweak) + ecc.ECPubkey(cK)
-    if pubkey.is_at_infinity():
+    tweak_num = ecc.string_to_number(tweak)
+    if not ecc.is_secret_within_curve_range(tweak_num):
         raise ecc.InvalidECPointException()
-    cK_n = pubkey.get_public_key_bytes(compressed=True)
+    cK_n, = ecc.pubkey_tweak_add(cK, [tweak_num])
     return cK_n
 
 
@@ -21,8 +21,13 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import os
+import sys
+import json
+import mmap
 import threading
 import struct
+from array import array
+from collections import OrderedDict
 
 from . import util
 from .bitcoin import Hash, hash_encode, int_to_hex, rev_hex, op_push
@@ -33,6 +38,7 @@ from . import ecc
 from pprint import pprint
 
 MAX_TARGET = 0x00000000FFFF0000000000000000000000000000000000000000000000000000
+HEADER_CACHE_SIZE = 2 * 2016
 
 
 class MissingHeader(Exception):
@@ -48,85 +54,137 @@ class InvalidFile(Exception):
         super().__init__(*messages)
         self.filename = filename
 
-def serialize_header(res, get_hash = False):
-    s = int_to_hex(res.get('version'), 4) \
-        + rev_hex(res.get('prev_block_hash')) \
-        + rev_hex(res.get('merkle_root')) \
-        + rev_hex(res.get('contract_hash'))
-
-    s += rev_hex(res.get('attestation_hash'))
-    s += rev_hex(res.get('mapping_hash'))
-
-    s += int_to_hex(int(res.get('timestamp')), 4) +\
-         int_to_hex(int(res.get('block_height')), 4)
-
-    challenge = res.get('challenge')
-    s += int_to_hex(int(len(challenge)/2), 1) + rev_hex(challenge)
+def int_to_bytes(i, length):
+    """Little-endian bytes of i, accepting the same range as int_to_hex."""
+    if not isinstance(i, int):
+        raise TypeError('{} instead of int'.format(i))
+    return i.to_bytes(length, 'little', signed=i < 0)
+
+def serialize_header_bytes(res, get_hash = False):
+    challenge = bfh(res.get('challenge'))
+    s = b''.join((
+        int_to_bytes(res.get('version'), 4),
+        bfh(res.get('prev_block_hash'))[::-1],
+        bfh(res.get('merkle_root'))[::-1],
+        bfh(res.get('contract_hash'))[::-1],
+        bfh(res.get('attestation_hash'))[::-1],
+        bfh(res.get('mapping_hash'))[::-1],
+        int_to_bytes(int(res.get('timestamp')), 4),
+        int_to_bytes(int(res.get('block_height')), 4),
+        int_to_bytes(len(challenge), 1),
+        challenge[::-1],
+    ))
 
     if not get_hash:
-        proof = res.get('proof')
-        s += int_to_hex(int(len(proof)/2), 1) + rev_hex(proof)
+        proof = bfh(res.get('proof'))
+        s += int_to_bytes(len(proof), 1) + proof[::-1]
 
     return s
 
+def serialize_header(res, get_hash = False):
+    return bh2u(serialize_header_bytes(res, get_hash))
+
+def header_size(s, offset=0):
+    """Length of the serialized header starting at offset in s."""
+    pos = offset + constants.net.BASIC_HEADER_SIZE
+    challenge_size = s[pos]
+    # a header without challenge is re-serialized with an empty proof
+    proof_size = s[pos + 1 + challenge_size] if challenge_size > 0 else 0
+    return constants.net.BASIC_HEADER_SIZE + 1 + challenge_size + 1 + proof_size
+
 def deserialize_headers(s, height):
     headers = []
-    # s is bytes format
-    # use deserialize_header to pick up the next header
-    # use serialize_header to find the header length
-    while s:
-        next_header = deserialize_header(s, height)
+    # single pass over the chunk: header lengths are read from the
+    # challenge and proof size bytes, without re-serializing
+    s = memoryview(s)
+    offset = 0
+    while offset < len(s):
+        next_header = deserialize_header(s[offset:], height)
         headers.append(next_header)
-        s = s[int(len(serialize_header(next_header))/2):]
+        offset += header_size(s, offset)
         height += 1
 
     return headers
 
+# parsed challenge scripts: challenge hex -> (m, [ECPubkey]).
+# Only scripts matching constants.net.CHALLENGE get here, so this stays small.
+challenge_keys = {}
+
+def get_challenge_keys(challenge):
+    keys = challenge_keys.get(challenge)
+    if keys is None:
+        m, n, x_pubkeys, pubkeys, redeem_script = parse_redeemScript_multisig(bfh(challenge))
+        keys = m, [ecc.ECPubkey(bfh(pubkey)) for pubkey in pubkeys]
+        challenge_keys[challenge] = keys
+    return keys
+
+def verify_sig(public_key, sig_string, msg_hash):
+    try:
+        public_key.verify_message_hash(sig_string, msg_hash)
+        return True
+    except Exception:
+        return False
+
+def count_verified_sigs(signatures, public_keys, msg_hash):
+    """Number of signatures matching distinct keys.
+
+    Signatures are expected in key order, as for OP_CHECKMULTISIG, which
+    needs at most one verification per key. Proofs with signatures out
+    of order fall back to trying every remaining key.
+    """
+    nverified = 0
+    i = 0
+    for sig_string in signatures:
+        while i < len(public_keys):
+            i += 1
+            if verify_sig(public_keys[i - 1], sig_string, msg_hash):
+                nverified += 1
+                break
+        else:
+            break
+    if nverified == len(signatures):
+        return nverified
+    keyfound = set()
+    nverified = 0
+    for sig_string in signatures:
+        for j, public_key in enumerate(public_keys):
+            if j in keyfound:
+                continue
+            if verify_sig(public_key, sig_string, msg_hash):
+                keyfound.add(j)
+                nverified += 1
+                break
+    return nverified
+
 def verify_header_proof(h):
-    rproof = h['proof']
-    rchallenge = h['challenge']
-    proof = "".join(reversed([rproof[i:i+2] for i in range(0, len(rproof), 2)]))
-    challenge = "".join(reversed([rchallenge[i:i+2] for i in range(0, len(rchallenge), 2)]))
+    proof = bfh(h['proof'])[::-1]
+    challenge = bh2u(bfh(h['challenge'])[::-1])
     if challenge != constants.net.CHALLENGE[h['block_height']]:
         print_error("challenge script mismatch:", challenge)
         return False
 
     try:
-        m, n, x_pubkeys, pubkeys, redeem_script = parse_redeemScript_multisig(bytearray.fromhex(challenge))
+        m, public_keys = get_challenge_keys(challenge)
     except:
         print_error("could not retrieve redeem script params")
         return False
 
-    signatures = []
     try:
-        decoded = [ x for x in script_GetOp(bytearray.fromhex(proof)) ]
+        decoded = [ x for x in script_GetOp(proof) ]
     except struct.error:
         print_error("could not decode proof in binary format")
         return False
 
-    for element in decoded[1:]:
-        signatures.append(element[1])
-
-    rhhash = hash_header(h)
-    hhash = "".join(reversed([rhhash[i:i+2] for i in range(0, len(rhhash), 2)]))
+    try:
+        signatures = [ecc.sig_string_from_der_sig(element[1]) for element in decoded[1:]]
+    except Exception:
+        print_error("could not decode proof signatures")
+        return False
 
-    keyfound = []
-    nverified = 0
-    #loop over each signature and then check each pubkey in turn
-    for sig in signatures:
-        sig_string = ecc.sig_string_from_der_sig(sig)
-        for pubkey in pubkeys:
-            if pubkey in keyfound: continue
-            pubpoint = ecc.ser_to_point(bytes.fromhex(pubkey))
-            public_key = ecc.ECPubkey.from_point(pubpoint)
-            try:
-                public_key.verify_message_hash(sig_string, bytes.fromhex(hhash))
-                keyfound.append(pubkey)
-                nverified += 1
-            except:
-                pass
-        if nverified >= m: 
-            return True
+    hhash = bfh(hash_header(h))[::-1]
+    nverified = count_verified_sigs(signatures, public_keys, hhash)
+    if nverified >= m:
+        return True
 
     print_error("not enough signatures:", nverified, "required", m)
 
@@ -137,29 +195,29 @@ def deserialize_header(s, height):
         raise InvalidHeader('Invalid header: {}'.format(s))
     if len(s) < constants.net.MIN_HEADER_SIZE:
         raise InvalidHeader('Invalid header length: {}'.format(len(s)))
-    hex_to_int = lambda s: int('0x' + bh2u(s[::-1]), 16)
+    basic_size = constants.net.BASIC_HEADER_SIZE
+    s = memoryview(s)
     h = {}
-    h['version'] = hex_to_int(s[0:4])
-    h['prev_block_hash'] = hash_encode(s[4:36])
-    h['merkle_root'] = hash_encode(s[36:68])
-    h['contract_hash'] = hash_encode(s[68:100])
+    h['version'] = struct.unpack_from('<I', s, 0)[0]
+    h['prev_block_hash'] = hash_encode(bytes(s[4:36]))
+    h['merkle_root'] = hash_encode(bytes(s[36:68]))
+    h['contract_hash'] = hash_encode(bytes(s[68:100]))
 
-    h['attestation_hash'] = hash_encode(s[100:132])
-    h['mapping_hash'] = hash_encode(s[132:164])
+    h['attestation_hash'] = hash_encode(bytes(s[100:132]))
+    h['mapping_hash'] = hash_encode(bytes(s[132:164]))
 
-    h['timestamp'] = hex_to_int(s[constants.net.BASIC_HEADER_SIZE-8:constants.net.BASIC_HEADER_SIZE-4])
+    h['timestamp'] = struct.unpack_from('<I', s, basic_size - 8)[0]
     h['block_height'] = height
 
     challenge = ''
     proof = ''
-    challenge_size = s[constants.net.BASIC_HEADER_SIZE]
+    challenge_size = s[basic_size]
     if challenge_size > 0:
-        challenge = hash_encode(s[constants.net.BASIC_HEADER_SIZE+1:
-                        constants.net.BASIC_HEADER_SIZE+1+challenge_size])
-        proof_size = s[constants.net.BASIC_HEADER_SIZE+1+challenge_size]
+        challenge = hash_encode(bytes(s[basic_size+1:basic_size+1+challenge_size]))
+        proof_size = s[basic_size+1+challenge_size]
         if proof_size > 0:
-            proof = hash_encode(s[constants.net.BASIC_HEADER_SIZE+1+challenge_size+1:
-                                        constants.net.BASIC_HEADER_SIZE+1+challenge_size+1+proof_size])
+            proof = hash_encode(bytes(s[basic_size+1+challenge_size+1:
+                                        basic_size+1+challenge_size+1+proof_size]))
     h['challenge'] = challenge
     h['proof'] = proof
 
@@ -170,27 +228,160 @@ def hash_header(header):
         return '0' * 64
     if header.get('prev_block_hash') is None:
         header['prev_block_hash'] = '00'*32
-    return hash_encode(Hash(bfh(serialize_header(header, True))))
+    return hash_encode(Hash(serialize_header_bytes(header, True)))
 
 
 blockchains = {}
 
+# The headers of the branches are kept in segments. A segment holds
+# consecutive headers from its base height on, in a headers file with a
+# file of their end offsets next to it. Segment 0 is the original
+# blockchain_headers/headers_offset pair, the others are in the forks
+# directory. A branch is a list of extents [segment, start, end) covering
+# its heights; the last one is open (end None) and runs to the end of its
+# segment, so headers are appended without touching anything else.
+# The extents of all branches are listed in the manifest, which is
+# replaced atomically. A fork swap only moves extents from one branch to
+# the other and rewrites the manifest: no header is copied.
+segment_bases = {0: 0}
+
+# in-memory views of the header files, keyed by path and shared by all branches:
+# the offset file is loaded into an array of little-endian uint64,
+# the headers file is memory-mapped. Both are dropped whenever the file
+# is rewritten outside of write()/write_offset().
+header_offsets = {}
+header_maps = {}
+header_files_lock = threading.RLock()
+
+def read_offset_file(path):
+    offsets = array('Q')
+    assert offsets.itemsize == 8
+    with open(path, 'rb') as f:
+        data = f.read()
+    offsets.frombytes(data[:len(data) - len(data) % 8])
+    if sys.byteorder != 'little':
+        offsets.byteswap()
+    return offsets
+
+def offsets_to_bytes(offsets):
+    if sys.byteorder != 'little':
+        offsets = array('Q', offsets)
+        offsets.byteswap()
+    return offsets.tobytes()
+
+def map_headers_file(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def release_header_map(path):
+    with header_files_lock:
+        m = header_maps.pop(path, None)
+        if isinstance(m, mmap.mmap):
+            m.close()
+
+def release_header_file(path):
+    with header_files_lock:
+        header_offsets.pop(path, None)
+        release_header_map(path)
+
+def segment_path(config, segment):
+    d = util.get_headers_dir(config)
+    filename = 'blockchain_headers' if segment == 0 else os.path.join('forks', 'segment_%d' % segment)
+    return os.path.join(d, filename)
+
+def segment_offset_path(config, segment):
+    d = util.get_headers_dir(config)
+    filename = 'headers_offset' if segment == 0 else os.path.join('forks', 'segment_%d_offset' % segment)
+    return os.path.join(d, filename)
+
+def manifest_path(config):
+    return os.path.join(util.get_headers_dir(config), 'forks', 'manifest')
+
+def new_segment(config, base):
+    with header_files_lock:
+        segment = max(segment_bases) + 1
+        segment_bases[segment] = base
+        with open(segment_path(config, segment), 'wb'):
+            pass
+        with open(segment_offset_path(config, segment), 'wb') as f:
+            f.write(bytes(8))
+        return segment
+
+def merge_extents(extents):
+    """Joins the consecutive extents of the same segment."""
+    merged = []
+    for e in extents:
+        if merged and merged[-1][0] == e[0] and merged[-1][2] == e[1]:
+            merged[-1][2] = e[2]
+        else:
+            merged.append(list(e))
+    return merged
+
+def write_manifest(config):
+    """Saves the extents of all branches, then deletes the segments
+    no branch reads any more."""
+    with header_files_lock:
+        d = {
+            'segments': segment_bases,
+            'branches': [{'forkpoint': b.forkpoint, 'parent': b.parent_id, 'extents': b.extents}
+                         for b in blockchains.values()],
+        }
+        path = manifest_path(config)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(json.dumps(d))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        used = set(e[0] for b in blockchains.values() for e in b.extents)
+        for segment in list(segment_bases):
+            if segment == 0 or segment in used:
+                continue
+            segment_bases.pop(segment)
+            for path in (segment_path(config, segment), segment_offset_path(config, segment)):
+                release_header_file(path)
+                if os.path.exists(path):
+                    os.remove(path)
+
+def remove_headers(config):
+    """Deletes the headers of all branches."""
+    with header_files_lock:
+        for segment in segment_bases:
+            for path in (segment_path(config, segment), segment_offset_path(config, segment)):
+                release_header_file(path)
+                if os.path.exists(path):
+                    os.remove(path)
+        if os.path.exists(manifest_path(config)):
+            os.remove(manifest_path(config))
+        segment_bases.clear()
+        segment_bases[0] = 0
+
 def read_blockchains(config):
-    blockchains[0] = Blockchain(config, 0, None)
     fdir = os.path.join(util.get_headers_dir(config), 'forks')
     util.make_dir(fdir)
-    l = filter(lambda x: x.startswith('fork_'), os.listdir(fdir))
-    l = sorted(l, key = lambda x: int(x.split('_')[1]))
-    for filename in l:
-        forkpoint = int(filename.split('_')[2])
-        parent_id = int(filename.split('_')[1])
-        b = Blockchain(config, forkpoint, parent_id)
-        util.print_error("forkpoint:{0}\nparent_id:{1}".format(forkpoint, parent_id))
-        h = b.read_header(b.forkpoint)
-        if b.parent().can_connect(h, check_height=False):
-            blockchains[b.forkpoint] = b
-        else:
-            util.print_error("cannot connect", filename)
+    blockchains.clear()
+    segment_bases.clear()
+    segment_bases[0] = 0
+    try:
+        with open(manifest_path(config), 'r', encoding='utf-8') as f:
+            d = json.loads(f.read())
+    except FileNotFoundError:
+        # a single branch in segment 0
+        blockchains[0] = Blockchain(config, 0, None)
+        return blockchains
+    segment_bases.update((int(k), v) for k, v in d['segments'].items())
+    for x in d['branches']:
+        b = Blockchain(config, x['forkpoint'], x['parent'], x['extents'])
+        blockchains[b.forkpoint] = b
+    for b in sorted(blockchains.values(), key=lambda b: b.forkpoint):
+        if b.parent_id is None:
+            continue
+        util.print_error("forkpoint:{0}\nparent_id:{1}".format(b.forkpoint, b.parent_id))
+        h = b.read_header(b.forkpoint) if b.parent_id in blockchains else None
+        if h is None or not b.parent().can_connect(h, check_height=False):
+            util.print_error("cannot connect fork", b.forkpoint)
+            blockchains.pop(b.forkpoint)
     return blockchains
 
 def check_header(header):
@@ -213,14 +404,19 @@ class Blockchain(util.PrintError):
     Manages blockchain headers and their verification
     """
 
-    def __init__(self, config, forkpoint, parent_id):
+    def __init__(self, config, forkpoint, parent_id, extents=None):
         self.config = config
         self.catch_up = None  # interface catching up
         self.forkpoint = forkpoint
         self.checkpoints = constants.net.CHECKPOINTS
         self.parent_id = parent_id
         assert parent_id != forkpoint
+        # [segment, start, end) of the heights of this branch, see segment_bases
+        self.extents = [list(e) for e in extents] if extents else [[0, forkpoint, None]]
         self.lock = threading.RLock()
+        self._header_cache = OrderedDict()  # height -> (header, hash), LRU order
+        self.cache_hits = 0
+        self.cache_misses = 0
         with self.lock:
             self.update_size()
 
@@ -254,8 +450,11 @@ class Blockchain(util.PrintError):
 
     def fork(parent, header):
         forkpoint = header.get('block_height')
-        self = Blockchain(parent.config, forkpoint, parent.forkpoint)
-        open(self.path(), 'w+').close()
+        segment = new_segment(parent.config, forkpoint)
+        self = Blockchain(parent.config, forkpoint, parent.forkpoint, [[segment, forkpoint, None]])
+        with header_files_lock:
+            blockchains[forkpoint] = self
+            write_manifest(self.config)
         self.save_header(header)
         return self
 
@@ -267,8 +466,75 @@ class Blockchain(util.PrintError):
             return self._size
 
     def update_size(self):
-        p = self.offset_path()
-        self._size = (os.path.getsize(p)//8) - 1 if os.path.exists(p) else 0
+        # the files may have been replaced on disk, reload them lazily
+        for segment, start, end in self.extents:
+            release_header_file(segment_offset_path(self.config, segment))
+            release_header_file(segment_path(self.config, segment))
+        self.invalidate_cache()
+        segment = self.extents[-1][0]
+        p = segment_offset_path(self.config, segment)
+        if os.path.exists(p):
+            self._size = segment_bases[segment] + (os.path.getsize(p)//8) - 1 - self.forkpoint
+        else:
+            self._size = 0
+
+    def get_segment(self, height):
+        """Returns the segment holding the header at height."""
+        for segment, start, end in reversed(self.extents):
+            if height >= start:
+                return segment
+        raise MissingHeader(height)
+
+    def get_offsets(self, segment):
+        name = segment_offset_path(self.config, segment)
+        with header_files_lock:
+            offsets = header_offsets.get(name)
+            if offsets is None:
+                self.assert_headers_file_available(name)
+                offsets = header_offsets[name] = read_offset_file(name)
+            return offsets
+
+    def get_headers_map(self, segment):
+        name = segment_path(self.config, segment)
+        with header_files_lock:
+            m = header_maps.get(name)
+            if m is None:
+                self.assert_headers_file_available(name)
+                m = header_maps[name] = map_headers_file(name)
+            return m
+
+    def invalidate_cache(self, from_height=None):
+        """Drop cached headers at or above from_height (all if None)."""
+        with self.lock:
+            if from_height is None or from_height <= self.forkpoint:
+                self._header_cache.clear()
+                return
+            for height in [h for h in self._header_cache if h >= from_height]:
+                del self._header_cache[height]
+
+    def get_cache_stats(self):
+        with self.lock:
+            return {
+                'size': len(self._header_cache),
+                'hits': self.cache_hits,
+                'misses': self.cache_misses,
+            }
+
+    def get_cached_header(self, height):
+        """Return (header, hash) for a height stored in this branch."""
+        with self.lock:
+            entry = self._header_cache.get(height)
+            if entry is not None:
+                self._header_cache.move_to_end(height)
+                self.cache_hits += 1
+                return entry
+            self.cache_misses += 1
+            header = self.read_header_from_file(height)
+            entry = header, hash_header(header)
+            self._header_cache[height] = entry
+            if len(self._header_cache) > HEADER_CACHE_SIZE:
+                self._header_cache.popitem(last=False)
+            return entry
 
     def verify_header(self, header, prev_hash):
         _hash = hash_header(header)
@@ -284,14 +550,11 @@ class Blockchain(util.PrintError):
             prev_hash = hash_header(header)
 
     def path(self):
-        d = util.get_headers_dir(self.config)
-        filename = 'blockchain_headers' if self.parent_id is None else os.path.join('forks', 'fork_%d_%d'%(self.parent_id, self.forkpoint))
-        return os.path.join(d, filename)
+        # the headers file new headers are appended to
+        return segment_path(self.config, self.extents[-1][0])
 
     def offset_path(self):
-        d = util.get_headers_dir(self.config)
-        filename = 'headers_offset'
-        return os.path.join(d, filename)
+        return segment_offset_path(self.config, self.extents[-1][0])
 
     @with_lock
     def save_chunk(self, index, chunk):
@@ -302,30 +565,17 @@ class Blockchain(util.PrintError):
             main_chain.save_chunk(index, chunk)
             return
 
-        delta_height = (index * 2016 - self.forkpoint)
-        delta_bytes = 0
-        header_data = b''
-        offset_data = b''
-        initial_offset = self.dynamic_header_offset(delta_height)
-        offset = initial_offset
-        for idx, header in enumerate(chunk):
-            header_bytes = bfh(serialize_header(header))
-            if idx + delta_height < 0:
-                delta_bytes += len(header_bytes)
-            header_data += header_bytes
-            offset += len(header_bytes)
-            offset_data += bfh(int_to_hex(offset, 8))
-
+        height = index * 2016
         # if this chunk contains our forkpoint, only save the part after forkpoint
         # (the part before is the responsibility of the parent)
-        if delta_bytes > 0:
-            header_data = header_data[delta_bytes:]
-            offset_data = offset_data[delta_height*8:]
-            delta_bytes = 0
+        if height < self.forkpoint:
+            chunk = chunk[self.forkpoint - height:]
+            height = self.forkpoint
         truncate = not chunk_within_checkpoint_region
 
-        self.write(header_data, initial_offset, truncate)
-        self.write_offset(offset_data, (delta_height + 1)*8)
+        self.write_headers(height, [serialize_header_bytes(header) for header in chunk], truncate)
+        # with truncate, anything above the chunk is gone as well
+        self.invalidate_cache(index * 2016)
         self.swap_with_parent()
 
     @with_lock
@@ -339,46 +589,38 @@ class Blockchain(util.PrintError):
         parent_id = self.parent_id
         forkpoint = self.forkpoint
         parent = self.parent()
-        self.assert_headers_file_available(self.path())
-
-        # headers
-        with open(self.path(), 'rb') as f:
-            my_data = f.read()
-        self.assert_headers_file_available(parent.path())
-        with open(parent.path(), 'rb') as f:
-            f.seek(self.dynamic_header_offset(forkpoint - parent.forkpoint))
-            parent_data = f.read(self.dynamic_header_offset(parent_branch_size))
-
-        # header offsets
-        self.assert_headers_file_available(self.offset_path())
-        with open(self.offset_path(), 'rb') as f:
-            my_offset_data = f.read()
-        self.assert_headers_file_available(parent.offset_path())
-        with open(parent.offset_path(), 'rb') as f:
-            f.seek((forkpoint - parent.forkpoint + 1) * 8)
-            parent_offset_data = f.read(parent_branch_size * 8)
-
-        self.write(parent_data, 0)
-        self.write_offset(parent_offset_data, 0)
-        parent.write(my_data, self.dynamic_header_offset(forkpoint - parent.forkpoint))
-        parent.write_offset(my_offset_data, (forkpoint - parent.forkpoint + 1) * 8)
-
-        # store file path
-        for b in blockchains.values():
-            b.old_path = b.path()
-        # swap parameters
-        self.parent_id = parent.parent_id; parent.parent_id = parent_id
-        self.forkpoint = parent.forkpoint; parent.forkpoint = forkpoint
-        self._size = parent._size; parent._size = parent_branch_size
-        # move files
-        for b in blockchains.values():
-            if b in [self, parent]: continue
-            if b.old_path != b.path():
-                self.print_error("renaming", b.old_path, b.path())
-                os.rename(b.old_path, b.path())
-        # update pointers
-        blockchains[self.forkpoint] = self
-        blockchains[parent.forkpoint] = parent
+        with parent.lock, header_files_lock:
+            # the heights of the parent below the forkpoint go to this
+            # branch, the rest become the fork
+            below, above = [], []
+            for segment, start, end in parent.extents:
+                if end is not None and end <= forkpoint:
+                    below.append([segment, start, end])
+                elif start >= forkpoint:
+                    above.append([segment, start, end])
+                else:
+                    below.append([segment, start, forkpoint])
+                    above.append([segment, forkpoint, end])
+            self.extents = merge_extents(below + self.extents)
+            parent.extents = above
+            # forks of either branch follow their heights
+            for b in blockchains.values():
+                if b in [self, parent]: continue
+                if b.parent_id == forkpoint:
+                    b.parent_id = parent_id
+                elif b.parent_id == parent_id and b.forkpoint > forkpoint:
+                    b.parent_id = forkpoint
+            # swap parameters
+            self._size += forkpoint - parent.forkpoint; parent._size = parent_branch_size
+            self.parent_id = parent.parent_id; parent.parent_id = parent_id
+            self.forkpoint = parent.forkpoint; parent.forkpoint = forkpoint
+            # both branches now cover different heights
+            self.invalidate_cache()
+            parent.invalidate_cache()
+            # update pointers
+            blockchains[self.forkpoint] = self
+            blockchains[parent.forkpoint] = parent
+            write_manifest(self.config)
 
     def assert_headers_file_available(self, path):
         if os.path.exists(path):
@@ -388,60 +630,104 @@ class Blockchain(util.PrintError):
         else:
             raise FileNotFoundError('Cannot find headers file but headers_dir is there. Should be at {}'.format(path))
 
-    def write(self, data, offset, truncate=True):
-        filename = self.path()
-        with self.lock:
+    def get_tail_segment(self, height):
+        """Returns the segment to write the headers from height on into,
+        after dropping the extents above height. The segment is written
+        in place unless another branch reads it at height or above, then
+        the headers go to a new segment."""
+        assert self.forkpoint <= height <= self.height() + 1, (height, self.forkpoint, self.height())
+        segment = self.get_segment(height)
+        shared = any(e[0] == segment and (e[2] is None or e[2] > height)
+                     for b in blockchains.values() if b is not self for e in b.extents)
+        extents = [list(e) for e in self.extents if e[1] < height]
+        if shared:
+            if extents:
+                extents[-1][2] = height
+            segment = new_segment(self.config, height)
+            extents.append([segment, height, None])
+        elif extents and extents[-1][0] == segment:
+            extents[-1][2] = None
+        else:
+            extents.append([segment, height, None])
+        if extents != self.extents:
+            self.extents = extents
+            write_manifest(self.config)
+        return segment
+
+    def write_headers(self, height, headers, truncate=True):
+        """Writes the serialized headers from height on. With truncate,
+        they end the branch."""
+        with self.lock, header_files_lock:
+            if truncate:
+                segment = self.get_tail_segment(height)
+            else:
+                segment = self.get_segment(height)
+            delta = height - segment_bases[segment]
+            offsets = self.get_offsets(segment)
+            assert not truncate or delta < len(offsets), (height, len(offsets))
+            offset = offsets[delta] if delta < len(offsets) else 0
+            new_offsets = array('Q')
+            end = offset
+            for data in headers:
+                end += len(data)
+                new_offsets.append(end)
+            self.write(segment, b''.join(headers), offset, truncate)
+            self.write_offset(segment, offsets_to_bytes(new_offsets), (delta + 1) * 8, truncate)
+            if segment == self.extents[-1][0]:
+                self._size = segment_bases[segment] + len(offsets) - 1 - self.forkpoint
+
+    def write(self, segment, data, offset, truncate=True):
+        filename = segment_path(self.config, segment)
+        with self.lock, header_files_lock:
             self.assert_headers_file_available(filename)
+            release_header_map(filename)
             with open(filename, 'rb+') as f:
-                if truncate and offset != self._size*80:
+                if truncate:
                     f.seek(offset)
                     f.truncate()
                 f.seek(offset)
                 f.write(data)
                 f.flush()
                 os.fsync(f.fileno())
-            self.update_size()
 
-    def write_offset(self, data, offset):
-        filename = self.offset_path()
-        with self.lock:
-            self.assert_headers_file_available(filename)
+    def write_offset(self, segment, data, offset, truncate=True):
+        filename = segment_offset_path(self.config, segment)
+        with self.lock, header_files_lock:
+            offsets = self.get_offsets(segment)
             with open(filename, 'rb+') as f:
+                if truncate:
+                    f.seek(offset)
+                    f.truncate()
                 f.seek(offset)
                 f.write(data)
                 f.flush()
                 os.fsync(f.fileno())
-            self.update_size()
+            # keep the in-memory table in sync with what is now on disk
+            new_offsets = array('Q')
+            new_offsets.frombytes(data)
+            if sys.byteorder != 'little':
+                new_offsets.byteswap()
+            assert offset % 8 == 0 and len(data) % 8 == 0
+            start = offset // 8
+            if start > len(offsets):
+                offsets.extend([0] * (start - len(offsets)))
+            offsets[start:start + len(new_offsets)] = new_offsets
+            if truncate:
+                del offsets[start + len(new_offsets):]
 
     @with_lock
     def save_header(self, header):
-        delta = header.get('block_height') - self.forkpoint
-        data = bfh(serialize_header(header))
-        assert delta == self.size()
-
-        offset = self.dynamic_header_offset(delta)
-        self.write(data, offset)
-
-        offset += len(data)
-        pos = (delta + 1) * 8
-        self.write_offset(bfh(int_to_hex(offset, 8)), pos)
+        height = header.get('block_height')
+        assert height - self.forkpoint == self.size()
+        self.write_headers(height, [serialize_header_bytes(header)])
+        self.invalidate_cache(height)
         self.swap_with_parent()
 
-    def dynamic_header_offset(self, height):
-        name = self.offset_path()
-        self.assert_headers_file_available(name)
-        with open(name, 'rb') as f:
-            f.seek(height * 8)
-            h = f.read(8)
-
-        hex_to_int = lambda s: int('0x' + bh2u(s[::-1]), 16) if len(s)!=0 else 0
-        offset = hex_to_int(h)
-        #self.print_error("height{0}-offset{1}".format(height, offset))
-        return offset
-
-    def dynamic_header_len(self, height):
-        return self.dynamic_header_offset(height + 1)\
-               - self.dynamic_header_offset(height)
+    @with_lock
+    def reset(self):
+        """Drops the headers of this branch, to save it again from its forkpoint."""
+        self.write_headers(self.forkpoint, [])
+        self.invalidate_cache()
 
     def read_header(self, height):
         assert self.parent_id != self.forkpoint
@@ -451,15 +737,21 @@ class Blockchain(util.PrintError):
             return self.parent().read_header(height)
         if height > self.height():
             return
-        delta = height - self.forkpoint
-
-        name = self.path()
-        self.assert_headers_file_available(name)
-        with open(name, 'rb') as f:
-            f.seek(self.dynamic_header_offset(delta))
-            h = f.read(self.dynamic_header_len(delta))
-            if len(h) < constants.net.MIN_HEADER_SIZE:
-                raise InvalidFile(name, 'Expected to read a full header. This was only {} bytes'.format(len(h)))
+        header = self.get_cached_header(height)[0]
+        # callers may modify the header, do not hand out the cached dict
+        return dict(header) if header is not None else None
+
+    def read_header_from_file(self, height):
+        segment = self.get_segment(height)
+        delta = height - segment_bases[segment]
+
+        with header_files_lock:
+            offsets = self.get_offsets(segment)
+            start = offsets[delta] if delta < len(offsets) else 0
+            end = offsets[delta + 1] if delta + 1 < len(offsets) else 0
+            h = self.get_headers_map(segment)[start:end]
+        if len(h) < constants.net.MIN_HEADER_SIZE:
+            raise InvalidFile(segment_path(self.config, segment), 'Expected to read a full header. This was only {} bytes'.format(len(h)))
         if h == bytes([0])*(constants.net.MIN_HEADER_SIZE):
             return None
 
@@ -475,8 +767,12 @@ class Blockchain(util.PrintError):
             index = height // 2016
             h, t = self.checkpoints[index]
             return h
+        elif height < self.forkpoint:
+            return self.parent().get_hash(height)
+        elif height > self.height():
+            return hash_header(None)
         else:
-            return hash_header(self.read_header(height))
+            return self.get_cached_header(height)[1]
 
     def can_connect(self, header, check_height=True):
         if header is None:
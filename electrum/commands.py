@@ -42,6 +42,7 @@ from .i18n import _
 from .transaction import Transaction, multisig_script, TxOutput
 from .paymentrequest import PR_PAID, PR_UNPAID, PR_UNKNOWN, PR_EXPIRED
 from .plugin import run_hook
+from .token_ratio import token_ratio
 
 known_commands = {}
 
@@ -185,10 +186,10 @@ class Commands:
         return self.network.get_history_for_scripthash(sh)
 
     @command('w')
-    def listunspent(self):
+    def listunspent(self, asset=None):
         """List unspent outputs. Returns the list of unspent transaction
         outputs in your wallet."""
-        l = copy.deepcopy(self.wallet.get_utxos())
+        l = copy.deepcopy(self.wallet.get_utxos(asset=asset))
         for i in l:
             v = i["value"]
             i["value"] = str(Decimal(v)/COIN) if v is not None else None
@@ -241,9 +242,9 @@ class Commands:
             pubkey_bytes = ecc.ECPrivkey(privkey2).get_public_key_bytes(compressed=compressed)
             h160 = bitcoin.hash_160(pubkey_bytes)
             x_pubkey = 'fd' + bh2u(b'\x00' + h160)
-            tx.sign({x_pubkey:(privkey2, compressed)})
+            tx.sign({x_pubkey:(privkey2, compressed)}, self.config.get('sign_workers', 0))
         else:
-            self.wallet.sign_transaction(tx, password)
+            self.wallet.sign_transaction(tx, password, self.config)
         return tx.as_dict()
 
     @command('')
@@ -301,6 +302,13 @@ class Commands:
         """Check that an address is valid. """
         return is_address(address)
 
+    @command('n')
+    def haswhitelistoutput(self, address):
+        """Check if an address holds an unspent output of the whitelist
+        asset. Addresses registered through register-address or onboarding
+        transactions are not covered."""
+        return self.network.policy_tracker.has_whitelist_output(address)
+
     @command('w')
     def getpubkeys(self, address, tweaked=False):
         """Return the public keys for a wallet address. Keys are untweaked by default."""
@@ -326,6 +334,11 @@ class Commands:
             out["unconfirmed"] = str(Decimal(u)/COIN)
         if x:
             out["unmatured"] = str(Decimal(x)/COIN)
+        asset_balance = self.wallet.get_asset_balance()
+        for i, key in enumerate(["confirmed", "unconfirmed", "unmatured"]):
+            per_asset = {asset: str(Decimal(b[i])/COIN) for asset, b in asset_balance.items() if b[i]}
+            if per_asset or i == 0:
+                out[key + "_per_asset"] = per_asset
         return out
 
     @command('n')
@@ -347,6 +360,30 @@ class Commands:
         uses this to verify transactions (Simple Payment Verification)."""
         return self.network.get_merkle_for_transaction(txid, int(height))
 
+    @command('wn')
+    def getassets(self):
+        """Return the physical assets your tokens are allocated to, according
+        to the asset mapping."""
+        mapping = self.network.asset_mapping
+        if mapping.status != 'connected':
+            raise Exception('Asset mapping not available: ' + str(mapping.status))
+        tokrat = token_ratio(self.network.get_local_height())
+        balance = {asset: sum(b) for asset, b in self.wallet.get_asset_balance().items() if sum(b)}
+        out = []
+        for ref, mass, owned in mapping.get_owned_assets(balance, tokrat):
+            out.append({
+                'ref': ref,
+                'mass': mass,
+                'mass_owned': owned*tokrat/1.0E+8,
+            })
+        return {'verified': mapping.verified, 'assets': out}
+
+    @command('')
+    def gettokenratio(self, height):
+        """Return the token ratio at a block height: the fine mass (oz)
+        of one token."""
+        return token_ratio(int(height))
+
     @command('n')
     def getservers(self):
         """Return the list of available servers"""
@@ -440,7 +477,7 @@ class Commands:
         if rbf:
             tx.set_rbf(True)
         if not unsigned:
-            self.wallet.sign_transaction(tx, password)
+            self.wallet.sign_transaction(tx, password, self.config)
         return tx
 
     @command('wp')
@@ -750,7 +787,8 @@ command_options = {
     'fee_method':  (None, "Fee estimation method to use"),
     'fee_level':   (None, "Float between 0.0 and 1.0, representing fee slider position"),
     'tweaked':     (None, "Show tweaked public keys"),
-    'filename':    (None, "Output file name")
+    'filename':    (None, "Output file name"),
+    'asset':       (None, "Asset id"),
 }
 
 
@@ -41,7 +41,9 @@ from .storage import WalletStorage
 from .commands import known_commands, Commands
 from .simple_config import SimpleConfig
 from .exchange_rate import FxThread
+from .token_ratio import token_ratios
 from .plugin import run_hook
+from .transaction import shutdown_sign_pool
 
 
 def get_lockfile(config):
@@ -122,6 +124,7 @@ class Daemon(DaemonThread):
     def __init__(self, config, fd, is_gui):
         DaemonThread.__init__(self)
         self.config = config
+        token_ratios.load(os.path.join(config.path, 'token_ratios'))
         if config.get('offline'):
             self.network = None
         else:
@@ -196,7 +199,9 @@ class Daemon(DaemonThread):
                     'server': p[0],
                     'blockchain_height': self.network.get_local_height(),
                     'server_height': self.network.get_server_height(),
+                    'header_cache': self.network.get_header_cache_stats(),
                     'spv_nodes': len(self.network.get_interfaces()),
+                    'interface_stats': self.network.get_interface_stats(),
                     'connected': self.network.is_connected(),
                     'auto_connect': p[4],
                     'version': ELECTRUM_VERSION,
@@ -296,6 +301,7 @@ class Daemon(DaemonThread):
             self.print_error("shutting down network")
             self.network.stop()
             self.network.join()
+        shutdown_sign_pool()
         self.on_stop()
 
     def stop(self):
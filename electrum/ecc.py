@@ -39,6 +39,7 @@ from ecdsa.util import string_to_number, number_to_string
 from .util import bfh, bh2u, assert_bytes, print_error, to_bytes, InvalidPassword, profiler
 from .crypto import (Hash, aes_encrypt_with_iv, aes_decrypt_with_iv, hmac_oneshot)
 from .ecc_fast import do_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1
+from .ecc_fast import is_using_fast_ecc, pubkey_tweak_add_batch
 
 
 do_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1()
@@ -350,6 +351,28 @@ def is_secret_within_curve_range(secret: Union[int, bytes]) -> bool:
     return 0 < secret < CURVE_ORDER
 
 
+def pubkey_tweak_add(pubkey: bytes, scalars) -> list:
+    """Returns pubkey + scalar*G (compressed) for every scalar in scalars.
+    The pubkey is parsed only once, so this is the cheap way of deriving
+    many keys from the same parent. A zero scalar yields pubkey itself."""
+    scalars = list(scalars)
+    for scalar in scalars:
+        if not 0 <= scalar < CURVE_ORDER:
+            raise InvalidECPointException('Invalid tweak scalar (not within curve order)')
+    if is_using_fast_ecc():
+        try:
+            results = pubkey_tweak_add_batch(pubkey, scalars)
+        except ValueError as e:
+            raise InvalidECPointException() from e
+    else:
+        point = _ser_to_python_ecdsa_point(pubkey)
+        results = [point_to_ser(generator_secp256k1 * scalar + point) if scalar else point_to_ser(point)
+                   for scalar in scalars]
+    if None in results:
+        raise InvalidECPointException()
+    return results
+
+
 class ECPrivkey(ECPubkey):
 
     def __init__(self, privkey_bytes: bytes):
@@ -423,7 +446,10 @@ class ECPrivkey(ECPubkey):
         sig65, recid = bruteforce_recid(sig_string)
         return sig65
 
-    def decrypt_message(self, encrypted, magic=b'BIE1', get_ephemeral=False, decode=base64.b64decode, ephemeral_pubkey_bytes:bytes=None):
+    def decrypt_message(self, encrypted, magic=b'BIE1', get_ephemeral=False, decode=base64.b64decode, ephemeral_pubkey_bytes:bytes=None, ecdh_cache:dict=None):
+        """ecdh_cache, if given, maps ephemeral pubkeys to the keys shared
+        with this key. It is filled here, to skip the EC multiplication
+        for the next messages from the same sender."""
         encrypted = decode(encrypted)
         if len(encrypted) < 101:
             raise Exception('invalid ciphertext: length')
@@ -436,15 +462,22 @@ class ECPrivkey(ECPubkey):
         mac = encrypted[-32:]
         if magic_found != magic:
             raise Exception('invalid ciphertext: invalid magic bytes')
-        try:
-            ecdsa_point = _ser_to_python_ecdsa_point(ephemeral_pubkey_bytes)
-        except AssertionError as e:
-            raise Exception('invalid ciphertext: invalid ephemeral pubkey') from e
-        if not ecdsa.ecdsa.point_is_valid(generator_secp256k1, ecdsa_point.x(), ecdsa_point.y()):
-            raise Exception('invalid ciphertext: invalid ephemeral pubkey')
-        ephemeral_pubkey = ECPubkey.from_point(ecdsa_point)
-        ecdh_key = ephemeral_pubkey.ecdh(self.secret_scalar)
-        key = hashlib.sha512(ecdh_key).digest()
+        ephemeral_pubkey_bytes = bytes(ephemeral_pubkey_bytes)
+        cached = ecdh_cache.get(ephemeral_pubkey_bytes) if ecdh_cache is not None else None
+        if cached is None:
+            try:
+                ecdsa_point = _ser_to_python_ecdsa_point(ephemeral_pubkey_bytes)
+            except AssertionError as e:
+                raise Exception('invalid ciphertext: invalid ephemeral pubkey') from e
+            if not ecdsa.ecdsa.point_is_valid(generator_secp256k1, ecdsa_point.x(), ecdsa_point.y()):
+                raise Exception('invalid ciphertext: invalid ephemeral pubkey')
+            ephemeral_pubkey = ECPubkey.from_point(ecdsa_point)
+            ecdh_key = ephemeral_pubkey.ecdh(self.secret_scalar)
+            key = hashlib.sha512(ecdh_key).digest()
+            if ecdh_cache is not None:
+                ecdh_cache[ephemeral_pubkey_bytes] = ephemeral_pubkey, key
+        else:
+            ephemeral_pubkey, key = cached
         key_e, key_m = key[0:32], key[32:]
         if mac != hmac_oneshot(key_m, encrypted[:-32], hashlib.sha256):
             raise InvalidPassword()
@@ -81,6 +81,9 @@ def load_library():
         secp256k1.secp256k1_ec_pubkey_tweak_mul.argtypes = [c_void_p, c_char_p, c_char_p]
         secp256k1.secp256k1_ec_pubkey_tweak_mul.restype = c_int
 
+        secp256k1.secp256k1_ec_pubkey_tweak_add.argtypes = [c_void_p, c_char_p, c_char_p]
+        secp256k1.secp256k1_ec_pubkey_tweak_add.restype = c_int
+
         secp256k1.ctx = secp256k1.secp256k1_context_create(SECP256K1_CONTEXT_SIGN | SECP256K1_CONTEXT_VERIFY)
         r = secp256k1.secp256k1_context_randomize(secp256k1.ctx, os.urandom(32))
         if r:
@@ -212,6 +215,33 @@ def is_using_fast_ecc():
     return _patched_functions.monkey_patching_active
 
 
+def pubkey_tweak_add_batch(pubkey_bytes: bytes, scalars):
+    '''Returns [pubkey + scalar*G for scalar in scalars], compressed.
+    The pubkey is parsed once for the whole batch. An entry is None
+    where the result is the point at infinity.
+    Only to be called when is_using_fast_ecc().'''
+    pubkey = create_string_buffer(64)
+    r = _libsecp256k1.secp256k1_ec_pubkey_parse(
+        _libsecp256k1.ctx, pubkey, pubkey_bytes, len(pubkey_bytes))
+    if not r:
+        raise ValueError('invalid public key')
+    results = []
+    for scalar in scalars:
+        child = create_string_buffer(pubkey.raw, 64)
+        if scalar:
+            r = _libsecp256k1.secp256k1_ec_pubkey_tweak_add(
+                _libsecp256k1.ctx, child, scalar.to_bytes(32, byteorder="big"))
+            if not r:
+                results.append(None)
+                continue
+        child_serialized = create_string_buffer(33)
+        child_size = c_size_t(33)
+        _libsecp256k1.secp256k1_ec_pubkey_serialize(
+            _libsecp256k1.ctx, child_serialized, byref(child_size), child, SECP256K1_EC_COMPRESSED)
+        results.append(child_serialized.raw)
+    return results
+
+
 try:
     _libsecp256k1 = load_library()
 except:
@@ -985,8 +985,9 @@ class ElectrumWindow(App):
             except:
                 self.show_error("Invalid PIN")
                 return
+        storage = self.wallet.storage
         self.stop_wallet()
-        os.unlink(wallet_path)
+        storage.delete()
         self.show_error(_("Wallet removed: {}").format(basename))
         new_path = self.electrum_config.get_wallet_path()
         self.load_wallet_by_name(new_path)
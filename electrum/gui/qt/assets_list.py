@@ -24,11 +24,7 @@
 # SOFTWARE.
 from .util import *
 from electrum.i18n import _
-import requests
-import json
-from electrum import bitcoin, ecc
-from electrum import constants
-import base64
+from electrum.token_ratio import token_ratio
 
 class AssetsList(MyTreeWidget):
 
@@ -36,69 +32,24 @@ class AssetsList(MyTreeWidget):
         MyTreeWidget.__init__(self, parent, self.create_menu, [ _('Serial No.'), _('Year'), _('Manufacturer'), _('Asset Fine Mass'), _('Mass Owned'), _('Fraction')],2)
         self.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.setSortingEnabled(True)
-        self.verified = False
-        self.amap = {}
-        if self.config.get('get_map'):
-            try:
-                r = requests.request('GET', self.config.get('mapping_url'), timeout=2)
-                r.raise_for_status()
-            except requests.exceptions.HTTPError as errh:
-                self.getmap = 'http_error'
-                return
-            except requests.exceptions.ConnectionError as errc:
-                self.getmap = 'connection_error'
-                return
-            except requests.exceptions.Timeout as errt:
-                self.getmap = 'timeout_error'
-                return
-            except requests.exceptions.RequestException as err:
-                self.getmap = 'request_exception'
-                return
-            self.getmap = 'connected'
-            try:
-                self.amap = r.json()
-            except:
-                self.getmap = 'json_error'
-                return
-            self.controller_pubkeys = [constants.net.CONTROLER1,constants.net.CONTROLER2,constants.net.CONTROLER3]
-            self.verified = self.verify_mapping_sig()
+        self.mapping = parent.network.asset_mapping if parent.network else None
 
     def on_update(self):
-        if self.config.get('get_map'):
+        if self.config.get('get_map') and self.mapping:
             self.wallet = self.parent.wallet
             tokrat = token_ratio(self.wallet.get_block_height())
             tokens = {}
-            ownassets = {}
             item = self.currentItem()
             self.clear()
-            self.utxos = self.wallet.get_utxos()
-            for x in self.utxos:
-                asset = x.get('asset')
-                amount = float(x['value'])
-                if asset in tokens:
-                    tokens[asset] += amount
-                else:
-                    tokens[asset] = amount
+            for asset, (c, u, x) in self.wallet.get_asset_balance().items():
+                if c + u + x:
+                    tokens[asset] = c + u + x
 
-
-            for tokenid in tokens:
-                if "assets" in self.amap:
-                    for i,j in self.amap["assets"].items():
-                        if j["tokenid"] == tokenid:
-                            if j["ref"] in ownassets:
-                                ownassets[j["ref"]] += tokens[tokenid]
-                            else:
-                                ownassets[j["ref"]] = tokens[tokenid]
-                            if j["mass"] < tokens[tokenid]*tokrat/1.0E+8:
-                                tokens[tokenid] -= j["mass"]*1.0E+8/tokrat
-                            else:
-                                tokens[tokenid] = 0
-
-            for myasset in ownassets:
-                rmass = str("%.6f" % (round(float(ownassets[myasset])*tokrat/1.0E+8,6)))+" oz "
-                tmass = str("%.6f" % (round(float(self.get_mass_assetid(myasset)),6)))+" oz "
-                fraction = 100*(float(ownassets[myasset])*tokrat/1.0E+8)/float(self.get_mass_assetid(myasset))
+            for myasset, tmass, owned in self.mapping.get_owned_assets(tokens, tokrat):
+                rmass = str("%.6f" % (round(float(owned)*tokrat/1.0E+8,6)))+" oz "
+                fraction = 100*(float(owned)*tokrat/1.0E+8)/float(tmass)
                 fraction_str = str("%.4f" % round(fraction,4))+" %"
+                tmass = str("%.6f" % (round(float(tmass),6)))+" oz "
                 asset_ref = myasset.split("-")
                 if len(asset_ref) != 3: return
                 asset_item = SortableTreeWidgetItem([asset_ref[0], asset_ref[1], asset_ref[2], tmass, rmass, fraction_str])
@@ -120,31 +71,3 @@ class AssetsList(MyTreeWidget):
     def on_permit_edit(self, item, column):
         # disable editing fields in this tab (labels)
         return False
-
-    def verify_mapping_sig(self):
-        nsig = len(self.amap["sigs"])
-        if nsig < self.amap["n"]:
-            return False
-        jsonstring = json.dumps(self.amap["assets"],sort_keys=True)
-        jsonstring += str(self.amap["n"]) + str(self.amap["m"]) + str(self.amap["time"]) + str(self.amap["height"])
-        message = jsonstring.encode('utf-8')
-        nvalid = 0
-        for key in self.controller_pubkeys:
-            for i,j in self.amap["sigs"].items():
-                txin_type = 'p2pkh'
-                address = bitcoin.pubkey_to_address(txin_type, key)
-                sig = base64.b64decode(j)
-                verified = ecc.verify_message_with_address(address, sig, message)
-                if verified: nvalid += 1
-        if nvalid >= self.amap["n"]:
-            return True
-        else:
-            return False
-
-    def get_mass_assetid(self,assetid):
-        tmass = 0.0
-        for i,j in self.amap["assets"].items():
-            if j["ref"] == assetid:
-                tmass += j["mass"]
-        return tmass
-
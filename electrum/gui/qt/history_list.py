@@ -30,6 +30,7 @@ from electrum.address_synchronizer import TX_HEIGHT_LOCAL
 from .util import *
 from electrum.i18n import _
 from electrum.util import block_explorer_URL, profiler, print_error, TxMinedStatus
+from electrum.token_ratio import token_mass
 
 try:
     from electrum.plot import plot_history, NothingToPlotException
@@ -231,7 +232,9 @@ class HistoryList(MyTreeWidget, AcceptFileDragDrop):
         blue_brush = QBrush(QColor("#1E1EFF"))
         red_brush = QBrush(QColor("#BC1E1E"))
         monospace_font = QFont(MONOSPACE_FONT)
-        for tx_item in self.transactions:
+        masses = token_mass([tx_item['balance'].value for tx_item in self.transactions],
+                            self.wallet.get_block_height())
+        for tx_item, mass in zip(self.transactions, masses):
             tx_hash = tx_item['txid']
             height = tx_item['height']
             conf = tx_item['confirmations']
@@ -245,8 +248,7 @@ class HistoryList(MyTreeWidget, AcceptFileDragDrop):
             icon = self.icon_cache.get(":icons/" + TX_ICONS[status])
             v_str = self.parent.format_amount(value, is_diff=True, whitespaces=True)
             balance_str = self.parent.format_amount(balance, whitespaces=True)
-            tokrat = token_ratio(self.wallet.get_block_height())
-            rmass = str("%.6f" % round((float(balance)*tokrat/1.0E+8),8))
+            rmass = str("%.6f" % round(mass,8))
             rmass_str = rmass+" oz "
             entry = ['', tx_hash, status_str, label, v_str, balance_str, rmass_str]
             fiat_value = None
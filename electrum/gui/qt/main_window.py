@@ -55,6 +55,7 @@ from electrum.util import (format_time, format_satoshis, format_fee_satoshis,
                            base_units, base_units_list, base_unit_name_to_decimal_point,
                            decimal_point_to_base_unit_name, quantize_feerate)
 from electrum.transaction import Transaction, TxOutput
+from electrum.token_ratio import token_ratio
 from electrum.address_synchronizer import AddTransactionException
 from electrum.wallet import Multisig_Wallet, CannotBumpFee
 
@@ -99,6 +100,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
     notify_transactions_signal = pyqtSignal()
     new_fx_quotes_signal = pyqtSignal()
     new_fx_history_signal = pyqtSignal()
+    asset_mapping_signal = pyqtSignal()
     network_signal = pyqtSignal(str, object)
     alias_received_signal = pyqtSignal()
     computing_privkeys_signal = pyqtSignal()
@@ -207,6 +209,8 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
             self.network.register_callback(self.on_history, ['on_history'])
             self.new_fx_quotes_signal.connect(self.on_fx_quotes)
             self.new_fx_history_signal.connect(self.on_fx_history)
+            self.network.register_callback(self.on_asset_mapping, ['asset_mapping'])
+            self.asset_mapping_signal.connect(self.on_asset_mapping_qt)
 
         # update fee slider in case we missed the callback
         self.load_wallet(wallet)
@@ -227,6 +231,23 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
     def on_quotes(self, b):
         self.new_fx_quotes_signal.emit()
 
+    def on_asset_mapping(self, b):
+        self.asset_mapping_signal.emit()
+
+    def on_asset_mapping_qt(self):
+        mapping = self.network.asset_mapping
+        # a failed refresh keeps the verified mapping, so this only warns
+        # about the first fetch of the session or after a reset
+        if self.network.get_mapping:
+            url = self.network.mapping_server
+            if mapping.status != 'connected':
+                self.show_warning(_('Warning: mapping not recieved. '+mapping.status))
+                self.network.set_mapping(False,url)
+            elif not mapping.verified:
+                self.show_warning(_('Warning: Asset mapping authentication failed'))
+                self.network.set_mapping(False,url)
+        self.assets_list.update()
+
     def on_fx_quotes(self):
         self.update_status()
         # Refresh edits with the new rate
@@ -362,6 +383,10 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
         self.need_update.set()
         # Once GUI has been initialized check if we want to announce something since the callback has been called before the GUI was initialized
         self.notify_transactions()
+        # policy transactions received before this wallet was loaded
+        txs = self.wallet.replay_policy_txs()
+        if txs:
+            self.parse_policy_txs(txs)
         # update menus
         self.seed_menu.setEnabled(self.wallet.has_seed())
         self.update_lock_icon()
@@ -439,6 +464,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
         new_path = os.path.join(wallet_folder, filename)
         if new_path != path:
             try:
+                self.wallet.storage.write(compact=True)
                 shutil.copy2(path, new_path)
                 self.show_message(_("A copy of your wallet file was created in")+" '%s'" % str(new_path), title=_("Wallet backup created"))
             except BaseException as reason:
@@ -612,12 +638,22 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
             # Combine the transactions if there are at least three
             tx_processing=self.tx_notifications
             self.tx_notifications=[]
+            policy_txs = []
+            other_txs = []
+            for tx in tx_processing:
+                if not tx:
+                    continue
+                if self.wallet.is_policy_tx(tx):
+                    policy_txs.append(tx)
+                else:
+                    other_txs.append(tx)
+            if policy_txs:
+                self.parse_policy_txs(policy_txs)
+            tx_processing = other_txs
             num_txns = len(tx_processing)
             if num_txns >= 3:
                 total_amount = 0
                 for tx in tx_processing:
-                    if self.wallet.parse_policy_tx(tx, self):
-                        continue
                     is_relevant, is_mine, v, fee = self.wallet.get_wallet_delta(tx)
                     if v > 0:
                         total_amount += v
@@ -627,14 +663,28 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
                 tx_processing = []
             else:
                 for tx in tx_processing:
-                    if tx:
-                        if self.wallet.parse_policy_tx(tx, self):
-                            continue
-                        is_relevant, is_mine, v, fee = self.wallet.get_wallet_delta(tx)
-                        if v > 0:
-                            self.notify(_("New transaction received: {}").format(self.format_amount_and_units(v)))
+                    is_relevant, is_mine, v, fee = self.wallet.get_wallet_delta(tx)
+                    if v > 0:
+                        self.notify(_("New transaction received: {}").format(self.format_amount_and_units(v)))
                 tx_processing = []
 
+    def parse_policy_txs(self, txs):
+        # ask for the password at most once, then decrypt in the wallet thread
+        password = None
+        if self.wallet.policy_txs_need_password(txs):
+            msg = _('Received encrypted address whitelist transactions.') + '\n' + _('Please enter your password to update wallet whitelist status.')
+            password = self.password_dialog(msg, parent=self.top_level_window())
+            if not password:
+                return
+            try:
+                self.wallet.check_password(password)
+            except InvalidPassword as e:
+                self.show_error(str(e))
+                return
+        def on_success(n):
+            self.need_update.set()
+        self.wallet.thread.add(partial(self.wallet.parse_policy_txs, txs, password), on_success=on_success)
+
     def notify(self, message):
         if self.tray:
             try:
@@ -1705,7 +1755,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
             # can sign directly
             task = partial(Transaction.sign, tx, self.tx_external_keypairs)
         else:
-            task = partial(self.wallet.sign_transaction, tx, password)
+            task = partial(self.wallet.sign_transaction, tx, password, self.config)
         msg = _('Signing transaction...')
         WaitingDialog(self, msg, task, on_success, on_failure)
 
@@ -1908,14 +1958,6 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
     def create_assets_tab(self):
         from .assets_list import AssetsList
         self.assets_list = l = AssetsList(self)
-        if self.network.get_mapping:
-            url = self.network.mapping_server
-            if l.getmap != 'connected':
-                self.show_warning(_('Warning: mapping not recieved. '+l.getmap))
-                self.network.set_mapping(False,url)
-            elif not l.verified:
-                self.show_warning(_('Warning: Asset mapping authentication failed'))
-                self.network.set_mapping(False,url)
         return self.create_list_tab(l)
 
     def create_contacts_tab(self):
@@ -2231,7 +2273,7 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
         basename = os.path.basename(wallet_path)
         self.gui_object.daemon.stop_wallet(wallet_path)
         self.close()
-        os.unlink(wallet_path)
+        self.wallet.storage.delete()
         self.show_error(_("Wallet removed: {}").format(basename))
 
     @protected
@@ -2737,8 +2779,6 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin, PrintError):
             self.wallet.storage.put('registered_addresses', [])
             self.wallet.frozen_addresses = set()
             self.wallet.storage.put('frozen_addresses', [])
-            self.wallet.unassigned_kyc_pubkeys = {}
-            self.wallet.storage.put('unassigned_kyc_pubkeys', {})
             historyBackup = self.wallet.history
             self.wallet.clear_history()
             for it in historyBackup:
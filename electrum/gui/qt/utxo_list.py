@@ -24,6 +24,7 @@
 # SOFTWARE.
 from .util import *
 from electrum.i18n import _
+from electrum.token_ratio import token_mass
 
 class UTXOList(MyTreeWidget):
     filter_columns = [0, 2]  # Address, Label
@@ -41,15 +42,15 @@ class UTXOList(MyTreeWidget):
         item = self.currentItem()
         self.clear()
         self.utxos = self.wallet.get_utxos()
-        for x in self.utxos:
+        masses = token_mass([x['value'] for x in self.utxos], self.wallet.get_block_height())
+        for x, mass in zip(self.utxos, masses):
             address = x.get('address')
             height = x.get('height')
             asset = x.get('asset')
             name = self.get_name(x)
             label = self.wallet.get_label(x.get('prevout_hash'))
             amount = self.parent.format_amount(x['value'], whitespaces=True)
-            tokrat = token_ratio(self.wallet.get_block_height())
-            rmass = str("%.6f" % (float(x['value'])*tokrat/1.0E+8))
+            rmass = str("%.6f" % mass)
             rmass_str = rmass+" oz "
             utxo_item = SortableTreeWidgetItem([address, asset, amount, rmass_str, '%d'%height, name[0:10] + '...' + name[-2:]])
             utxo_item.setFont(0, QFont(MONOSPACE_FONT))
@@ -30,6 +30,7 @@ import sys
 import threading
 import time
 import traceback
+from collections import deque
 
 import requests
 
@@ -42,18 +43,18 @@ from . import x509
 from . import pem
 
 
-def Connection(server, queue, config_path):
+def Connection(server, queue, config_path, on_done=None):
     """Makes asynchronous connections to a remote Electrum server.
     Returns the running thread that is making the connection.
 
     Once the thread has connected, it finishes, placing a tuple on the
     queue of the form (server, socket), where socket is None if
-    connection failed.
+    connection failed, and calls on_done if given.
     """
     host, port, protocol = server.rsplit(':', 2)
     if not protocol in 'st':
         raise Exception('Unknown protocol: %s' % protocol)
-    c = TcpConnection(server, queue, config_path)
+    c = TcpConnection(server, queue, config_path, on_done)
     c.start()
     return c
 
@@ -61,10 +62,11 @@ def Connection(server, queue, config_path):
 class TcpConnection(threading.Thread, util.PrintError):
     verbosity_filter = 'i'
 
-    def __init__(self, server, queue, config_path):
+    def __init__(self, server, queue, config_path, on_done=None):
         threading.Thread.__init__(self)
         self.config_path = config_path
         self.queue = queue
+        self.on_done = on_done
         self.server = server
         self.host, self.port, self.protocol = self.server.rsplit(':', 2)
         self.host = str(self.host)
@@ -245,6 +247,30 @@ class TcpConnection(threading.Thread, util.PrintError):
         if socket:
             self.print_error("connected")
         self.queue.put((self.server, socket))
+        if self.on_done:
+            self.on_done()
+
+
+# flow control: number of unanswered requests allowed on a connection
+MIN_WINDOW = 10
+INITIAL_WINDOW = 100
+MAX_WINDOW = 1000
+# JSON-RPC error codes of servers shedding load (aiorpcx)
+OVERLOAD_ERRORS = (-101, -102)  # excessive resource usage, server busy
+# responses slower than this, well within the 30s timeout, shrink the window
+SLOW_RESPONSE_TIME = 10
+# requests unanswered this long are not sampled anymore if answered
+STALE_REQUEST_TIME = 60
+# sent ahead of bulk requests (histories, transactions)
+PRIORITY_METHODS = {
+    'server.version',
+    'server.ping',
+    'blockchain.headers.subscribe',
+    'blockchain.block.headers',
+    'blockchain.block.get_header',
+    'blockchain.transaction.get_merkle',
+    'blockchain.transaction.broadcast',
+}
 
 
 class Interface(util.PrintError):
@@ -265,10 +291,24 @@ class Interface(util.PrintError):
         self.pipe.set_timeout(0.0)  # Don't wait for data
         # Dump network messages.  Set at runtime from the console.
         self.debug = False
-        self.unsent_requests = []
+        self.priority_requests = deque()
+        self.unsent_requests = deque()
         self.unanswered_requests = {}
+        self.send_times = {}
         self.last_send = time.time()
         self.closed_remotely = False
+        # the window grows while it is the limit, and is halved on overload
+        # errors or slow responses, at most once per window of requests.
+        # Round trips include the server queueing the rest of a bulk send,
+        # so they are only sampled on the first response of each send.
+        self.window = INITIAL_WINDOW
+        self.last_shrink = 0
+        self.unsampled_sends = set()
+        self.last_prune = time.time()
+        self.rtt = None
+        self.min_rtt = None
+        # send bulk requests as one JSON-RPC batch array; needs server support
+        self.batch_requests = False
 
     def diagnostic_name(self):
         return self.host
@@ -284,37 +324,99 @@ class Interface(util.PrintError):
             except socket.error:
                 pass
         self.socket.close()
+        self.send_times.clear()
+        self.unsampled_sends.clear()
 
     def queue_request(self, *args):  # method, params, _id
         '''Queue a request, later to be send with send_requests when the
         socket is available for writing.
         '''
         self.request_time = time.time()
-        self.unsent_requests.append(args)
+        if args[0] in PRIORITY_METHODS:
+            self.priority_requests.append(args)
+        else:
+            self.unsent_requests.append(args)
 
     def num_requests(self):
-        '''Keep unanswered requests below 100'''
-        n = 100 - len(self.unanswered_requests)
-        return min(n, len(self.unsent_requests))
+        '''Keep unanswered requests within the window'''
+        n = self.window - len(self.unanswered_requests)
+        return max(0, min(n, len(self.priority_requests) + len(self.unsent_requests)))
 
     def send_requests(self):
         '''Sends queued requests.  Returns False on failure.'''
         self.last_send = time.time()
         make_dict = lambda m, p, i: {'method': m, 'params': p, 'id': i}
         n = self.num_requests()
-        wire_requests = self.unsent_requests[0:n]
+        wire_requests = []
+        for queue in (self.priority_requests, self.unsent_requests):
+            while queue and len(wire_requests) < n:
+                wire_requests.append(queue.popleft())
+        messages = [make_dict(*r) for r in wire_requests]
+        if self.batch_requests:
+            # batches are a JSON-RPC 2.0 feature
+            bulk = [dict(m, jsonrpc='2.0') for m in messages if m['method'] not in PRIORITY_METHODS]
+            if len(bulk) > 1:
+                messages = [m for m in messages if m['method'] in PRIORITY_METHODS] + [bulk]
         try:
-            self.pipe.send_all([make_dict(*r) for r in wire_requests])
+            self.pipe.send_all(messages)
         except BaseException as e:
             self.print_error("pipe send error:", e)
+            # put them back in order, they have not been sent
+            for r in reversed(wire_requests):
+                queue = self.priority_requests if r[0] in PRIORITY_METHODS else self.unsent_requests
+                queue.appendleft(r)
             return False
-        self.unsent_requests = self.unsent_requests[n:]
         for request in wire_requests:
             if self.debug:
                 self.print_error("-->", request)
             self.unanswered_requests[request[2]] = request
+            self.send_times[request[2]] = self.last_send
+        if wire_requests:
+            self.unsampled_sends.add(self.last_send)
         return True
 
+    def on_response(self, wire_id, response):
+        '''Adapt the window to errors and slow responses.'''
+        sent = self.send_times.pop(wire_id, None)
+        if sent is None:
+            return
+        now = time.time()
+        if sent in self.unsampled_sends:
+            self.unsampled_sends.remove(sent)
+            rtt = now - sent
+            self.rtt = rtt if self.rtt is None else 0.875 * self.rtt + 0.125 * rtt
+            self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        error = response.get('error')
+        overload = isinstance(error, dict) and error.get('code') in OVERLOAD_ERRORS
+        if overload or now - sent > SLOW_RESPONSE_TIME:
+            # requests sent before the last shrink report the same problem
+            if sent > self.last_shrink:
+                self.window = max(MIN_WINDOW, self.window // 2)
+                self.last_shrink = now
+        elif len(self.unanswered_requests) + 1 >= self.window:
+            # the window was the limit, and the server keeps up
+            self.window = min(MAX_WINDOW, self.window + 1)
+
+    def prune_send_times(self):
+        '''Forget the send times of requests that were dropped or are not
+        answered, so that they do not pile up on a long connection.'''
+        now = time.time()
+        if now - self.last_prune < STALE_REQUEST_TIME:
+            return
+        self.last_prune = now
+        self.send_times = {wire_id: sent for wire_id, sent in self.send_times.items()
+                           if wire_id in self.unanswered_requests and now - sent < STALE_REQUEST_TIME}
+        self.unsampled_sends &= set(self.send_times.values())
+
+    def get_stats(self):
+        return {
+            'window': self.window,
+            'queued': len(self.priority_requests) + len(self.unsent_requests),
+            'unanswered': len(self.unanswered_requests),
+            'rtt': self.rtt,
+            'min_rtt': self.min_rtt,
+        }
+
     def ping_required(self):
         '''Returns True if a ping should be sent.'''
         return time.time() - self.last_send > 300
@@ -343,25 +445,29 @@ class Interface(util.PrintError):
                 response = self.pipe.get()
             except util.timeout:
                 break
-            if not type(response) is dict:
-                responses.append((None, None))
-                if response is None:
-                    self.closed_remotely = True
-                    self.print_error("connection closed remotely")
-                break
-            if self.debug:
-                self.print_error("<--", response)
-            wire_id = response.get('id', None)
-            if wire_id is None:  # Notification
-                responses.append((None, response))
-            else:
-                request = self.unanswered_requests.pop(wire_id, None)
-                if request:
-                    responses.append((request, response))
+            # a batch request is answered with an array of responses
+            batch = response if type(response) is list else [response]
+            for response in batch:
+                if not type(response) is dict:
+                    responses.append((None, None))
+                    if response is None:
+                        self.closed_remotely = True
+                        self.print_error("connection closed remotely")
+                    return responses
+                if self.debug:
+                    self.print_error("<--", response)
+                wire_id = response.get('id', None)
+                if wire_id is None:  # Notification
+                    responses.append((None, response))
                 else:
-                    self.print_error("unknown wire ID", wire_id)
-                    responses.append((None, None)) # Signal
-                    break
+                    request = self.unanswered_requests.pop(wire_id, None)
+                    if request:
+                        self.on_response(wire_id, response)
+                        responses.append((request, response))
+                    else:
+                        self.print_error("unknown wire ID", wire_id)
+                        responses.append((None, None)) # Signal
+                        return responses
 
         return responses
 
@@ -98,12 +98,12 @@ class Software_KeyStore(KeyStore):
         decrypted = ec.decrypt_message(message)
         return decrypted
 
-    def sign_transaction(self, tx, keypairs):
+    def sign_transaction(self, tx, keypairs, num_workers=0):
         if self.is_watching_only():
             return
         # Sign
         if keypairs:
-            tx.sign(keypairs)
+            tx.sign(keypairs, num_workers)
 
 
 class Imported_KeyStore(Software_KeyStore):
@@ -223,11 +223,13 @@ class Xpub:
         self.xpub_receive = None
         self.xpub_change = None
         self.xpub_encryption = None
+        self.branch_nodes = {}
 
     def get_master_public_key(self):
         return self.xpub
 
-    def derive_pubkey(self, for_change, n, for_encryption=False):
+    def get_branch_node(self, for_change, for_encryption=False):
+        """(cK, c) of the branch xpub, deserialized once and cached."""
         if for_encryption:
             xpub=self.xpub_encryption
             for_change=False
@@ -244,7 +246,22 @@ class Xpub:
                 self.xpub_change = xpub
             else:
                 self.xpub_receive = xpub
-        return self.get_pubkey_from_xpub(xpub, (n,))
+        node = self.branch_nodes.get(xpub)
+        if node is None:
+            _, _, _, _, c, cK = deserialize_xpub(xpub)
+            node = self.branch_nodes[xpub] = (cK, c)
+        return node
+
+    def derive_pubkey(self, for_change, n, for_encryption=False):
+        return self.derive_pubkey_range(for_change, n, n + 1, for_encryption)[0]
+
+    def derive_pubkey_range(self, for_change, start, end, for_encryption=False, tweak=None):
+        """Pubkeys for indices start..end-1 of a branch. If a contract
+        hash is given as tweak, the keys come out already tweaked, as
+        tweak_pubkey would return them."""
+        cK, c = self.get_branch_node(for_change, for_encryption)
+        tweak = bfh(tweak)[::-1] if tweak else None
+        return [bh2u(x) for x in CKD_pub_range(cK, c, start, end, tweak)]
 
     def tweak_pubkey(self, c, t, e=False):
         if not t:
@@ -427,6 +444,10 @@ class Old_KeyStore(Deterministic_KeyStore):
     def derive_pubkey(self, for_change, n):
         return self.get_pubkey_from_mpk(self.mpk, for_change, n)
 
+    # Tweaking not supported in old storage keys
+    def derive_pubkey_range(self, for_change, start, end, for_encryption=False, tweak=None):
+        return [self.derive_pubkey(for_change, n) for n in range(start, end)]
+
     def get_private_key_from_stretched_exponent(self, for_change, n, secexp):
         secexp = (secexp + self.get_sequence(self.mpk, for_change, n)) % ecc.CURVE_ORDER
         pk = number_to_string(secexp, ecc.CURVE_ORDER)
@@ -519,6 +540,9 @@ class Hardware_KeyStore(KeyStore, Xpub):
     #No key tweaking for hardware keystores.
     def tweak_pubkey(self, c, t, e=False):
         return c
+
+    def derive_pubkey_range(self, for_change, start, end, for_encryption=False, tweak=None):
+        return Xpub.derive_pubkey_range(self, for_change, start, end, for_encryption)
         
     def set_label(self, label):
         self.label = label
@@ -48,10 +48,17 @@ from . import blockchain
 from .version import ELECTRUM_VERSION, PROTOCOL_VERSION
 from .i18n import _
 from .blockchain import InvalidHeader, InvalidFile
+from .asset_mapping import AssetMapping
+from .policy_tracker import PolicyTracker
 
 
 NODES_RETRY_INTERVAL = 60
 SERVER_RETRY_INTERVAL = 10
+CHUNK_PIPELINE_SIZE = 8
+MAX_CHUNK_ERRORS = 3
+# wait_on_sockets is woken up by network events and by wakeup();
+# the timeout only paces pings, timeouts and reconnections
+SELECT_TIMEOUT = 1.0
 
 
 def parse_servers(result):
@@ -249,8 +256,23 @@ class Network(util.DaemonThread):
         self.auto_connect = self.config.get('auto_connect', True)
         self.get_mapping = self.config.get('get_map', False)
         self.connecting = set()
-        self.requested_chunks = set()
+        # (chunk index, interface catching up) -> interface asked
+        self.requested_chunks = {}
+        # (chunk index, interface catching up) -> (interface asked, hexdata),
+        # waiting for lower chunks before they can be connected
+        self.received_chunks = {}
+        # (chunk index, interface catching up) -> failed requests
+        self.chunk_errors = {}
         self.socket_queue = queue.Queue()
+        # other threads write to wakeup_w to interrupt wait_on_sockets
+        self.wakeup_r, self.wakeup_w = socket.socketpair()
+        self.wakeup_r.setblocking(False)
+        self.wakeup_w.setblocking(False)
+        # asset mapping, shared by the GUI and commands
+        self.asset_mapping = AssetMapping(self.config, self)
+        # policy transactions, shared by the wallets
+        self.policy_tracker = PolicyTracker(self.config, self)
+        self.add_jobs([self.asset_mapping, self.policy_tracker])
         self.start_network(deserialize_server(self.default_server)[2],
                            deserialize_proxy(self.config.get('proxy')))
 
@@ -348,6 +370,8 @@ class Network(util.DaemonThread):
         if self.debug:
             self.print_error(interface.host, "-->", method, params, message_id)
         interface.queue_request(method, params, message_id)
+        if threading.current_thread() is not self:
+            self.wakeup()
         return message_id
 
     @with_interface_lock
@@ -439,7 +463,7 @@ class Network(util.DaemonThread):
                 self.print_error("connecting to %s as new interface" % server)
                 self.set_status('connecting')
             self.connecting.add(server)
-            Connection(server, self.socket_queue, self.config.path)
+            Connection(server, self.socket_queue, self.config.path, self.wakeup)
 
     def start_random_interface(self):
         with self.interface_lock:
@@ -537,10 +561,12 @@ class Network(util.DaemonThread):
         self.config.set_key('get_map', get_map, True)
         self.get_mapping = get_map
         self.mapping_server = mapping_url
+        self.asset_mapping.reset()
 
     def default_mapping(self):
         self.config.set_key('mapping_url', constants.net.MAPPING_URL, False)
         self.mapping_server=constants.net.MAPPING_URL
+        self.asset_mapping.reset()
         return constants.net.MAPPING_URL
 
     def set_parameters(self, host, port, protocol, proxy, auto_connect):
@@ -751,6 +777,7 @@ class Network(util.DaemonThread):
         messages = list(messages)
         with self.pending_sends_lock:
             self.pending_sends.append((messages, callback))
+        self.wakeup()
 
     @with_interface_lock
     def process_pending_sends(self):
@@ -802,6 +829,7 @@ class Network(util.DaemonThread):
         if server == self.default_server:
             self.set_status('disconnected')
         if server in self.interfaces:
+            self.cancel_chunks(self.interfaces[server])
             self.close_interface(self.interfaces[server])
             self.notify('interfaces')
         with self.blockchains_lock:
@@ -813,6 +841,7 @@ class Network(util.DaemonThread):
         # todo: get tip first, then decide which checkpoint to use.
         self.add_recent_server(server)
         interface = Interface(server, socket)
+        interface.batch_requests = self.config.get('batch_requests', False)
         interface.blockchain = None
         interface.tip_header = None
         interface.tip = 0
@@ -850,6 +879,7 @@ class Network(util.DaemonThread):
                 self.connection_down(interface.server)
             elif interface.ping_required():
                 self.queue_request('server.ping', [], interface)
+            interface.prune_send_times()
 
         now = time.time()
         # nodes
@@ -878,49 +908,139 @@ class Network(util.DaemonThread):
                 if self.config.is_fee_estimates_update_required():
                     self.request_fee_estimates()
 
-    def request_chunk(self, interface, index):
-        if index in self.requested_chunks:
+    def request_chunk(self, interface, index, catch_up=None):
+        catch_up = catch_up or interface
+        key = index, catch_up
+        if key in self.requested_chunks or key in self.received_chunks:
             return
         interface.print_error("requesting chunk %d" % index)
-        self.requested_chunks.add(index)
+        self.requested_chunks[key] = interface
         height = index * 2016
         self.queue_request('blockchain.block.headers', [height, 2016],
                            interface)
 
+    def get_chunk_servers(self, interface, index):
+        '''Interfaces whose tip covers chunk index of interface catching up,
+        starting with interface.'''
+        last_height = min(index * 2016 + 2015, interface.tip)
+        with self.interface_lock:
+            interfaces = sorted(self.interfaces.values(), key=lambda i: i.server)
+        return [interface] + [i for i in interfaces if i != interface and i.tip >= last_height]
+
+    def request_chunks(self, interface, index):
+        '''Request chunks from index on for interface catching up, keeping
+        up to CHUNK_PIPELINE_SIZE in flight. Each chunk is asked from one
+        of the interfaces whose tip covers it, in turn.'''
+        pending = [i for i, c in self.requested_chunks if c == interface]
+        pending += [i for i, c in self.received_chunks if c == interface]
+        if pending:
+            index = max(max(pending) + 1, index)
+        while len(pending) < CHUNK_PIPELINE_SIZE and index * 2016 <= interface.tip:
+            servers = self.get_chunk_servers(interface, index)
+            self.request_chunk(servers[index % len(servers)], index, interface)
+            pending.append(index)
+            index += 1
+
+    def retry_chunk(self, server_interface, index, catch_up):
+        '''Ask again for a chunk server_interface failed to send, from
+        another interface if one can serve it. After MAX_CHUNK_ERRORS
+        failures only the interface catching up is asked, and it is
+        dropped if it fails as well.'''
+        key = index, catch_up
+        errors = self.chunk_errors[key] = self.chunk_errors.get(key, 0) + 1
+        if errors > MAX_CHUNK_ERRORS:
+            if server_interface == catch_up:
+                self.connection_down(catch_up.server)
+                return
+            servers = []
+        else:
+            servers = [i for i in self.get_chunk_servers(catch_up, index) if i != server_interface]
+        self.request_chunk(servers[index % len(servers)] if servers else catch_up, index, catch_up)
+
+    def cancel_chunks(self, interface):
+        '''Forget chunks asked from or on behalf of interface. Chunks another
+        interface was waiting for are asked again from that interface.'''
+        retry = []
+        for key, server_interface in list(self.requested_chunks.items()):
+            index, catch_up = key
+            if interface in (server_interface, catch_up):
+                del self.requested_chunks[key]
+                if catch_up != interface:
+                    retry.append((catch_up, index))
+        for key in list(self.received_chunks):
+            if key[1] == interface:
+                del self.received_chunks[key]
+        for key in list(self.chunk_errors):
+            if key[1] == interface:
+                del self.chunk_errors[key]
+        for catch_up, index in retry:
+            self.request_chunk(catch_up, index)
+
     def on_block_headers(self, interface, response):
         '''Handle receiving a chunk of block headers'''
         error = response.get('error')
         result = response.get('result')
         params = response.get('params')
-        blockchain = interface.blockchain
-        if result is None or params is None or error is not None:
-            interface.print_error(error or 'bad response')
-            return
         # Ignore unsolicited chunks
-        height = params[0]
-        index = height // 2016
-        if index * 2016 != height or index not in self.requested_chunks:
-            interface.print_error("received chunk %d (unsolicited)" % index)
+        height = params[0] if params else None
+        index = height // 2016 if height is not None else None
+        keys = [key for key, server_interface in self.requested_chunks.items()
+                if key[0] == index and server_interface == interface]
+        if not keys or index * 2016 != height:
+            interface.print_error("received chunk %s (unsolicited)" % index)
             return
-        else:
-            interface.print_error("received chunk %d" % index)
-        self.requested_chunks.remove(index)
-        hexdata = result['hex']
-        connect = blockchain.connect_chunk(index, hexdata)
-        if not connect:
-            self.connection_down(interface.server)
+        # the same chunk may have been asked from interface for several
+        # interfaces catching up; each response answers one request
+        key = keys[0]
+        del self.requested_chunks[key]
+        catch_up = key[1]
+        if result is None or error is not None:
+            interface.print_error(error or 'bad response')
+            self.retry_chunk(interface, index, catch_up)
             return
-        if index >= len(blockchain.checkpoints):
-            # If not finished, get the next chunk
-            if blockchain.height() < interface.tip:
-                self.request_chunk(interface, index+1)
+        interface.print_error("received chunk %d" % index)
+        self.received_chunks[key] = interface, result['hex']
+        self.connect_chunks(catch_up)
+
+    def connect_chunks(self, interface):
+        '''Connect the chunks received for interface. Past the checkpoints,
+        a chunk is only connected right above the blockchain tip.'''
+        blockchain = interface.blockchain
+        caught_up = False
+        while True:
+            indices = sorted(i for i, c in self.received_chunks if c == interface)
+            if not indices:
+                break
+            index = indices[0]
+            next_index = (blockchain.height() + 1) // 2016
+            if len(blockchain.checkpoints) <= index < next_index:
+                # already connected, e.g. asked again after an error
+                self.received_chunks.pop((index, interface))
+                continue
+            if index > next_index and index >= len(blockchain.checkpoints):
+                # wait for the previous chunks
+                break
+            server_interface, hexdata = self.received_chunks.pop((index, interface))
+            self.chunk_errors.pop((index, interface), None)
+            connect = blockchain.connect_chunk(index, hexdata)
+            if not connect:
+                self.connection_down(server_interface.server)
+                if server_interface != interface and interface.server in self.interfaces:
+                    self.request_chunk(interface, index)
+                return
+            if index >= len(blockchain.checkpoints):
+                caught_up = True
             else:
+                # the verifier must have asked for this chunk
+                pass
+        if caught_up:
+            # If not finished, get the next chunks
+            if blockchain.height() < interface.tip:
+                self.request_chunks(interface, (blockchain.height() + 1) // 2016)
+            elif not any(c == interface for _, c in self.requested_chunks):
                 interface.mode = 'default'
                 interface.print_error('catch up done', blockchain.height())
                 blockchain.catch_up = None
-        else:
-            # the verifier must have asked for this chunk
-            pass
         self.notify('updated')
 
     def on_get_header(self, interface, response):
@@ -993,8 +1113,7 @@ class Network(util.DaemonThread):
                         next_height = interface.bad
                     else:
                         interface.print_error('forkpoint conflicts with existing fork', branch.path())
-                        branch.write(b'', 0)
-                        branch.write_offset(bytes(8), 0)
+                        branch.reset()
                         branch.save_header(interface.bad_header)
                         interface.mode = 'catch_up'
                         interface.blockchain = branch
@@ -1050,7 +1169,7 @@ class Network(util.DaemonThread):
         # If not finished, get the next header
         if next_height is not None:
             if interface.mode == 'catch_up' and interface.tip > next_height + 5:
-                self.request_chunk(interface, next_height // 2016)
+                self.request_chunks(interface, next_height // 2016)
             else:
                 self.request_header(interface, next_height)
         else:
@@ -1070,23 +1189,43 @@ class Network(util.DaemonThread):
                 self.connection_down(interface.server)
                 continue
 
+    def wakeup(self):
+        '''Interrupt wait_on_sockets. Call after giving the network
+        thread work from outside a server response.'''
+        try:
+            self.wakeup_w.send(b'\0')
+        except OSError:
+            # buffer full: a wakeup is already pending
+            pass
+
+    def add_jobs(self, jobs):
+        util.DaemonThread.add_jobs(self, jobs)
+        self.wakeup()
+
+    def stop(self):
+        util.DaemonThread.stop(self)
+        self.wakeup()
+
     def wait_on_sockets(self):
-        # Python docs say Windows doesn't like empty selects.
-        # Sleep to prevent busy looping
-        if not self.interfaces:
-            time.sleep(0.1)
-            return
         with self.interface_lock:
             interfaces = list(self.interfaces.values())
-        rin = [i for i in interfaces]
+        # always select on wakeup_r; Windows doesn't like empty selects
+        rin = [self.wakeup_r] + interfaces
         win = [i for i in interfaces if i.num_requests()]
         try:
-            rout, wout, xout = select.select(rin, win, [], 0.1)
+            rout, wout, xout = select.select(rin, win, [], SELECT_TIMEOUT)
         except socket.error as e:
             if e.errno == errno.EINTR:
                 return
             raise
         assert not xout
+        if self.wakeup_r in rout:
+            rout.remove(self.wakeup_r)
+            try:
+                while self.wakeup_r.recv(4096):
+                    pass
+            except OSError:
+                pass
         for interface in wout:
             interface.send_requests()
         for interface in rout:
@@ -1118,8 +1257,7 @@ class Network(util.DaemonThread):
                 self.wait_on_sockets()
             except InvalidFile:
                 self.print_error("Headers file is invalid and needs to be recreated.")
-                os.remove(self.blockchains[0].offset_path())
-                self.init_headers_file()
+                self.remove_headers()
                 continue # TODO: The app will wait until the request times out. Faster solution needed.
             self.maintain_requests()
             self.run_jobs()    # Synchronizer and Verifier
@@ -1181,20 +1319,19 @@ class Network(util.DaemonThread):
             else:
                 self.print_error("chain already catching up with", chain.catch_up.server)
 
-    def rescan_blockchain(self):
+    def remove_headers(self):
         with self.blockchains_lock:
-            b = self.blockchains[0]
-            filename = b.path()
-            if os.path.exists(filename):
-                os.remove(filename)
-            offset_path = b.offset_path()
-            if os.path.exists(offset_path):
-                os.remove(offset_path)
-            self.sub_cache = {} 
+            blockchain.remove_headers(self.config)
             self.blockchains = blockchain.read_blockchains(self.config)
             self.blockchain_index = 0
             self.init_headers_file()
 
+    def rescan_blockchain(self):
+        self.sub_cache = {}
+        self.remove_headers()
+        # the wallets parse the policy transactions again
+        self.policy_tracker.clear()
+
     @with_interface_lock
     def blockchain(self):
         if self.interface and self.interface.blockchain is not None:
@@ -1212,6 +1349,20 @@ class Network(util.DaemonThread):
                 out[k] = r
         return out
 
+    def get_interface_stats(self):
+        with self.interface_lock:
+            interfaces = list(self.interfaces.values())
+        return {i.server: i.get_stats() for i in interfaces}
+
+    def get_header_cache_stats(self):
+        with self.blockchains_lock:
+            blockchain_items = list(self.blockchains.values())
+        stats = {'size': 0, 'hits': 0, 'misses': 0}
+        for b in blockchain_items:
+            for k, v in b.get_cache_stats().items():
+                stats[k] += v
+        return stats
+
     def follow_chain(self, index):
         blockchain = self.blockchains.get(index)
         if blockchain:
@@ -0,0 +1,332 @@
+# Electrum - lightweight Ocean client
+# Copyright (C) 2018 The Electrum Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import hashlib
+import json
+import os
+import random
+import threading
+
+from . import bitcoin, constants
+from .bitcoin import TYPE_ADDRESS, TYPE_PUBKEY, TYPE_DATA
+from .transaction import (Transaction, TxOutPoint, get_data_from_policy_output_script,
+                          parse_whitelistScriptSig)
+from .util import ThreadJob, bfh, bh2u
+from .whitelist import WhitelistSet
+
+
+def get_policy_output_address(output):
+    if output.type == TYPE_ADDRESS:
+        return output.address
+    if output.type == TYPE_PUBKEY:
+        return bitcoin.public_key_to_p2pkh(bfh(output.address))
+    return None
+
+
+def get_kyc_pubkeys(tx):
+    """Yields (pubkey, n) for the KYC pubkeys published in the outputs
+    of a whitelist transaction."""
+    for n, output in enumerate(tx.outputs()):
+        if output.asset != constants.net.WHITELISTASSET:
+            continue
+        datatype, payload = get_data_from_policy_output_script(bfh(output.scriptPubKey))
+        if datatype != TYPE_DATA:
+            continue
+        # the bytes after the first nrev are reversed
+        nrev = 3
+        if len(payload) <= nrev:
+            continue
+        yield bh2u(bytes(payload[:nrev]) + bytes(reversed(payload[nrev:]))), n
+
+
+def get_registeraddress_payload(tx):
+    """Returns (txtype, data) of a register-address or onboarding
+    transaction, or (None, None)."""
+    for output in tx.outputs():
+        decoded = dict()
+        parse_whitelistScriptSig(decoded, bfh(output.scriptPubKey))
+        if decoded:
+            return decoded['type'], decoded['data']
+    return None, None
+
+
+class PolicyTracker(ThreadJob):
+    """Follows the policy transactions of the network, i.e. the
+    transactions of the whitelist asset, once for all the wallets of
+    the daemon.
+
+    It subscribes to WHITELISTCOINSADDRESS and to the addresses that
+    received the whitelist asset, and parses each policy transaction
+    once, in history order. It keeps the set of addresses holding the
+    whitelist asset and the KYC pubkeys not yet assigned to a user, and
+    saves them in the config directory. New policy transactions are
+    passed to the wallets with the 'new_transaction' network callback.
+
+    The register-address and onboarding transactions are kept too, so
+    that wallets loaded later can replay them, see get_policy_txs.
+    """
+
+    def __init__(self, config, network):
+        self.config = config
+        self.network = network
+        self.path = os.path.join(config.path, 'policy')
+        self.whitelist_path = os.path.join(config.path, 'policy_whitelist')
+        self.lock = threading.RLock()
+        self.clear()
+        self.load()
+
+    def clear(self):
+        with self.lock:
+            # address -> history, as of the last parsed transactions
+            self.history = {}
+            self.parsed = set()
+            self.whitelist = WhitelistSet()
+            # KYC pubkey -> TxOutPoint, for pubkeys not assigned to a user yet
+            self.kyc_pubkeys = {}
+            self.kyc_outpoints = {}
+            # register-address and onboarding transactions, in history order
+            self.policy_txs = []
+            # addresses not subscribed to yet
+            self.new_addresses = {constants.net.WHITELISTCOINSADDRESS}
+            self.requested_histories = {}
+            # txids to parse, in history order; txid -> tx once received
+            self.queue = []
+            self.received = {}
+            self.changed = False
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                d = json.loads(f.read())
+            with open(self.whitelist_path, 'rb') as f:
+                whitelist = WhitelistSet.from_bytes(f.read())
+        except FileNotFoundError:
+            # policy transactions are parsed again
+            return
+        except (OSError, ValueError) as e:
+            self.print_error('cannot read policy state', e)
+            return
+        with self.lock:
+            self.history = {addr: [tuple(x) for x in h] for addr, h in d.get('history', {}).items()}
+            for h in self.history.values():
+                self.parsed.update(tx_hash for tx_hash, height in h)
+            self.whitelist = whitelist
+            for key, (txid, n) in d.get('kyc_pubkeys', {}).items():
+                self._add_kyc_pubkey(key, TxOutPoint(txid, n))
+            self.policy_txs = [tuple(x) for x in d.get('policy_txs', [])]
+            self.new_addresses |= set(self.history) | set(self.whitelist)
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            d = {
+                'history': self.history,
+                'kyc_pubkeys': self.kyc_pubkeys,
+                'policy_txs': self.policy_txs,
+            }
+            whitelist = self.whitelist.to_bytes()
+            self.changed = False
+        try:
+            with open(self.whitelist_path, 'wb') as f:
+                f.write(whitelist)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(d))
+        except OSError as e:
+            self.print_error('cannot save policy state', e)
+
+    def has_whitelist_output(self, address):
+        """Whether address holds an unspent output of the whitelist
+        asset. Addresses registered with register-address or onboarding
+        payloads are encrypted to their wallet and not in the set, so
+        False does not mean that address cannot receive funds."""
+        return address in self.whitelist
+
+    def get_unassigned_kyc_pubkey(self):
+        with self.lock:
+            if not self.kyc_pubkeys:
+                return None
+            return random.choice(list(self.kyc_pubkeys))
+
+    def get_policy_txs(self):
+        """Returns the register-address and onboarding transactions
+        parsed so far, in history order, for the wallets to replay."""
+        with self.lock:
+            policy_txs = list(self.policy_txs)
+        txs = []
+        for txid, raw in policy_txs:
+            tx = Transaction(raw)
+            tx.deserialize()
+            txs.append(tx)
+        return txs
+
+    def is_up_to_date(self):
+        with self.lock:
+            return not (self.new_addresses or self.requested_histories or self.queue)
+
+    def run(self):
+        '''Called from the network proxy thread main loop.'''
+        with self.lock:
+            addresses = self.new_addresses
+            self.new_addresses = set()
+        if addresses:
+            self.network.subscribe_to_addresses(addresses, self.on_address_status)
+
+    def get_status(self, h):
+        if not h:
+            return None
+        status = ''
+        for tx_hash, height in h:
+            status += tx_hash + ':%d:' % height
+        return bh2u(hashlib.sha256(status.encode('ascii')).digest())
+
+    def on_address_status(self, response):
+        if response.get('error'):
+            self.print_error("response error:", response)
+            return
+        addr = response['params'][0]
+        result = response['result']
+        with self.lock:
+            if self.get_status(self.history.get(addr)) == result:
+                return
+            if addr in self.requested_histories:
+                return
+            self.requested_histories[addr] = result
+        self.network.request_address_history(addr, self.on_address_history)
+
+    def on_address_history(self, response):
+        params = response.get('params')
+        if not params:
+            return
+        addr = params[0]
+        if response.get('error'):
+            self.print_error("response error:", response)
+            with self.lock:
+                self.requested_histories.pop(addr, None)
+            return
+        hist = [(item['tx_hash'], item['height']) for item in response['result']]
+        missing = []
+        with self.lock:
+            server_status = self.requested_histories.pop(addr, None)
+            if self.get_status(hist) != server_status:
+                self.print_error("error: status mismatch: %s" % addr)
+                return
+            self.history[addr] = hist
+            self.changed = True
+            for tx_hash, height in hist:
+                if tx_hash in self.parsed or tx_hash in self.received:
+                    continue
+                self.queue.append(tx_hash)
+                self.received[tx_hash] = None
+                missing.append(tx_hash)
+        if missing:
+            self.print_error("requesting policy txs", addr, len(missing))
+            self.network.get_transactions(missing, self.on_tx_response)
+        else:
+            self.parse_queue()
+
+    def on_tx_response(self, response):
+        params = response.get('params')
+        if not params:
+            return
+        tx_hash = params[0]
+        tx = None
+        if response.get('error'):
+            self.print_error("response error:", response)
+        else:
+            tx = Transaction(response['result'])
+            try:
+                tx.deserialize()
+            except Exception:
+                self.print_msg("cannot deserialize transaction, skipping", tx_hash)
+                tx = None
+            if tx and tx_hash != tx.txid():
+                tx = None
+        with self.lock:
+            if tx_hash not in self.received:
+                return
+            if tx is None:
+                # request the histories that have it again
+                self.received.pop(tx_hash)
+                self.queue.remove(tx_hash)
+                for addr, h in list(self.history.items()):
+                    if any(tx_hash == x[0] for x in h):
+                        self.history.pop(addr)
+                        self.new_addresses.add(addr)
+            else:
+                self.received[tx_hash] = tx
+        self.parse_queue()
+
+    def parse_queue(self):
+        parsed = []
+        with self.lock:
+            while self.queue and self.received.get(self.queue[0]) is not None:
+                tx_hash = self.queue.pop(0)
+                tx = self.received.pop(tx_hash)
+                self.parse_tx(tx)
+                self.parsed.add(tx_hash)
+                if tx.is_whitelist():
+                    parsed.append(tx)
+            done = not self.queue
+        for tx in parsed:
+            self.network.trigger_callback('new_transaction', tx)
+        if done:
+            self.save()
+
+    def parse_tx(self, tx):
+        with self.lock:
+            self.changed = True
+            for txin in tx.inputs():
+                if txin['type'] == 'coinbase':
+                    continue
+                prevout_hash, prevout_n = txin['prevout_hash'], txin['prevout_n']
+                # spending the output of a KYC pubkey assigns it
+                key = self.kyc_outpoints.pop(TxOutPoint(prevout_hash, prevout_n), None)
+                if key is not None:
+                    self.kyc_pubkeys.pop(key, None)
+                # spending the last whitelist output of an address removes it
+                addr = self.whitelist.spend_output(prevout_hash, prevout_n)
+                if addr is not None:
+                    self.print_error("address removed from whitelist", addr)
+            if not tx.is_whitelist():
+                return
+            txid = tx.txid()
+            for n, output in enumerate(tx.outputs()):
+                addr = get_policy_output_address(output)
+                if addr is None or addr == constants.net.WHITELISTCOINSADDRESS:
+                    continue
+                if self.whitelist.add_output(txid, n, addr) and addr not in self.history:
+                    self.new_addresses.add(addr)
+            for key, n in get_kyc_pubkeys(tx):
+                self._add_kyc_pubkey(key, TxOutPoint(txid, n))
+            if get_registeraddress_payload(tx)[0] is not None:
+                self.policy_txs.append((txid, str(tx)))
+        if self.new_addresses and self.network:
+            self.network.wakeup()
+
+    def _add_kyc_pubkey(self, key, outpoint):
+        old = self.kyc_pubkeys.pop(key, None)
+        if old is not None:
+            self.kyc_outpoints.pop(old, None)
+        self.kyc_pubkeys[key] = outpoint
+        self.kyc_outpoints[outpoint] = key
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+# Syncs synthetic competing forks and times the fork swaps, against the
+# previous swap that copied both branches between the fork files.
+# usage: python3 -m electrum.scripts.bench_forks [chain_length] [fork_depth] [rounds]
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from electrum import blockchain
+from electrum.blockchain import hash_header
+from electrum.simple_config import SimpleConfig
+from electrum.util import print_msg
+
+
+def make_headers(start, num, prev_hash, tag):
+    headers = []
+    for height in range(start, start + num):
+        header = {
+            'version': 1,
+            'prev_block_hash': prev_hash,
+            'merkle_root': tag + '%062x' % height,
+            'contract_hash': '00' * 32,
+            'attestation_hash': '00' * 32,
+            'mapping_hash': '00' * 32,
+            'timestamp': 1500000000 + height,
+            'block_height': height,
+            'challenge': '51' * 105,
+            'proof': '30' * 145,
+        }
+        headers.append(header)
+        prev_hash = hash_header(header)
+    return headers
+
+
+def old_swap(child, parent, scratch):
+    # the I/O of the previous swap_with_parent: read the child branch and
+    # the parent above the forkpoint, and write each one over the other
+    with blockchain.header_files_lock:
+        segment = parent.get_segment(child.forkpoint)
+        offsets = parent.get_offsets(segment)
+        delta = child.forkpoint - blockchain.segment_bases[segment]
+        parent_data = parent.get_headers_map(segment)[offsets[delta]:]
+        parent_offsets = blockchain.offsets_to_bytes(offsets[delta:])
+        segment = child.extents[-1][0]
+        my_data = child.get_headers_map(segment)[:]
+        my_offsets = blockchain.offsets_to_bytes(child.get_offsets(segment))
+    for name, data in (('child', parent_data), ('child_offset', parent_offsets),
+                       ('parent', my_data), ('parent_offset', my_offsets)):
+        with open(os.path.join(scratch, name), 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def main():
+    length = int(sys.argv[1]) if len(sys.argv) > 1 else 20160
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 4032
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    tmp = tempfile.mkdtemp()
+    try:
+        config = SimpleConfig({'electrum_path': tmp})
+        chains = blockchain.read_blockchains(config)
+        main_chain = chains[0]
+        with open(main_chain.path(), 'wb'):
+            pass
+        with open(main_chain.offset_path(), 'wb') as f:
+            f.write(bytes(8))
+        with main_chain.lock:
+            main_chain.update_size()
+        headers = make_headers(0, length, '00' * 32, 'aa')
+        for index in range(0, length, 2016):
+            main_chain.save_chunk(index // 2016, headers[index:index + 2016])
+
+        # the main chain and a fork take the lead in turn, by one header
+        forkpoint = length - depth
+        branches = [main_chain, None]
+        tips = [headers[-1], headers[forkpoint - 1]]
+        tags = ['aa', 'bb']
+        old = new = 0
+        sync_start = time.time()
+        for r in range(rounds):
+            i = (r + 1) % 2
+            b = branches[i]
+            height = forkpoint if b is None else b.height() + 1
+            num = blockchain.blockchains[0].height() - height + 2
+            new_headers = make_headers(height, num, hash_header(tips[i]), tags[i])
+            if b is None:
+                b = branches[i] = main_chain.fork(new_headers[0])
+                new_headers = new_headers[1:]
+            for header in new_headers[:-1]:
+                b.save_header(header)
+            scratch = tempfile.mkdtemp(dir=tmp)
+            t0 = time.time()
+            old_swap(b, b.parent(), scratch)
+            old += time.time() - t0
+            t0 = time.time()
+            b.save_header(new_headers[-1])
+            new += time.time() - t0
+            assert blockchain.blockchains[0] is b
+            tips[i] = new_headers[-1]
+        sync = time.time() - sync_start
+        print_msg("%d headers, forks %d deep, %d swaps: copy %.1f ms, manifest %.1f ms per swap (sync %.1f s)"
+                  % (length, depth, rounds, old / rounds * 1000, new / rounds * 1000, sync))
+    finally:
+        for segment in blockchain.segment_bases:
+            blockchain.release_header_file(blockchain.segment_path(config, segment))
+            blockchain.release_header_file(blockchain.segment_offset_path(config, segment))
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
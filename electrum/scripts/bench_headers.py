@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# Compares chunk parsing and hashing of the bytes header codec
+# against the previous hex/dict round trip.
+# usage: python3 -m electrum.scripts.bench_headers [num_headers]
+
+import sys
+import timeit
+
+from electrum.bitcoin import Hash, hash_encode, int_to_hex, rev_hex
+from electrum.blockchain import (deserialize_header, deserialize_headers, hash_header,
+                                 serialize_header_bytes)
+from electrum.util import bfh, print_msg
+
+
+def old_serialize_header(res, get_hash=False):
+    s = int_to_hex(res.get('version'), 4) \
+        + rev_hex(res.get('prev_block_hash')) \
+        + rev_hex(res.get('merkle_root')) \
+        + rev_hex(res.get('contract_hash'))
+    s += rev_hex(res.get('attestation_hash'))
+    s += rev_hex(res.get('mapping_hash'))
+    s += int_to_hex(int(res.get('timestamp')), 4) +\
+         int_to_hex(int(res.get('block_height')), 4)
+    challenge = res.get('challenge')
+    s += int_to_hex(int(len(challenge)/2), 1) + rev_hex(challenge)
+    if not get_hash:
+        proof = res.get('proof')
+        s += int_to_hex(int(len(proof)/2), 1) + rev_hex(proof)
+    return s
+
+
+def old_deserialize_headers(s, height):
+    headers = []
+    while s:
+        next_header = deserialize_header(s, height)
+        headers.append(next_header)
+        s = s[int(len(old_serialize_header(next_header))/2):]
+        height += 1
+    return headers
+
+
+def old_hash_header(header):
+    return hash_encode(Hash(bfh(old_serialize_header(header, True))))
+
+
+def make_chunk(num):
+    data = []
+    prev_hash = '00' * 32
+    for height in range(num):
+        header = {
+            'version': 1,
+            'prev_block_hash': prev_hash,
+            'merkle_root': '%064x' % height,
+            'contract_hash': '00' * 32,
+            'attestation_hash': '00' * 32,
+            'mapping_hash': '00' * 32,
+            'timestamp': 1500000000 + height,
+            'block_height': height,
+            'challenge': '51' * 105,
+            'proof': '30' * 145,
+        }
+        data.append(serialize_header_bytes(header))
+        prev_hash = hash_header(header)
+    return b''.join(data)
+
+
+def ingest(parse, hash_func, data):
+    for header in parse(data, 0):
+        hash_func(header)
+
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 2016
+    data = make_chunk(num)
+    assert old_deserialize_headers(data, 0) == deserialize_headers(data, 0)
+    runs = 10
+    old = timeit.timeit(lambda: ingest(old_deserialize_headers, old_hash_header, data), number=runs) / runs
+    new = timeit.timeit(lambda: ingest(deserialize_headers, hash_header, data), number=runs) / runs
+    print_msg("%d headers: dict/hex path %.1f ms, bytes path %.1f ms (%.1fx)"
+              % (num, old * 1000, new * 1000, old / new))
+
+
+if __name__ == '__main__':
+    main()
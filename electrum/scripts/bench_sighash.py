@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# Compares signature preimage construction for every input of a large
+# transaction against the previous per-input hex serialization.
+# usage: python3 -m electrum.scripts.bench_sighash [num_inputs]
+
+import sys
+import timeit
+
+from electrum import ecc
+from electrum.bitcoin import (TYPE_ADDRESS, Hash, int_to_hex, pubkey_to_address,
+                              var_int)
+from electrum.transaction import Transaction, TxOutput
+from electrum.util import bfh, bh2u, print_msg
+
+ASSET = '90f6212d141349050aca026eeb6e53a037bfaf5e0383deae7b9a5139d9724659'
+
+
+def old_serialize_preimage(tx, i):
+    nVersion = int_to_hex(tx.version, 4)
+    nHashType = int_to_hex(1, 4)
+    nLocktime = int_to_hex(tx.locktime, 4)
+    inputs = tx.inputs()
+    outputs = tx.outputs()
+    txin = inputs[i]
+    if tx.is_segwit_input(txin):
+        hashPrevouts = bh2u(Hash(bfh(''.join(tx.serialize_outpoint(txin) for txin in inputs))))
+        hashSequence = bh2u(Hash(bfh(''.join(int_to_hex(txin.get('sequence', 0xffffffff - 1), 4) for txin in inputs))))
+        hashOutputs = bh2u(Hash(bfh(''.join(tx.serialize_output(o) for o in outputs))))
+        outpoint = tx.serialize_outpoint(txin)
+        preimage_script = tx.get_preimage_script(txin)
+        scriptCode = var_int(len(preimage_script) // 2) + preimage_script
+        amount = int_to_hex(txin['value'], 8)
+        nSequence = int_to_hex(txin.get('sequence', 0xffffffff - 1), 4)
+        preimage = nVersion + hashPrevouts + hashSequence + outpoint + scriptCode + amount + nSequence + hashOutputs + nLocktime + nHashType
+    else:
+        txins = var_int(len(inputs)) + ''.join(tx.serialize_input(txin, tx.get_preimage_script(txin) if i==k else '') for k, txin in enumerate(inputs))
+        txouts = var_int(len(outputs)) + ''.join(tx.serialize_output(o) for o in outputs)
+        preimage = nVersion + txins + txouts + nLocktime + nHashType
+    return preimage
+
+
+def make_tx(num_inputs, txin_type):
+    pubkey = ecc.ECPrivkey(bytes([1] * 32)).get_public_key_hex()
+    address = pubkey_to_address('p2pkh', pubkey)
+    inputs = [{
+        'type': txin_type,
+        'prevout_hash': '%064x' % n,
+        'prevout_n': n % 3,
+        'address': address,
+        'pubkeys': [pubkey],
+        'x_pubkeys': [pubkey],
+        'signatures': [None],
+        'num_sig': 1,
+        'value': 100000 + n,
+        'sequence': 0xfffffffd,
+        'issuance': None,
+    } for n in range(num_inputs)]
+    outputs = [TxOutput(TYPE_ADDRESS, address, 50000 + n, 1, ASSET, 1)
+               for n in range(num_inputs // 10 + 1)]
+    return Transaction.from_io(inputs, outputs)
+
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    for txin_type in ['p2pkh', 'p2wpkh']:
+        tx = make_tx(num, txin_type)
+        assert all(old_serialize_preimage(tx, i) == tx.serialize_preimage(i) for i in range(num))
+        old = timeit.timeit(lambda: [Hash(bfh(old_serialize_preimage(tx, i))) for i in range(num)], number=1)
+        def new():
+            tx.invalidate_sighash_cache()
+            return [tx.pre_hash(i) for i in range(num)]
+        new = timeit.timeit(new, number=1)
+        print_msg("%d %s inputs: hex path %.1f ms, cached bytes path %.1f ms (%.1fx)"
+                  % (num, txin_type, old * 1000, new * 1000, old / new))
+
+
+if __name__ == '__main__':
+    main()
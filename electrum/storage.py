@@ -68,13 +68,33 @@ def get_derivation_used_for_hw_device_encryption():
 STO_EV_PLAINTEXT, STO_EV_USER_PW, STO_EV_XPUB_PW = range(0, 3)
 
 
+# the journal is folded into the wallet file once it grows past the
+# size of the wallet file, and at least this many bytes
+JOURNAL_MIN_COMPACT_SIZE = 1024 * 1024
+
+
+def journal_path(path):
+    return path + '.journal'
+
+
 class JsonDB(PrintError):
+    """Wallet data, saved as a JSON snapshot file plus a journal.
+
+    write() appends the keys and dict entries changed since the last
+    write to the journal file, one line per write. The journal starts
+    with the hash of the snapshot it applies to, and is folded into a
+    new snapshot once it gets large.
+    """
 
     def __init__(self, path):
         self.db_lock = threading.RLock()
         self.data = {}
         self.path = path
         self.modified = False
+        self.pending = []  # operations not written yet
+        self.snapshot_hash = None  # sha256 of the wallet file, None to rewrite it
+        self.snapshot_size = 0
+        self.journal_size = 0
 
     def get(self, key, default=None):
         with self.db_lock:
@@ -88,30 +108,115 @@ class JsonDB(PrintError):
     def put(self, key, value):
         try:
             json.dumps(key, cls=util.MyEncoder)
-            json.dumps(value, cls=util.MyEncoder)
         except Exception as err:
             self.print_error("{0}: json error: cannot save ".format(err), key)
             return
         with self.db_lock:
-            if value is not None:
-                if self.data.get(key) != value:
+            old = self.data.get(key)
+            if value is None:
+                if key in self.data:
                     self.modified = True
-                    self.data[key] = copy.deepcopy(value)
-            elif key in self.data:
+                    self.data.pop(key)
+                    self.pending.append(['del', key])
+                return
+            if isinstance(old, dict) and isinstance(value, dict):
+                # only look at the entries that changed
+                changed = [(k, v) for k, v in value.items() if k not in old or old[k] != v]
+                removed = [k for k in old if k not in value]
+                if all(type(k) is str for k, v in changed) and all(type(k) is str for k in removed):
+                    try:
+                        json.dumps(changed, cls=util.MyEncoder)
+                    except Exception as err:
+                        self.print_error("{0}: json error: cannot save ".format(err), key)
+                        return
+                    for k in removed:
+                        old.pop(k)
+                        self.pending.append(['delitem', key, k])
+                    for k, v in changed:
+                        old[k] = copy.deepcopy(v)
+                        self.pending.append(['setitem', key, k, old[k]])
+                    if changed or removed:
+                        self.modified = True
+                    return
+            if old != value:
+                try:
+                    json.dumps(value, cls=util.MyEncoder)
+                except Exception as err:
+                    self.print_error("{0}: json error: cannot save ".format(err), key)
+                    return
                 self.modified = True
-                self.data.pop(key)
+                self.data[key] = copy.deepcopy(value)
+                self.pending.append(['set', key, self.data[key]])
+
+    def apply_ops(self, ops):
+        for op in ops:
+            if op[0] == 'set':
+                self.data[op[1]] = op[2]
+            elif op[0] == 'del':
+                self.data.pop(op[1], None)
+            elif op[0] == 'setitem':
+                self.data.setdefault(op[1], {})[op[2]] = op[3]
+            elif op[0] == 'delitem':
+                self.data.get(op[1], {}).pop(op[2], None)
+
+    def read_journal(self, raw, decrypt):
+        """Replay the journal written after the wallet file contents raw.
+        Sizes are in bytes."""
+        raw = raw.encode('utf8')
+        self.snapshot_hash = hashlib.sha256(raw).hexdigest()
+        self.snapshot_size = len(raw)
+        self.journal_size = 0
+        try:
+            with open(journal_path(self.path), 'rb') as f:
+                lines = f.read().split(b'\n')
+        except FileNotFoundError:
+            return
+        # the last item is what follows the last newline: empty, or the
+        # part of a write interrupted before its fsync
+        if len(lines) < 2:
+            return
+        try:
+            header = json.loads(lines[0].decode('utf-8'))
+        except ValueError:
+            header = None
+        if not isinstance(header, dict) or header.get('snapshot') != self.snapshot_hash:
+            # left over from an older wallet file, which contains it already
+            return
+        size = len(lines[0]) + 1
+        for line in lines[1:-1]:
+            try:
+                ops = json.loads(decrypt(line.decode('utf-8')))
+            except Exception:
+                # a torn write; discard the rest
+                break
+            self.apply_ops(ops)
+            size += len(line) + 1
+        # the next append truncates the journal to what was replayed
+        self.journal_size = size
+        self.print_error("replayed journal", size)
 
     @profiler
-    def write(self):
+    def write(self, compact=False):
         with self.db_lock:
-            self._write()
+            self._write(compact)
 
-    def _write(self):
+    def _write(self, compact=False):
         if threading.currentThread().isDaemon():
             self.print_error('warning: daemon thread cannot write db')
             return
+        if compact and self.journal_size:
+            self.modified = True
         if not self.modified:
             return
+        if (compact or self.snapshot_hash is None
+                or self.journal_size > max(JOURNAL_MIN_COMPACT_SIZE, self.snapshot_size)):
+            self._write_snapshot()
+        else:
+            self._append_journal()
+        self.pending = []
+        self.modified = False
+
+    def _write_snapshot(self):
         s = json.dumps(self.data, indent=4, sort_keys=True, cls=util.MyEncoder)
         s = self.encrypt_before_writing(s)
 
@@ -129,8 +234,32 @@ class JsonDB(PrintError):
             os.remove(self.path)
             os.rename(temp_path, self.path)
         os.chmod(self.path, mode)
+        # the journal does not match the new file anymore
+        if os.path.exists(journal_path(self.path)):
+            os.remove(journal_path(self.path))
+        s = s.encode('utf8')
+        self.snapshot_hash = hashlib.sha256(s).hexdigest()
+        self.snapshot_size = len(s)
+        self.journal_size = 0
         self.print_error("saved", self.path)
-        self.modified = False
+
+    def _append_journal(self):
+        line = self.encrypt_before_writing(json.dumps(self.pending, cls=util.MyEncoder)) + '\n'
+        path = journal_path(self.path)
+        if self.journal_size == 0:
+            line = json.dumps({'snapshot': self.snapshot_hash}) + '\n' + line
+        data = line.encode('utf-8')
+        with open(path, 'r+b' if self.journal_size else 'wb') as f:
+            # drop anything after the last complete write, e.g. a torn line
+            f.seek(self.journal_size)
+            f.truncate()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if self.journal_size == 0:
+            os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+        self.journal_size += len(data)
+        self.print_error("saved journal", path, len(data))
 
     def encrypt_before_writing(self, plaintext: str) -> str:
         return plaintext
@@ -138,6 +267,12 @@ class JsonDB(PrintError):
     def file_exists(self):
         return self.path and os.path.exists(self.path)
 
+    def delete(self):
+        """Remove the wallet file and its journal."""
+        os.unlink(self.path)
+        if os.path.exists(journal_path(self.path)):
+            os.unlink(journal_path(self.path))
+
 
 class WalletStorage(JsonDB):
 
@@ -157,7 +292,7 @@ class WalletStorage(JsonDB):
             # avoid new wallets getting 'upgraded'
             self.put('seed_version', FINAL_SEED_VERSION)
 
-    def load_data(self, s):
+    def load_data(self, s, decrypt=lambda x: x):
         try:
             self.data = json.loads(s)
         except:
@@ -175,6 +310,7 @@ class WalletStorage(JsonDB):
                     self.print_error('Failed to convert label to json format', key)
                     continue
                 self.data[key] = value
+        self.read_journal(self.raw, decrypt)
 
         # check here if I need to load a plugin
         t = self.get('wallet_type')
@@ -246,14 +382,14 @@ class WalletStorage(JsonDB):
 
     def decrypt(self, password):
         ec_key = self.get_eckey_from_password(password)
+        enc_magic = self._get_encryption_magic()
+        decrypt = lambda c: zlib.decompress(ec_key.decrypt_message(c, enc_magic)).decode('utf8')
         if self.raw:
-            enc_magic = self._get_encryption_magic()
-            s = zlib.decompress(ec_key.decrypt_message(self.raw, enc_magic))
+            s = decrypt(self.raw)
         else:
             s = None
         self.pubkey = ec_key.get_public_key_hex()
-        s = s.decode('utf8')
-        self.load_data(s)
+        self.load_data(s, decrypt)
 
     def encrypt_before_writing(self, plaintext: str) -> str:
         s = plaintext
@@ -296,9 +432,10 @@ class WalletStorage(JsonDB):
         else:
             self.pubkey = None
             self._encryption_version = STO_EV_PLAINTEXT
-        # make sure next storage.write() saves changes
+        # make sure next storage.write() saves changes, re-encrypted
         with self.db_lock:
             self.modified = True
+            self.snapshot_hash = None
 
     def requires_split(self):
         d = self.get('accounts', {})
@@ -29,7 +29,6 @@ import hashlib
 from .transaction import Transaction
 from .util import ThreadJob, bh2u
 from . import bitcoin
-from . import constants
 
 
 class Synchronizer(ThreadJob):
@@ -51,8 +50,6 @@ class Synchronizer(ThreadJob):
         self.requested_tx = {}
         self.requested_histories = {}
         self.requested_addrs = set()
-        # Addresses that have received whitelist asset
-        self.whitelist_addrs = set()
         self.lock = Lock()
 
         self.initialized = False
@@ -71,18 +68,11 @@ class Synchronizer(ThreadJob):
     def release(self):
         self.network.unsubscribe(self.on_address_status)
 
-    def add_whitelist(self, address):
-        with self.lock:
-            self.whitelist_addrs.add(address)
-
-    def remove_whitelist(self, address):
-        with self.lock:
-            self.whitelist_addrs.discard(address)
-        
     def add(self, address):
         '''This can be called from the proxy or GUI threads.'''
         with self.lock:
             self.new_addresses.add(address)
+        self.network.wakeup()
 
     def subscribe_to_addresses(self, addresses):
         if addresses:
@@ -148,8 +138,7 @@ class Synchronizer(ThreadJob):
             self.print_error("error: status mismatch: %s" % addr)
         else:
             # Store received history
-            is_whitelist = addr in self.whitelist_addrs
-            self.wallet.receive_history_callback(addr, hist, tx_fees, is_whitelist)
+            self.wallet.receive_history_callback(addr, hist, tx_fees)
             # Request transactions we don't have
             self.request_missing_txs(hist)
         # Remove request; this allows up_to_date to be True
@@ -211,8 +200,6 @@ class Synchronizer(ThreadJob):
             self.print_error("missing tx", self.requested_tx)
         addrset=set(self.wallet.get_addresses())    
         self.subscribe_to_addresses(addrset)
-        self.add_whitelist(constants.net.WHITELISTCOINSADDRESS)
-        self.add(constants.net.WHITELISTCOINSADDRESS)
         self.initialized = True
 
     def run(self):
@@ -0,0 +1,140 @@
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from electrum import asset_mapping
+from electrum.asset_mapping import AssetMapping
+from electrum.simple_config import SimpleConfig
+
+from . import SequentialTestCase
+
+
+TOKEN1 = '11' * 32
+TOKEN2 = '22' * 32
+
+AMAP = {
+    "assets": {
+        "0": {"ref": "123-2018-ABC", "tokenid": TOKEN1, "mass": 400.0},
+        "1": {"ref": "124-2018-ABC", "tokenid": TOKEN1, "mass": 350.5},
+        "2": {"ref": "124-2018-ABC", "tokenid": TOKEN2, "mass": 12.25},
+        "3": {"ref": "125-2019-XYZ", "tokenid": '33' * 32, "mass": 1.0},
+    },
+    "n": 2, "m": 3, "time": 1540000000, "height": 1000, "sigs": {},
+}
+
+
+def scan_owned_assets(amap, tokens, tokrat):
+    # nested scans over the whole mapping, as done by the assets tab
+    ownassets = {}
+    tokens = {k: float(v) for k, v in tokens.items()}
+    for tokenid in tokens:
+        for i, j in amap["assets"].items():
+            if j["tokenid"] == tokenid:
+                if j["ref"] in ownassets:
+                    ownassets[j["ref"]] += tokens[tokenid]
+                else:
+                    ownassets[j["ref"]] = tokens[tokenid]
+                if j["mass"] < tokens[tokenid]*tokrat/1.0E+8:
+                    tokens[tokenid] -= j["mass"]*1.0E+8/tokrat
+                else:
+                    tokens[tokenid] = 0
+    return ownassets
+
+
+class TestAssetMapping(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.electrum_dir = tempfile.mkdtemp()
+        self.config = SimpleConfig({'electrum_path': self.electrum_dir, 'get_map': True})
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.electrum_dir)
+
+    def test_indexes(self):
+        mapping = AssetMapping(self.config, None)
+        mapping.set_mapping(AMAP)
+        self.assertEqual(400.0, mapping.get_mass_assetid("123-2018-ABC"))
+        self.assertEqual(362.75, mapping.get_mass_assetid("124-2018-ABC"))
+        self.assertEqual(0.0, mapping.get_mass_assetid("nope"))
+        self.assertEqual(2, len(mapping.by_tokenid[TOKEN1]))
+        tokrat = 0.0975
+        for tokens in [{TOKEN1: 500000000000}, {TOKEN1: 800000000000, TOKEN2: 1000}, {'44' * 32: 5}]:
+            owned = {ref: x for ref, mass, x in mapping.get_owned_assets(tokens, tokrat)}
+            self.assertEqual(scan_owned_assets(AMAP, tokens, tokrat), owned)
+
+    def test_unsigned_mapping_not_verified(self):
+        self.assertFalse(AssetMapping.verify_mapping_sig(AMAP))
+        self.assertFalse(AssetMapping.verify_mapping_sig({}))
+
+    def _run_inline(self):
+        return mock.patch('electrum.asset_mapping.Thread',
+                          side_effect=lambda target, args: mock.Mock(start=lambda: target(*args)))
+
+    def test_fetch_refreshed(self):
+        network = mock.Mock()
+        mapping = AssetMapping(self.config, network)
+        mapping_hash = 'ab' * 32
+        with mock.patch.object(mapping, 'get_header_mapping_hash', return_value=mapping_hash), \
+                mock.patch.object(AssetMapping, 'fetch', return_value=(AMAP, 'connected')) as fetch, \
+                mock.patch.object(AssetMapping, 'verify_mapping_sig', return_value=True) as verify, \
+                self._run_inline():
+            mapping.run()
+            mapping.run()
+            self.assertEqual(1, fetch.call_count)
+            self.assertEqual(1, verify.call_count)
+            network.trigger_callback.assert_called_once_with('asset_mapping')
+            self.assertEqual('connected', mapping.status)
+            self.assertTrue(mapping.verified)
+            # the same mapping_hash does not prove the mapping is unchanged
+            now = time.time() + asset_mapping.MAPPING_REFRESH_INTERVAL + 1
+            with mock.patch('electrum.asset_mapping.time.time', return_value=now):
+                mapping.run()
+            self.assertEqual(2, fetch.call_count)
+            # nor is the cache trusted at startup
+            mapping2 = AssetMapping(self.config, network)
+            with mock.patch.object(mapping2, 'get_header_mapping_hash', return_value=mapping_hash):
+                mapping2.run()
+            self.assertEqual(3, fetch.call_count)
+
+    def test_cache_used_when_offline(self):
+        network = mock.Mock()
+        mapping_hash = 'ab' * 32
+        AssetMapping(self.config, network).write_cache(mapping_hash, AMAP)
+        mapping = AssetMapping(self.config, network)
+        with mock.patch.object(mapping, 'get_header_mapping_hash', return_value=mapping_hash), \
+                mock.patch.object(mapping, 'fetch', return_value=(None, 'connection_error')), \
+                self._run_inline():
+            mapping.run()
+            self.assertEqual('connected', mapping.status)
+            self.assertEqual(400.0, mapping.get_mass_assetid("123-2018-ABC"))
+            # once a mapping is loaded, a failed refresh keeps it
+            mapping.update_safe(mapping_hash)
+            self.assertEqual('connected', mapping.status)
+            self.assertTrue(mapping.verified)
+            self.assertEqual(400.0, mapping.get_mass_assetid("123-2018-ABC"))
+            self.assertEqual(1, network.trigger_callback.call_count)
+
+    def test_failed_refresh_keeps_verified_mapping(self):
+        network = mock.Mock()
+        mapping = AssetMapping(self.config, network)
+        mapping_hash = 'ab' * 32
+        with mock.patch.object(AssetMapping, 'verify_mapping_sig', side_effect=lambda amap: amap is AMAP):
+            with mock.patch.object(mapping, 'fetch', return_value=(AMAP, 'connected')):
+                mapping.update_safe(mapping_hash)
+            network.trigger_callback.reset_mock()
+            for result in [(None, 'timeout_error'), ({'assets': {}}, 'connected')]:
+                with mock.patch.object(mapping, 'fetch', return_value=result):
+                    mapping.update_safe(mapping_hash)
+                self.assertEqual('connected', mapping.status)
+                self.assertTrue(mapping.verified)
+                self.assertEqual(400.0, mapping.get_mass_assetid("123-2018-ABC"))
+            network.trigger_callback.assert_not_called()
+            # after reset, a failed fetch of an uncached mapping is reported
+            mapping.reset()
+            with mock.patch.object(mapping, 'fetch', return_value=(None, 'timeout_error')):
+                mapping.update_safe('cd' * 32)
+            self.assertEqual('timeout_error', mapping.status)
+            network.trigger_callback.assert_called_once_with('asset_mapping')
@@ -11,7 +11,8 @@ from electrum.bitcoin import (
     deserialize_privkey, serialize_privkey, is_segwit_address,
     is_b58_address, address_to_scripthash, is_minikey, is_compressed, is_xpub,
     xpub_type, is_xprv, is_bip32_derivation, seed_type, EncodeBase58Check,
-    script_num_to_hex, push_script, add_number_to_script, int_to_hex)
+    script_num_to_hex, push_script, add_number_to_script, int_to_hex,
+    deserialize_xprv, deserialize_xpub, CKD_pub_range, tweak_priv)
 from electrum import ecc, crypto, constants
 from electrum.ecc import number_to_string, string_to_number
 from electrum.transaction import opcodes
@@ -204,6 +205,20 @@ class Test_bitcoin(SequentialTestCase):
             self.assertEqual(plaintext, key.decrypt_message(ciphertext2))
             self.assertNotEqual(ciphertext1, ciphertext2)
 
+    def test_decrypt_message_ecdh_cache(self):
+        key = WalletStorage.get_eckey_from_password('secret_password77')
+        ciphertext1 = key.encrypt_message(b'first')
+        ciphertext2 = key.encrypt_message(b'second')
+        cache = {}
+        self.assertEqual(b'first', key.decrypt_message(ciphertext1, ecdh_cache=cache))
+        self.assertEqual(1, len(cache))
+        self.assertEqual(b'first', key.decrypt_message(ciphertext1, ecdh_cache=cache))
+        self.assertEqual(1, len(cache))
+        self.assertEqual(b'second', key.decrypt_message(ciphertext2, ecdh_cache=cache))
+        self.assertEqual(2, len(cache))
+        with self.assertRaises(Exception):
+            key.decrypt_message(ciphertext1[:-4] + b'AAA=', ecdh_cache=cache)
+
     @needs_test_with_all_ecc_implementations
     def test_sign_transaction(self):
         eckey1 = ecc.ECPrivkey(bfh('7e1255fddb52db1729fc3ceb21a46f95b8d9fe94cc83425e936a6c5223bb679d'))
@@ -433,6 +448,21 @@ class Test_xprv_xpub(SequentialTestCase):
         self.assertEqual("xpub6FnCn6nSzZAw5Tw7cgR9bi15UV96gLZhjDstkXXxvCLsUXBGXPdSnLFbdpq8p9HmGsApME5hQTZ3emM2rnY5agb9rXpVGyy3bdW6EEgAtqt", xpub)
         self.assertEqual("xprvA2nrNbFZABcdryreWet9Ea4LvTJcGsqrMzxHx98MMrotbir7yrKCEXw7nadnHM8Dq38EGfSh6dqA9QWTyefMLEcBYJUuekgW4BYPJcr9E7j", xprv)
 
+    def test_CKD_pub_range(self):
+        xprv, xpub = bip32_root(bfh("000102030405060708090a0b0c0d0e0f"), 'standard')
+        _, _, _, _, c, cK = deserialize_xpub(bip32_public_derivation(xpub, "m/", "m/0"))
+        tweak = bfh("8f1c1c5e0d5f6a1b2c3d4e5f60718293a4b5c6d7e8f90a1b2c3d4e5f60718293")
+        expected, expected_tweaked = [], []
+        for n in range(3, 8):
+            _, _, _, _, _, k = deserialize_xprv(bip32_private_derivation(xprv, "m/", "m/0/%d" % n)[0])
+            expected.append(ecc.ECPrivkey(k).get_public_key_bytes(compressed=True))
+            expected_tweaked.append(ecc.ECPrivkey(tweak_priv(k, tweak)).get_public_key_bytes(compressed=True))
+        self.assertEqual(expected, CKD_pub_range(cK, c, 3, 8))
+        self.assertEqual(expected_tweaked, CKD_pub_range(cK, c, 3, 8, tweak))
+        self.assertEqual([], CKD_pub_range(cK, c, 8, 8))
+        with self.assertRaises(ecc.InvalidECPointException):
+            CKD_pub_range(cK, c, 0, 1, number_to_string(ecc.CURVE_ORDER, ecc.CURVE_ORDER))
+
     @needs_test_with_all_ecc_implementations
     def test_xpub_from_xprv(self):
         """We can derive the xpub key from a xprv."""
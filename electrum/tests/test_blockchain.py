@@ -0,0 +1,295 @@
+import shutil
+import tempfile
+import os
+from unittest import mock
+
+from electrum import blockchain, constants, ecc
+from electrum.bitcoin import rev_hex, push_script
+from electrum.blockchain import (Blockchain, serialize_header, serialize_header_bytes,
+                                 deserialize_header, deserialize_headers, hash_header,
+                                 verify_header_proof)
+from electrum.constants import VersionedValue
+from electrum.simple_config import SimpleConfig
+from electrum.transaction import multisig_script
+from electrum.util import bfh, bh2u
+
+from . import SequentialTestCase
+
+
+def make_header(height, prev_hash, challenge_len=69, proof_len=72):
+    return {
+        'version': 1,
+        'prev_block_hash': prev_hash,
+        'merkle_root': '%064x' % (height + 1),
+        'contract_hash': '00' * 32,
+        'attestation_hash': '00' * 32,
+        'mapping_hash': '00' * 32,
+        'timestamp': 1500000000 + height,
+        'block_height': height,
+        'challenge': 'ab' * challenge_len,
+        'proof': 'cd' * proof_len,
+    }
+
+
+class TestHeaderCodec(SequentialTestCase):
+
+    def test_deserialize_headers_variable_length(self):
+        headers = [make_header(h, '%064x' % h, 1 + h % 70, h % 3 * 40) for h in range(10)]
+        data = b''.join(serialize_header_bytes(h) for h in headers)
+        self.assertEqual(headers, deserialize_headers(data, 0))
+
+    def test_serialize_header_hex_matches_bytes(self):
+        header = make_header(7, '11' * 32)
+        self.assertEqual(bh2u(serialize_header_bytes(header)), serialize_header(header))
+        self.assertEqual(header, deserialize_header(serialize_header_bytes(header), 7))
+        self.assertEqual('ac64abe65d7497160825c0f6e4859cf20db13b07d642dcd85248b0087f8843d8',
+                         hash_header(header))
+
+
+class TestBlockchain(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.data_dir = tempfile.mkdtemp()
+        self.config = SimpleConfig({'electrum_path': self.data_dir})
+        blockchain.blockchains = {}
+        os.mkdir(os.path.join(self.data_dir, 'forks'))
+        b = Blockchain(self.config, 0, None)
+        with open(b.path(), 'wb'):
+            pass
+        with open(b.offset_path(), 'wb') as f:
+            f.write(bytes(8))
+        with b.lock:
+            b.update_size()
+        blockchain.blockchains[0] = b
+        self.chain = b
+
+    def tearDown(self):
+        for segment in blockchain.segment_bases:
+            blockchain.release_header_file(blockchain.segment_path(self.config, segment))
+            blockchain.release_header_file(blockchain.segment_offset_path(self.config, segment))
+        blockchain.blockchains = {}
+        blockchain.segment_bases = {0: 0}
+        shutil.rmtree(self.data_dir)
+        super().tearDown()
+
+    def _build_chain(self, length):
+        headers = []
+        prev_hash = '00' * 32
+        for height in range(length):
+            # vary the challenge and proof sizes to get variable-length headers
+            header = make_header(height, prev_hash, 60 + height % 10, 70 + height % 3)
+            self.chain.save_header(header)
+            headers.append(header)
+            prev_hash = hash_header(header)
+        return headers
+
+    def _fork_headers(self, parent_header, length, tag):
+        headers = []
+        prev_hash = hash_header(parent_header)
+        for height in range(parent_header['block_height'] + 1, parent_header['block_height'] + 1 + length):
+            header = make_header(height, prev_hash, 50 + height % 7, 71)
+            header['merkle_root'] = tag * 32
+            headers.append(header)
+            prev_hash = hash_header(header)
+        return headers
+
+    def _read_file(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def _assert_branch(self, b, headers):
+        self.assertEqual(headers[0]['block_height'], b.forkpoint)
+        self.assertEqual(headers[-1]['block_height'], b.height())
+        for header in headers:
+            self.assertEqual(header, b.read_header(header['block_height']))
+
+    def test_read_header_variable_length(self):
+        headers = self._build_chain(20)
+        self.assertEqual(19, self.chain.height())
+        for header in headers:
+            self.assertEqual(header, self.chain.read_header(header['block_height']))
+        self.assertIsNone(self.chain.read_header(20))
+
+    def test_in_memory_view_matches_disk(self):
+        headers = self._build_chain(10)
+        # a fresh instance reading straight from disk sees the same headers
+        blockchain.release_header_file(self.chain.path())
+        blockchain.release_header_file(self.chain.offset_path())
+        other = Blockchain(self.config, 0, None)
+        self.assertEqual(self.chain.size(), other.size())
+        for header in headers:
+            height = header['block_height']
+            self.assertEqual(self.chain.read_header(height), other.read_header(height))
+        with open(self.chain.path(), 'rb') as f:
+            data = f.read()
+        self.assertEqual(b''.join(bfh(serialize_header(h)) for h in headers), data)
+
+    def test_save_chunk_overwrites_tail(self):
+        headers = self._build_chain(5)
+        replacement = make_header(4, hash_header(headers[3]), 80, 80)
+        self.chain.save_chunk(0, headers[:4] + [replacement])
+        self.assertEqual(4, self.chain.height())
+        self.assertEqual(headers[3], self.chain.read_header(3))
+        self.assertEqual(replacement, self.chain.read_header(4))
+        self.assertEqual(hash_header(replacement), self.chain.get_hash(4))
+        raw = bfh(serialize_header(replacement))
+        self.assertEqual(replacement, deserialize_header(raw, 4))
+
+    def test_header_cache(self):
+        headers = self._build_chain(5)
+        self.assertEqual(hash_header(headers[3]), self.chain.get_hash(3))
+        self.assertEqual(hash_header(headers[3]), self.chain.get_hash(3))
+        stats = self.chain.get_cache_stats()
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['hits'])
+        # returned headers are copies
+        self.chain.read_header(3)['merkle_root'] = 'ff' * 32
+        self.assertEqual(headers[3], self.chain.read_header(3))
+
+    def test_header_cache_invalidated_by_save_chunk(self):
+        headers = self._build_chain(5)
+        for height in range(5):
+            self.chain.get_hash(height)
+        replacement = make_header(4, hash_header(headers[3]), 80, 80)
+        self.chain.save_chunk(0, headers[:4] + [replacement])
+        self.assertEqual(hash_header(replacement), self.chain.get_hash(4))
+        self.assertEqual(replacement, self.chain.read_header(4))
+
+
+    def test_fork_swap_moves_no_headers(self):
+        main = self._build_chain(10)
+        fork_headers = self._fork_headers(main[5], 6, 'ee')
+        fork = self.chain.fork(fork_headers[0])
+        for header in fork_headers[1:4]:
+            fork.save_header(header)
+        main_data = self._read_file(self.chain.path())
+        main_offsets = self._read_file(self.chain.offset_path())
+        with mock.patch.object(Blockchain, 'write', side_effect=Blockchain.write, autospec=True) as write:
+            # the fork gets longer than the main chain above the forkpoint
+            fork.save_header(fork_headers[4])
+            # only the new header was written
+            self.assertEqual(1, write.call_count)
+        self.assertIs(fork, blockchain.blockchains[0])
+        self.assertIs(self.chain, blockchain.blockchains[6])
+        self.assertIsNone(fork.parent_id)
+        self.assertEqual(0, self.chain.parent_id)
+        self._assert_branch(fork, main[:6] + fork_headers[:5])
+        self._assert_branch(self.chain, main[6:])
+        # segment 0 is untouched, its tail now belongs to the fork
+        path = blockchain.segment_path(self.config, 0)
+        self.assertEqual(main_data, self._read_file(path))
+        self.assertEqual(main_offsets, self._read_file(blockchain.segment_offset_path(self.config, 0)))
+        self.assertEqual([[0, 0, 6], [1, 6, None]], fork.extents)
+        self.assertEqual([[0, 6, None]], self.chain.extents)
+        # both keep appending to their own segment
+        fork.save_header(fork_headers[5])
+        self._assert_branch(fork, main[:6] + fork_headers)
+        extra = self._fork_headers(main[9], 1, 'dd')
+        self.chain.save_header(extra[0])
+        self._assert_branch(self.chain, main[6:] + extra)
+
+        # swap back once the old chain is longer again
+        extra += self._fork_headers(extra[0], 2, 'dd')
+        self.chain.save_header(extra[1])
+        self.chain.save_header(extra[2])
+        self.assertIs(self.chain, blockchain.blockchains[0])
+        self.assertIs(fork, blockchain.blockchains[6])
+        self.assertEqual([[0, 0, None]], self.chain.extents)
+        self._assert_branch(self.chain, main + extra)
+        self._assert_branch(fork, fork_headers)
+
+    def test_manifest_reloaded(self):
+        main = self._build_chain(10)
+        fork_headers = self._fork_headers(main[5], 5, 'ee')
+        fork = self.chain.fork(fork_headers[0])
+        for header in fork_headers[1:]:
+            fork.save_header(header)
+        for segment in blockchain.segment_bases:
+            blockchain.release_header_file(blockchain.segment_path(self.config, segment))
+            blockchain.release_header_file(blockchain.segment_offset_path(self.config, segment))
+        with mock.patch('electrum.blockchain.verify_header_proof', return_value=True):
+            chains = blockchain.read_blockchains(self.config)
+        self.assertEqual({0, 6}, set(chains))
+        self._assert_branch(chains[0], main[:6] + fork_headers)
+        self._assert_branch(chains[6], main[6:])
+        self.assertEqual(0, chains[6].parent_id)
+
+    def test_rewrite_below_swapped_fork(self):
+        main = self._build_chain(10)
+        fork_headers = self._fork_headers(main[5], 5, 'ee')
+        fork = self.chain.fork(fork_headers[0])
+        for header in fork_headers[1:]:
+            fork.save_header(header)
+        # segment 0 is read by the fork at height 6, the main chain
+        # rewrites heights 3 and up in a new segment
+        replacement = self._fork_headers(main[2], 1, 'cc')
+        fork.write_headers(3, [serialize_header_bytes(replacement[0])])
+        fork.invalidate_cache(3)
+        self.assertEqual([[0, 0, 3], [2, 3, None]], fork.extents)
+        self._assert_branch(fork, main[:3] + replacement)
+        self._assert_branch(self.chain, main[6:])
+        # the old segment of the fork is deleted
+        self.assertEqual({0, 2}, set(blockchain.segment_bases))
+        self.assertFalse(os.path.exists(blockchain.segment_path(self.config, 1)))
+
+    def test_reset_branch(self):
+        main = self._build_chain(10)
+        fork_headers = self._fork_headers(main[5], 2, 'ee')
+        fork = self.chain.fork(fork_headers[0])
+        fork.save_header(fork_headers[1])
+        fork.reset()
+        self.assertEqual(0, fork.size())
+        other = self._fork_headers(main[5], 1, 'aa')
+        fork.save_header(other[0])
+        self._assert_branch(fork, other)
+        self._assert_branch(self.chain, main)
+
+
+class TestHeaderProof(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.privkeys = [ecc.ECPrivkey(bytes([i]) * 32) for i in range(1, 4)]
+        pubkeys = [k.get_public_key_hex() for k in self.privkeys]
+        self.challenge = multisig_script(pubkeys, 2)
+        self._saved_challenge = constants.net.CHALLENGE
+        constants.net.CHALLENGE = VersionedValue({0: self.challenge})
+
+    def tearDown(self):
+        constants.net.CHALLENGE = self._saved_challenge
+        super().tearDown()
+
+    def _signed_header(self, signers):
+        header = make_header(1, '00' * 32)
+        header['challenge'] = rev_hex(self.challenge)
+        header['proof'] = ''
+        msg_hash = bfh(hash_header(header))[::-1]
+        proof = '00'
+        for k in signers:
+            sig = bh2u(k.sign_transaction(msg_hash))
+            proof += push_script(sig)
+        header['proof'] = rev_hex(proof)
+        return header
+
+    def test_valid_proof(self):
+        header = self._signed_header(self.privkeys[:2])
+        self.assertTrue(verify_header_proof(header))
+
+    def test_valid_proof_signatures_out_of_order(self):
+        header = self._signed_header([self.privkeys[2], self.privkeys[0]])
+        self.assertTrue(verify_header_proof(header))
+
+    def test_not_enough_signatures(self):
+        header = self._signed_header(self.privkeys[:1])
+        self.assertFalse(verify_header_proof(header))
+
+    def test_same_key_counted_once(self):
+        header = self._signed_header([self.privkeys[1], self.privkeys[1]])
+        self.assertFalse(verify_header_proof(header))
+
+    def test_challenge_mismatch(self):
+        header = self._signed_header(self.privkeys[:2])
+        header['challenge'] = rev_hex(self.challenge[:-2] + 'ac')
+        self.assertFalse(verify_header_proof(header))
+
@@ -1,4 +1,8 @@
+import json
+import socket
+import time
 import unittest
+from unittest import mock
 
 from electrum import interface
 
@@ -26,3 +30,124 @@ class TestInterface(SequentialTestCase):
         self.assertTrue(i.check_host_name(
             peercert={'subject': [('commonName', 'foo.bar.com')]},
             name='foo.bar.com'))
+
+
+class TestInterfaceFlowControl(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sock, self.server_sock = socket.socketpair()
+        self.interface = interface.Interface('localhost:1:t', self.sock)
+
+    def tearDown(self):
+        self.sock.close()
+        self.server_sock.close()
+        super().tearDown()
+
+    def _sent_ids(self):
+        self.server_sock.settimeout(1)
+        data = b''
+        while not data.endswith(b'\n'):
+            data += self.server_sock.recv(65536)
+        return [json.loads(line)['id'] for line in data.splitlines()]
+
+    def test_priority_requests_sent_first(self):
+        i = self.interface
+        i.queue_request('blockchain.scripthash.get_history', ['a'], 0)
+        i.queue_request('blockchain.transaction.get', ['b'], 1)
+        i.queue_request('blockchain.block.headers', [0, 2016], 2)
+        self.assertTrue(i.send_requests())
+        self.assertEqual([2, 0, 1], self._sent_ids())
+
+    def test_window_limits_unanswered(self):
+        i = self.interface
+        for n in range(interface.INITIAL_WINDOW + 5):
+            i.queue_request('blockchain.transaction.get', [str(n)], n)
+        i.send_requests()
+        self.assertEqual(interface.INITIAL_WINDOW, len(i.unanswered_requests))
+        self.assertEqual(0, i.num_requests())
+        self.assertEqual(5, i.get_stats()['queued'])
+
+    def test_window_halved_on_overload_error(self):
+        i = self.interface
+        i.queue_request('blockchain.transaction.get', ['a'], 0)
+        i.send_requests()
+        i.on_response(0, {'id': 0, 'error': {'code': -101, 'message': 'excessive resource usage'}})
+        self.assertEqual(interface.INITIAL_WINDOW // 2, i.window)
+
+    def test_window_grows_when_full(self):
+        i = self.interface
+        for n in range(interface.INITIAL_WINDOW):
+            i.queue_request('blockchain.transaction.get', [str(n)], n)
+        i.send_requests()
+        i.unanswered_requests.pop(0)
+        i.on_response(0, {'id': 0, 'result': ''})
+        self.assertEqual(interface.INITIAL_WINDOW + 1, i.window)
+        self.assertIsNotNone(i.get_stats()['rtt'])
+
+    def test_window_kept_under_uniform_latency(self):
+        i = self.interface
+        n = interface.INITIAL_WINDOW
+        for k in range(n):
+            i.queue_request('blockchain.transaction.get', [str(k)], k)
+        i.send_requests()
+        # the server answers one request every 10ms, in order
+        sent = i.last_send
+        for k in range(n):
+            i.unanswered_requests.pop(k)
+            with mock.patch('electrum.interface.time.time', return_value=sent + 0.01 * (k + 1)):
+                i.on_response(k, {'id': k, 'result': ''})
+        self.assertGreaterEqual(i.window, n)
+        # one sample per send
+        self.assertAlmostEqual(0.01, i.rtt, delta=0.005)
+
+    def test_window_halved_once_on_slow_responses(self):
+        i = self.interface
+        for k in range(10):
+            i.queue_request('blockchain.transaction.get', [str(k)], k)
+        i.send_requests()
+        now = i.last_send + interface.SLOW_RESPONSE_TIME + 1
+        for k in range(10):
+            i.unanswered_requests.pop(k)
+            with mock.patch('electrum.interface.time.time', return_value=now + k):
+                i.on_response(k, {'id': k, 'result': ''})
+        self.assertEqual(interface.INITIAL_WINDOW // 2, i.window)
+
+    def test_send_times_pruned(self):
+        i = self.interface
+        now = time.time() + interface.STALE_REQUEST_TIME
+        for k, sent in enumerate([now - interface.STALE_REQUEST_TIME] * 2 + [now - 1]):
+            i.queue_request('blockchain.transaction.get', [str(k)], k)
+            with mock.patch('electrum.interface.time.time', return_value=sent):
+                i.send_requests()
+        # request 0 was dropped, request 1 is not answered in time
+        i.unanswered_requests.pop(0)
+        with mock.patch('electrum.interface.time.time', return_value=now):
+            i.prune_send_times()
+        self.assertEqual({2}, set(i.send_times))
+        self.assertEqual({i.send_times[2]}, i.unsampled_sends)
+        i.close()
+        self.assertEqual({}, i.send_times)
+        self.assertEqual(set(), i.unsampled_sends)
+
+    def test_batch_requests(self):
+        i = self.interface
+        i.batch_requests = True
+        i.queue_request('blockchain.transaction.get', ['a'], 0)
+        i.queue_request('blockchain.transaction.get', ['b'], 1)
+        i.queue_request('server.ping', [], 2)
+        i.send_requests()
+        self.server_sock.settimeout(1)
+        data = b''
+        while data.count(b'\n') < 2:
+            data += self.server_sock.recv(65536)
+        ping, batch = [json.loads(line) for line in data.splitlines()]
+        self.assertEqual(2, ping['id'])
+        self.assertEqual([0, 1], [r['id'] for r in batch])
+        response = [{'id': 1, 'result': 'tx_b'}, {'id': 0, 'result': 'tx_a'}]
+        self.server_sock.sendall(json.dumps(response).encode() + b'\n')
+        time.sleep(0.1)
+        responses = i.get_responses()
+        self.assertEqual([(1, 'tx_b'), (0, 'tx_a')],
+                         [(request[2], response['result']) for request, response in responses])
+        self.assertEqual({2}, set(i.unanswered_requests))
@@ -0,0 +1,135 @@
+import threading
+from unittest import mock
+
+from electrum import network
+from electrum.network import Network
+
+from . import SequentialTestCase
+
+
+class FakeBlockchain:
+
+    checkpoints = []
+
+    def __init__(self):
+        self.connected = []
+        self._height = -1
+
+    def height(self):
+        return self._height
+
+    def connect_chunk(self, index, hexdata):
+        # like verify_chunk, the previous header must be there
+        if index != (self._height + 1) // 2016:
+            return False
+        self.connected.append((index, hexdata))
+        self._height = index * 2016 + 2015
+        return True
+
+
+class FakeInterface:
+
+    def __init__(self, server, tip, blockchain=None):
+        self.server = server
+        self.tip = tip
+        self.blockchain = blockchain
+        self.mode = 'catch_up'
+
+    def print_error(self, *msg):
+        pass
+
+
+class TestChunkPipeline(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.network = n = Network.__new__(Network)
+        n.interface_lock = threading.RLock()
+        n.interfaces = {}
+        n.requested_chunks = {}
+        n.received_chunks = {}
+        n.chunk_errors = {}
+        n.queue_request = mock.Mock()
+        n.notify = mock.Mock()
+        n.connection_down = mock.Mock()
+
+    def add_interface(self, server, tip, blockchain=None):
+        interface = FakeInterface(server, tip, blockchain)
+        self.network.interfaces[server] = interface
+        return interface
+
+    def respond(self, interface, index, error=None):
+        response = {'params': [index * 2016, 2016]}
+        if error:
+            response['error'] = error
+        else:
+            response['result'] = {'hex': '%d' % index}
+        self.network.on_block_headers(interface, response)
+
+    def asked(self, interface):
+        return sorted(c[0][1][0] // 2016 for c in self.network.queue_request.call_args_list
+                      if c[0][2] == interface)
+
+    def test_chunks_connected_in_order(self):
+        blockchain = FakeBlockchain()
+        a = self.add_interface('a', 3 * 2016 - 1, blockchain)
+        b = self.add_interface('b', 3 * 2016 - 1)
+        self.network.request_chunks(a, 0)
+        self.assertEqual([0, 2], self.asked(a))
+        self.assertEqual([1], self.asked(b))
+        self.respond(a, 2)
+        self.assertEqual([], blockchain.connected)
+        self.respond(a, 0)
+        self.assertEqual([0], [i for i, _ in blockchain.connected])
+        self.respond(b, 1)
+        self.assertEqual([(0, '0'), (1, '1'), (2, '2')], blockchain.connected)
+        self.assertEqual('default', a.mode)
+        self.network.connection_down.assert_not_called()
+
+    def test_error_response_is_asked_again(self):
+        blockchain = FakeBlockchain()
+        a = self.add_interface('a', 2 * 2016 - 1, blockchain)
+        self.network.request_chunks(a, 0)
+        self.respond(a, 1)
+        self.respond(a, 0, error='busy')
+        # chunk 1 must not be connected over the missing chunk 0
+        self.assertEqual([], blockchain.connected)
+        self.assertIn((0, a), self.network.requested_chunks)
+        self.respond(a, 0)
+        self.assertEqual([0, 1], [i for i, _ in blockchain.connected])
+        self.network.connection_down.assert_not_called()
+
+    def test_failed_helper_chunk_asked_from_another_interface(self):
+        blockchain = FakeBlockchain()
+        a = self.add_interface('a', 2 * 2016 - 1, blockchain)
+        b = self.add_interface('b', 2 * 2016 - 1)
+        self.network.request_chunks(a, 0)
+        self.assertEqual({(0, a): a, (1, a): b}, self.network.requested_chunks)
+        self.respond(b, 1, error='busy')
+        self.assertEqual(a, self.network.requested_chunks[(1, a)])
+
+    def test_catch_up_interface_dropped_after_repeated_errors(self):
+        a = self.add_interface('a', 2015, FakeBlockchain())
+        self.network.request_chunks(a, 0)
+        for i in range(network.MAX_CHUNK_ERRORS):
+            self.respond(a, 0, error='busy')
+            self.network.connection_down.assert_not_called()
+        self.respond(a, 0, error='busy')
+        self.network.connection_down.assert_called_once_with('a')
+
+    def test_shared_chunk_index(self):
+        blockchain1, blockchain2 = FakeBlockchain(), FakeBlockchain()
+        a = self.add_interface('a', 2 * 2016 - 1, blockchain1)
+        b = self.add_interface('b', 2016 - 1, blockchain2)
+        # b's pipeline asks chunk 0 from a, a's own pipeline asks a for it too
+        self.network.request_chunk(a, 0, b)
+        self.network.request_chunks(a, 0)
+        self.assertEqual([0, 0, 1], self.asked(a))
+        self.respond(a, 1)
+        self.respond(a, 0)
+        # each response answers one of the two requests
+        self.assertEqual(1, len(blockchain1.connected) + len(blockchain2.connected))
+        self.respond(a, 0)
+        self.assertEqual([0, 1], [i for i, _ in blockchain1.connected])
+        self.assertEqual([0], [i for i, _ in blockchain2.connected])
+        self.assertEqual({}, self.network.requested_chunks)
@@ -0,0 +1,162 @@
+import shutil
+import tempfile
+from unittest import mock
+
+from electrum import constants
+from electrum.bitcoin import TYPE_ADDRESS, TYPE_SCRIPT, push_script
+from electrum.policy_tracker import PolicyTracker
+from electrum.simple_config import SimpleConfig
+from electrum.transaction import TxOutPoint, multisig_script, opcodes
+
+from . import SequentialTestCase
+
+
+TXID1 = '11' * 32
+TXID2 = '22' * 32
+TXID3 = '33' * 32
+TXID4 = '44' * 32
+TXID5 = '55' * 32
+ADDR = 'GHqwd9uaKCemQSMqzdNY2BzK1rXMtY7UoH'
+KYC_DATA = '02' + '0102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f20'
+KYC_PUBKEY = '020102' + '201f1e1d1c1b1a191817161514131211100f0e0d0c0b0a09080706050403'
+POLICY_PUBKEY = '03' + 'aa' * 32
+
+
+class FakeOutput:
+
+    def __init__(self, type, address, asset, script=None):
+        self.type = type
+        self.address = address
+        self.asset = asset
+        self.scriptPubKey = script or '76a914' + '00' * 20 + '88ac'
+
+
+class FakeTx:
+
+    def __init__(self, txid, inputs, outputs):
+        self._txid = txid
+        self._inputs = [{'type': 'p2pkh', 'prevout_hash': h, 'prevout_n': n} for h, n in inputs]
+        self._outputs = outputs
+
+    def __str__(self):
+        return self._txid
+
+    def deserialize(self):
+        pass
+
+    def txid(self):
+        return self._txid
+
+    def inputs(self):
+        return self._inputs
+
+    def outputs(self):
+        return self._outputs
+
+    def is_whitelist(self):
+        return all(o.asset == constants.net.WHITELISTASSET for o in self._outputs)
+
+
+def policy_tx(txid, inputs, *outputs):
+    asset = constants.net.WHITELISTASSET
+    return FakeTx(txid, inputs, [FakeOutput(type, address, asset, script) for type, address, script in outputs])
+
+
+TX1 = policy_tx(TXID1, [('00' * 32, 0)],
+                (TYPE_ADDRESS, constants.net.WHITELISTCOINSADDRESS, None),
+                (TYPE_SCRIPT, None, multisig_script([POLICY_PUBKEY, KYC_DATA], 1)))
+# assigns the KYC pubkey and whitelists ADDR
+TX2 = policy_tx(TXID2, [(TXID1, 1)], (TYPE_ADDRESS, ADDR, None))
+TX3 = FakeTx(TXID3, [], [FakeOutput(TYPE_ADDRESS, constants.net.WHITELISTCOINSADDRESS, '44' * 32)])
+# takes the whitelist asset back from ADDR
+TX4 = policy_tx(TXID4, [(TXID2, 0)], (TYPE_ADDRESS, constants.net.WHITELISTCOINSADDRESS, None))
+# registers addresses of a user
+TX5 = policy_tx(TXID5, [(TXID2, 0)],
+                (TYPE_ADDRESS, ADDR, None),
+                (TYPE_SCRIPT, None, '%02x' % opcodes.OP_REGISTERADDRESS + push_script('00' * 53)))
+
+
+class TestPolicyTracker(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.electrum_dir = tempfile.mkdtemp()
+        self.config = SimpleConfig({'electrum_path': self.electrum_dir})
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.electrum_dir)
+
+    def test_parse_tx(self):
+        tracker = PolicyTracker(self.config, None)
+        tracker.parse_tx(TX1)
+        self.assertEqual({KYC_PUBKEY: TxOutPoint(TXID1, 1)}, tracker.kyc_pubkeys)
+        self.assertEqual(KYC_PUBKEY, tracker.get_unassigned_kyc_pubkey())
+        self.assertEqual(0, len(tracker.whitelist))
+        tracker.parse_tx(TX2)
+        self.assertEqual({}, tracker.kyc_pubkeys)
+        self.assertIsNone(tracker.get_unassigned_kyc_pubkey())
+        self.assertTrue(tracker.has_whitelist_output(ADDR))
+        self.assertIn(ADDR, tracker.new_addresses)
+        tracker.parse_tx(TX3)
+        self.assertEqual([ADDR], list(tracker.whitelist))
+        tracker.parse_tx(TX4)
+        self.assertFalse(tracker.has_whitelist_output(ADDR))
+
+    def test_sync_in_history_order(self):
+        network = mock.Mock()
+        tracker = PolicyTracker(self.config, network)
+        coins_address = constants.net.WHITELISTCOINSADDRESS
+        tracker.run()
+        network.subscribe_to_addresses.assert_called_once_with({coins_address}, tracker.on_address_status)
+        hist = [(TXID1, 10), (TXID2, 11)]
+        tracker.on_address_status({'params': [coins_address], 'result': tracker.get_status(hist)})
+        network.request_address_history.assert_called_once_with(coins_address, tracker.on_address_history)
+        tracker.on_address_history({'params': [coins_address],
+                                    'result': [{'tx_hash': h, 'height': height} for h, height in hist]})
+        network.get_transactions.assert_called_once_with([TXID1, TXID2], tracker.on_tx_response)
+        self.assertFalse(tracker.is_up_to_date())
+        txs = {TXID1: TX1, TXID2: TX2}
+        with mock.patch('electrum.policy_tracker.Transaction', side_effect=lambda raw: txs[raw]):
+            # the spend of the KYC pubkey is received first
+            tracker.on_tx_response({'params': [TXID2], 'result': TXID2})
+            network.trigger_callback.assert_not_called()
+            tracker.on_tx_response({'params': [TXID1], 'result': TXID1})
+        self.assertEqual([mock.call('new_transaction', TX1), mock.call('new_transaction', TX2)],
+                         network.trigger_callback.call_args_list)
+        self.assertEqual({}, tracker.kyc_pubkeys)
+        self.assertEqual([ADDR], list(tracker.whitelist))
+        # the whitelisted address is followed too
+        tracker.run()
+        network.subscribe_to_addresses.assert_called_with({ADDR}, tracker.on_address_status)
+        self.assertTrue(tracker.is_up_to_date())
+
+        # the state is shared through the config directory
+        tracker2 = PolicyTracker(self.config, network)
+        self.assertEqual({TXID1, TXID2}, tracker2.parsed)
+        self.assertTrue(tracker2.has_whitelist_output(ADDR))
+        self.assertEqual({coins_address, ADDR}, tracker2.new_addresses)
+        tracker2.on_address_status({'params': [coins_address], 'result': tracker.get_status(hist)})
+        self.assertEqual(1, network.request_address_history.call_count)
+
+    def test_kyc_pubkeys_persisted(self):
+        tracker = PolicyTracker(self.config, None)
+        tracker.parse_tx(TX1)
+        tracker.save()
+        tracker2 = PolicyTracker(self.config, None)
+        self.assertEqual({KYC_PUBKEY: TxOutPoint(TXID1, 1)}, tracker2.kyc_pubkeys)
+        tracker2.parse_tx(TX2)
+        self.assertEqual({}, tracker2.kyc_pubkeys)
+
+    def test_policy_txs_kept_for_later_wallets(self):
+        tracker = PolicyTracker(self.config, None)
+        for tx in (TX1, TX2, TX5):
+            tracker.parse_tx(tx)
+        self.assertEqual([(TXID5, TXID5)], tracker.policy_txs)
+        tracker.save()
+        # a wallet loaded after the tracker is up to date gets them too
+        tracker2 = PolicyTracker(self.config, None)
+        with mock.patch('electrum.policy_tracker.Transaction', side_effect={TXID5: TX5}.get):
+            self.assertEqual([TX5], tracker2.get_policy_txs())
+        tracker2.clear()
+        self.assertEqual([], tracker2.get_policy_txs())
@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+
+from electrum.token_ratio import TokenRatios, token_mass, token_ratio
+
+from . import SequentialTestCase
+
+
+def iterated_token_ratio(blockheight):
+    # the per-hour iteration the table replaces
+    rate = 0.010101010101010101
+    hrate = (1.0 + rate)**(1.0/(365.0*3.0))
+    ratio = 1.0
+    for it in range(blockheight // 480):
+        ratio += round(ratio*hrate - ratio,12)
+    return round(0.1/ratio,13)
+
+
+class TestTokenRatio(SequentialTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.path)
+
+    def test_matches_iteration(self):
+        ratios = TokenRatios()
+        for height in [1000000, 0, 479, 480, 481, 123456, 2000000]:
+            self.assertEqual(iterated_token_ratio(height), ratios.get(height))
+        self.assertEqual(iterated_token_ratio(77777), token_ratio(77777))
+
+    def test_token_mass(self):
+        tr = iterated_token_ratio(50000)
+        self.assertEqual([float(v)*tr/1.0E+8 for v in (0, 5, 123456789)],
+                         token_mass([0, 5, 123456789], 50000))
+
+    def test_persisted(self):
+        path = os.path.join(self.path, 'token_ratios')
+        ratios = TokenRatios()
+        ratios.load(path)
+        ratios.get(480 * 100)
+        ratios.get(480 * 250)
+        ratios2 = TokenRatios()
+        ratios2.load(path)
+        self.assertEqual(ratios.table, ratios2.table)
+        self.assertEqual(251, len(ratios2.table))
+        self.assertEqual(iterated_token_ratio(480 * 300), ratios2.get(480 * 300))
+        # a file written with other parameters is discarded
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 16)
+        ratios3 = TokenRatios()
+        ratios3.load(path)
+        self.assertEqual(iterated_token_ratio(480 * 10), ratios3.get(480 * 10))
+        self.assertEqual(8 * 12, os.path.getsize(path))
@@ -1,6 +1,8 @@
+import sys
 import unittest
+from unittest import mock
 
-from electrum import transaction
+from electrum import transaction, ecc, bitcoin
 from electrum.bitcoin import TYPE_ADDRESS, TYPE_SCRIPT
 from electrum.keystore import xpubkey_to_address
 from electrum.util import bh2u, bfh
@@ -244,6 +246,99 @@ class TestTransaction(SequentialTestCase):
         tx = transaction.Transaction(v2_blob)
         self.assertEqual(tx.txid(), "7201a219a30af1303e4c17ab15a02e2d9c6fbfcd162403d5d171f293fa7901ce")
 
+    def test_preimage_sighash_cache(self):
+        tx = transaction.Transaction(v2_blob)
+        tx.deserialize(force_full_parse=True)
+        pre_hashes = [tx.pre_hash(i) for i in range(len(tx.inputs()))]
+        for txin, pre_hash in zip(tx.inputs(), pre_hashes):
+            sig_string = ecc.sig_string_from_der_sig(bfh(txin['signatures'][0][:-2]))
+            ecc.ECPubkey(bfh(txin['pubkeys'][0])).verify_message_hash(sig_string, pre_hash)
+        # changing the sequence numbers must not reuse the cached inputs
+        tx.set_rbf(True)
+        for i, pre_hash in enumerate(pre_hashes):
+            self.assertNotEqual(pre_hash, tx.pre_hash(i))
+        tx.set_rbf(False)
+        self.assertEqual(pre_hashes, [tx.pre_hash(i) for i in range(len(tx.inputs()))])
+
+    def _make_p2pkh_tx(self, num_inputs):
+        privkey = bytes([1] * 32)
+        pubkey = ecc.ECPrivkey(privkey).get_public_key_hex()
+        address = bitcoin.pubkey_to_address('p2pkh', pubkey)
+        inputs = [{'type': 'p2pkh', 'prevout_hash': '%064x' % n, 'prevout_n': 0, 'address': address,
+                   'pubkeys': [pubkey], 'x_pubkeys': [pubkey], 'signatures': [None], 'num_sig': 1,
+                   'value': 100000, 'sequence': 0xfffffffe, 'issuance': None}
+                  for n in range(num_inputs)]
+        outputs = [transaction.TxOutput(TYPE_ADDRESS, address, 50000 * num_inputs, 1, '00' * 32, 1)]
+        return transaction.Transaction.from_io(inputs, outputs), {pubkey: (privkey, True)}
+
+    def test_sign_parallel(self):
+        num_inputs = transaction.PARALLEL_SIGN_MIN_INPUTS
+        tx, keypairs = self._make_p2pkh_tx(num_inputs)
+        tx.sign(keypairs)
+        tx2, keypairs = self._make_p2pkh_tx(num_inputs)
+        with mock.patch.object(transaction.Transaction, '_sign_parallel',
+                               wraps=tx2._sign_parallel) as sign_parallel:
+            try:
+                tx2.sign(keypairs, num_workers=2)
+            finally:
+                transaction.shutdown_sign_pool()
+            self.assertEqual(1, sign_parallel.call_count)
+        self.assertTrue(tx2.is_complete())
+        self.assertEqual(tx.serialize(), tx2.serialize())
+
+    def test_sign_parallel_small_tx_is_serial(self):
+        tx, keypairs = self._make_p2pkh_tx(transaction.PARALLEL_SIGN_MIN_INPUTS - 1)
+        with mock.patch.object(transaction, 'ProcessPoolExecutor') as executor:
+            tx.sign(keypairs, num_workers=2)
+            self.assertFalse(executor.called)
+        self.assertTrue(tx.is_complete())
+
+    @mock.patch.object(transaction, 'ProcessPoolExecutor')
+    def test_sign_pool_reused(self, executor):
+        try:
+            if sys.version_info < (3, 7):
+                self.assertIsNone(transaction.get_sign_pool(2))
+                return
+            pool = transaction.get_sign_pool(2)
+            self.assertIs(pool, transaction.get_sign_pool(2))
+            self.assertEqual(1, executor.call_count)
+            self.assertEqual('spawn', executor.call_args[1]['mp_context'].get_start_method())
+            transaction.shutdown_sign_pool()
+            pool.shutdown.assert_called_once_with()
+        finally:
+            transaction.shutdown_sign_pool()
+
+    def test_sign_parallel_frozen_is_serial(self):
+        tx, keypairs = self._make_p2pkh_tx(transaction.PARALLEL_SIGN_MIN_INPUTS)
+        with mock.patch.object(sys, 'frozen', True, create=True), \
+                mock.patch.object(transaction, 'ProcessPoolExecutor') as executor:
+            tx.sign(keypairs, num_workers=2)
+            self.assertFalse(executor.called)
+        self.assertTrue(tx.is_complete())
+
+    def test_txid_cache(self):
+        tx = transaction.Transaction(v2_blob)
+        txid = "7201a219a30af1303e4c17ab15a02e2d9c6fbfcd162403d5d171f293fa7901ce"
+        with mock.patch.object(tx, '_serialize_to_network', wraps=tx._serialize_to_network) as ser:
+            self.assertEqual(txid, tx.txid())
+            self.assertEqual(txid, tx.wtxid())
+            self.assertEqual(txid, tx.txid())
+            self.assertEqual(1, ser.call_count)
+            tx.locktime += 1
+            self.assertNotEqual(txid, tx.txid())
+            self.assertEqual(2, ser.call_count)
+            tx.locktime -= 1
+            self.assertEqual(txid, tx.txid())
+            tx.set_rbf(True)
+            self.assertNotEqual(txid, tx.txid())
+        # partial transactions are not cached
+        tx = transaction.Transaction(unsigned_blob)
+        tx.deserialize()
+        with mock.patch.object(tx, '_serialize_to_network', wraps=tx._serialize_to_network) as ser:
+            tx.serialize()
+            tx.serialize()
+            self.assertEqual(2, ser.call_count)
+
     def test_get_address_from_output_script(self):
         # the inverse of this test is in test_bitcoin: test_address_to_script
         addr_from_script = lambda script: transaction.get_address_from_output_script(bfh(script))
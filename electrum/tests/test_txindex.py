@@ -0,0 +1,97 @@
+import random
+
+from electrum.txindex import InternTable, TxiIndex, TxoIndex, SpentOutpoints, SPENT_RECORD
+
+from . import SequentialTestCase
+
+
+ASSET = '90f6212d141349050aca026eeb6e53a037bfaf5e0383deae7b9a5139d9724659'
+TXID1 = '11' * 32
+TXID2 = '22' * 32
+ADDR = '2dcDqWdJpKrNZXy7mtj6fTcdqWY8WYpV6tn'
+SCRIPT = '76a9141ba6f3d8d9c4b47bfcbdc8e76c5c9f4b9a5f0e5988ac'
+
+
+class TestTxIndex(SequentialTestCase):
+
+    def test_txo_roundtrip(self):
+        blinded = '08' + 'ab' * 32
+        txo = {TXID1: {ADDR: [[0, 1000, ASSET, False, SCRIPT], [2, blinded, None, True, SCRIPT]]},
+               TXID2: {}}
+        index = TxoIndex(InternTable(), txo)
+        self.assertEqual({ADDR: [(0, 1000, ASSET, False, SCRIPT), (2, blinded, None, True, SCRIPT)]},
+                         index.get(TXID1))
+        self.assertEqual({}, index.get(TXID2))
+        self.assertIsNone(index.get('33' * 32))
+        self.assertIsNone(index.get(None))
+        self.assertEqual({TXID1, TXID2}, set(index))
+        self.assertEqual(txo, index.to_json())
+        self.assertEqual({}, index.pop(TXID2))
+        self.assertNotIn(TXID2, index)
+
+    def test_txo_get_output(self):
+        outputs = {ADDR: [[4, 10, ASSET, False, SCRIPT]],
+                   'other': [[n, n, ASSET, False, SCRIPT] for n in (7, 0, 2)]}
+        index = TxoIndex(InternTable(), {TXID1: outputs, TXID2: {}})
+        for addr, l in outputs.items():
+            for n, v, a, is_cb, spk in l:
+                self.assertEqual((addr, v, a, is_cb, spk), index.get_output(TXID1, n))
+        for n in (1, 3, 5, 8):
+            self.assertIsNone(index.get_output(TXID1, n))
+        self.assertIsNone(index.get_output(TXID2, 0))
+        self.assertIsNone(index.get_output(None, None))
+
+    def test_txi_add(self):
+        table = InternTable()
+        index = TxiIndex(table, {TXID2: {ADDR: [[TXID1 + ':0', 1000, ASSET]]}})
+        self.assertEqual({ADDR: {(TXID1 + ':0', 1000, ASSET)}}, index[TXID2])
+        self.assertFalse(index.add(TXID2, ADDR, TXID1 + ':0', 1000, ASSET))
+        self.assertTrue(index.add(TXID2, ADDR, TXID1 + ':1', 5, ASSET))
+        self.assertEqual({ADDR: [[TXID1 + ':0', 1000, ASSET], [TXID1 + ':1', 5, ASSET]]},
+                         index.to_json()[TXID2])
+        # the address and asset are stored once
+        self.assertEqual(2, len(table))
+
+    def test_spent_outpoints(self):
+        spent = SpentOutpoints({TXID1: {'0': TXID2}})
+        spent.add(TXID1, 3, TXID2)
+        self.assertEqual(TXID2, spent.get(TXID1, 0))
+        self.assertIsNone(spent.get(TXID1, 1))
+        self.assertIsNone(spent.get(TXID2, 0))
+        self.assertEqual({TXID2}, spent.spenders(TXID1))
+        spent.remove(TXID1, 0)
+        self.assertEqual({TXID1: {'3': TXID2}}, spent.to_json())
+        spent.remove_spender(TXID2)
+        self.assertNotIn(TXID1, spent)
+        self.assertEqual(set(), spent.spenders(TXID1))
+
+    def test_spent_outpoints_spent_by(self):
+        txid3 = '33' * 32
+        spent = SpentOutpoints({TXID1: {'0': TXID2, '1': TXID2}})
+        self.assertEqual([(TXID1, 0), (TXID1, 1)], spent.spent_by(TXID2))
+        # a conflicting spend replaces the previous one
+        spent.add(TXID1, 1, txid3)
+        self.assertEqual([(TXID1, 0)], spent.spent_by(TXID2))
+        self.assertEqual([(TXID1, 1)], spent.spent_by(txid3))
+        self.assertEqual({TXID2, txid3}, spent.spenders(TXID1))
+        spent.remove_spender(TXID2)
+        self.assertEqual([], spent.spent_by(TXID2))
+        self.assertEqual({TXID1: {'1': txid3}}, spent.to_json())
+
+    def test_spent_outpoints_many_outputs(self):
+        spent = SpentOutpoints()
+        # past 255, little-endian bytes do not sort like the numbers
+        ns = list(range(600))
+        random.Random(1).shuffle(ns)
+        for n in ns:
+            spent.add(TXID1, n, TXID2 if n % 2 else '33' * 32)
+        self.assertEqual(sorted(ns), [n for n, txid in SPENT_RECORD.iter_unpack(spent._spent[bytes.fromhex(TXID1)])])
+        self.assertTrue(all(spent.get(TXID1, n) == (TXID2 if n % 2 else '33' * 32) for n in ns))
+        self.assertIsNone(spent.get(TXID1, 600))
+        self.assertEqual(300, len(spent.spent_by(TXID2)))
+        for n in ns[:100]:
+            spent.remove(TXID1, n)
+        self.assertEqual(set(ns[100:]), set(int(n) for n in spent.to_json()[TXID1]))
+        spent.remove_spender(TXID2)
+        spent.remove_spender('33' * 32)
+        self.assertNotIn(TXID1, spent)
@@ -6,7 +6,8 @@ import os
 import json
 
 from io import StringIO
-from electrum.storage import WalletStorage, FINAL_SEED_VERSION
+from electrum import storage as storage_module
+from electrum.storage import WalletStorage, FINAL_SEED_VERSION, STO_EV_USER_PW, journal_path
 
 from . import SequentialTestCase
 
@@ -69,3 +70,112 @@ class TestWalletStorage(WalletTestCase):
         with open(self.wallet_path, "r") as f:
             contents = f.read()
         self.assertEqual(some_dict, json.loads(contents))
+
+    def test_write_appends_to_journal(self):
+        storage = WalletStorage(self.wallet_path)
+        storage.put('a', 'b')
+        storage.write()
+        with open(self.wallet_path, "r") as f:
+            snapshot = f.read()
+        storage.put('labels', {'x': '1', 'y': '2'})
+        storage.write()
+        storage.put('labels', {'x': '1', 'z': '3'})
+        storage.put('a', None)
+        storage.write()
+        # the wallet file is left alone, changes go to the journal
+        with open(self.wallet_path, "r") as f:
+            self.assertEqual(snapshot, f.read())
+        self.assertTrue(os.path.exists(journal_path(self.wallet_path)))
+
+        storage = WalletStorage(self.wallet_path)
+        self.assertEqual({'x': '1', 'z': '3'}, storage.get('labels'))
+        self.assertIsNone(storage.get('a'))
+
+    def test_delete_removes_journal(self):
+        storage = WalletStorage(self.wallet_path)
+        storage.put('a', 'b')
+        storage.write()
+        storage.put('a', 'c')
+        storage.write()
+        self.assertTrue(os.path.exists(journal_path(self.wallet_path)))
+        storage.delete()
+        self.assertFalse(os.path.exists(self.wallet_path))
+        self.assertFalse(os.path.exists(journal_path(self.wallet_path)))
+
+    def test_journal_ignores_torn_write(self):
+        storage = WalletStorage(self.wallet_path)
+        storage.write()
+        storage.put('a', 'b')
+        storage.write()
+        with open(journal_path(self.wallet_path), "a") as f:
+            f.write('[["set", "a", "c"')
+        storage = WalletStorage(self.wallet_path)
+        self.assertEqual('b', storage.get('a'))
+        # writes after the torn line are kept
+        storage.put('a', 'NEW')
+        storage.write()
+        storage.put('labels', {'x': '1'})
+        storage.write()
+        storage = WalletStorage(self.wallet_path)
+        self.assertEqual('NEW', storage.get('a'))
+        self.assertEqual({'x': '1'}, storage.get('labels'))
+
+    def test_journal_with_non_ascii_labels(self):
+        storage = WalletStorage(self.wallet_path)
+        storage.write()
+        storage.put('labels', {'x': 'café ₿'})
+        storage.write()
+        storage = WalletStorage(self.wallet_path)
+        with open(journal_path(self.wallet_path), "rb") as f:
+            self.assertEqual(os.fstat(f.fileno()).st_size, storage.journal_size)
+        storage.put('labels', {'x': 'café ₿', 'y': 'ü'})
+        storage.write()
+        storage = WalletStorage(self.wallet_path)
+        self.assertEqual({'x': 'café ₿', 'y': 'ü'}, storage.get('labels'))
+
+    def test_stale_journal_is_ignored(self):
+        storage = WalletStorage(self.wallet_path)
+        storage.write()
+        storage.put('a', 'b')
+        storage.write()
+        with open(journal_path(self.wallet_path), "r") as f:
+            journal = f.read()
+        storage.write(compact=True)
+        self.assertFalse(os.path.exists(journal_path(self.wallet_path)))
+        storage.put('a', 'c')
+        storage.write(compact=True)
+        # a journal written against an older wallet file is not replayed
+        with open(journal_path(self.wallet_path), "w") as f:
+            f.write(journal)
+        storage = WalletStorage(self.wallet_path)
+        self.assertEqual('c', storage.get('a'))
+
+    def test_journal_compacted_when_large(self):
+        saved = storage_module.JOURNAL_MIN_COMPACT_SIZE
+        storage_module.JOURNAL_MIN_COMPACT_SIZE = 0
+        try:
+            storage = WalletStorage(self.wallet_path)
+            storage.write()
+            for i in range(10):
+                storage.put('labels', {str(j): 'label' for j in range(i)})
+                storage.write()
+            with open(self.wallet_path, "r") as f:
+                self.assertEqual(9, len(json.loads(f.read())['labels']))
+        finally:
+            storage_module.JOURNAL_MIN_COMPACT_SIZE = saved
+
+    def test_encrypted_journal(self):
+        storage = WalletStorage(self.wallet_path)
+        storage.put('a', 'b')
+        storage.set_password('secret', STO_EV_USER_PW)
+        storage.write()
+        storage.put('labels', {'x': '1'})
+        storage.write()
+        with open(journal_path(self.wallet_path), "r") as f:
+            self.assertNotIn('labels', f.read())
+
+        storage = WalletStorage(self.wallet_path)
+        self.assertTrue(storage.is_encrypted())
+        storage.decrypt('secret')
+        self.assertEqual('b', storage.get('a'))
+        self.assertEqual({'x': '1'}, storage.get('labels'))
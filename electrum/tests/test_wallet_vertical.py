@@ -9,7 +9,7 @@ from electrum import Transaction
 from electrum import SimpleConfig
 from electrum.address_synchronizer import TX_HEIGHT_UNCONFIRMED, TX_HEIGHT_UNCONF_PARENT
 from electrum.wallet import sweep, Multisig_Wallet, Standard_Wallet, Imported_Wallet
-from electrum.util import bfh, bh2u
+from electrum.util import bfh, bh2u, VerifiedTxInfo
 from electrum.transaction import TxOutput
 
 from electrum.plugins.trustedcoin import trustedcoin
@@ -174,6 +174,60 @@ class TestWalletKeystoreAddressIntegrityForMainnet(SequentialTestCase):
         # Verify that we can receive keys for both untweaked and tweaked addr
         self.assertEqual([bitcoin.deserialize_privkey(w.export_private_key(address, None)[0])[1] for address in ['1NNkttn1YvVGdqBW4PR6zvc3Zx3H5owKRf', new_addr]], [pk, pk_new])
 
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_address_contract_index(self, mock_write):
+        ks = keystore.from_seed('cycle rocket west magnet parrot shuffle foot correct salt library feed song', '', False)
+        w = WalletIntegrityHelper.create_standard_wallet(ks)
+        old_addr = w.get_receiving_addresses()[0]
+        store = w.storage
+        store.update_contracts(TEST_CONTRACT_HASH)
+        w = Standard_Wallet(store)
+        new_addr = w.create_new_address()
+        self.assertEqual('', w.address_contracts[old_addr])
+        self.assertEqual(TEST_CONTRACT_HASH, w.address_contracts[new_addr])
+        self.assertEqual([None, TEST_CONTRACT_HASH], w.get_address_contracts(old_addr))
+        self.assertEqual([TEST_CONTRACT_HASH, None], w.get_address_contracts(new_addr))
+
+        # addresses only need one tweak
+        with mock.patch.object(w, 'tweak_pubkeys', wraps=w.tweak_pubkeys) as tweak:
+            w.get_public_key(old_addr)
+            w.get_public_key(new_addr)
+            self.assertEqual(2, tweak.call_count)
+
+        # wallets without the index rebuild it on first use
+        store.put('address_contracts', None)
+        w = Standard_Wallet(store)
+        self.assertEqual({}, w.address_contracts)
+        keys = [w.export_private_key(address, None)[0] for address in [old_addr, new_addr]]
+        self.assertEqual({old_addr: '', new_addr: TEST_CONTRACT_HASH}, w.address_contracts)
+        self.assertEqual(w.address_contracts, store.get('address_contracts'))
+        self.assertEqual(keys, [w.export_private_key(address, None)[0] for address in [old_addr, new_addr]])
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_create_new_addresses_batch(self, mock_write):
+        ks = keystore.from_seed('cycle rocket west magnet parrot shuffle foot correct salt library feed song', '', False)
+        w = WalletIntegrityHelper.create_standard_wallet(ks)
+        store = w.storage
+        store.update_contracts(TEST_CONTRACT_HASH)
+        w = Standard_Wallet(store)
+        n = len(w.get_receiving_addresses())
+        self.assertEqual(w.gap_limit, n)
+
+        # raising the gap limit derives the missing addresses in one batch
+        # per branch (receiving and encryption follow the same limit)
+        w.change_gap_limit(n + 5)
+        with mock.patch.object(w, 'save_addresses', wraps=w.save_addresses) as save:
+            w.synchronize()
+            self.assertEqual(2, save.call_count)
+        addresses = w.get_receiving_addresses()
+        self.assertEqual(n + 5, len(addresses))
+        for i, address in enumerate(addresses[n:], n):
+            self.assertEqual((False, i), w.get_address_index(address))
+            self.assertEqual(TEST_CONTRACT_HASH, w.address_contracts[address])
+            pubkey = w.keystore.tweak_pubkey(ks.derive_pubkey(False, i), TEST_CONTRACT_HASH)
+            self.assertEqual(address, w.pubkeys_to_address(pubkey))
+            self.assertEqual(pubkey, w.get_public_key(address))
+
     @needs_test_with_all_ecc_implementations
     @mock.patch.object(storage.WalletStorage, '_write')
     def test_electrum_seed_segwit(self, mock_write):
@@ -1153,6 +1207,175 @@ class TestWalletSending(SequentialTestCase):
 #         self.assertEqual('7f827fc5256c274fd1094eb7e020c8ded0baf820356f61aa4f14a9093b0ea0ee', tx_copy.wtxid())
 
 
+class TestWalletUtxoIndex(SequentialTestCase):
+
+    # funding_tx pays two outputs to one address, spending_tx spends both
+    funding_tx = '0200000000013fce6d84a9f5ad913d810a571c4502a6202679ca1f4deace8ce90e8fb43192df000000006a47304402203d6058c1428d47af4ea33908af4fd1ce197c11fe6d2c56ea02a707a97eb74ea102204587b89d06244bea54dea8fed5ffc4caf622abab7cc540ac3b6257ca0b7a6741012102db072d171201b0904ce83242bc4bc7f5ff903c0bbbe2e211beb6d2c4865a457afeffffff0301eb792dbb1a335e04062c72a49a80b931f58a65fe67f449c830fa98b3d3fd2cfd010000011cd25c8e5c001976a91472e34cebab371967b038ce41d0e8fa1fb983795e88ac01ea792dbb1a335e04062c72a49a80b931f58a65fe67f449c830fa98b3d3fd2cfd01000007fb525cb55c001976a91472e34cebab371967b038ce41d0e8fa1fb983795e88ac01ea792dbb1a335e04062c72a49a80b931f58a65fe67f449c830fa98b3d3fd2cfd010000000000001aa4000002000000'
+    spending_tx = '0100000000022f3208f9ba5bf0369b5e7114096a5e96640db10990ce76f19b20db18a9bdfe67000000006b4830450221009f5d45937473adef459380074ab28192d43809ab7493e1c9fbe179bfb938f1d00220138a57168076a6685965b50988ab2461cbb51741344c155ff670938cc03f6b55012102a807c07bd7975211078e916bdda061d97e98d59a3631a804aada2f9a3f5b587afeffffff2f3208f9ba5bf0369b5e7114096a5e96640db10990ce76f19b20db18a9bdfe67010000006b483045022100b5a5e83845bddfc6e80ac2f9bd0d0ea9d60ffd4c81285e8be93ec46a97a1e57302201f553a60f6c77650af1cb88467b5a83825208b243c134787f2389e7404a560e0012102a807c07bd7975211078e916bdda061d97e98d59a3631a804aada2f9a3f5b587afeffffff0401eb792dbb1a335e04062c72a49a80b931f58a65fe67f449c830fa98b3d3fd2cfd01000000000003d090001976a914ea7804a2c266063572cc009a63dc25dcc0e9d9b588ac01eb792dbb1a335e04062c72a49a80b931f58a65fe67f449c830fa98b3d3fd2cfd010000011cd258bdcc001976a914aab9af3fbee0ab4e5c00d53e92f66d4bcb44f1bd88ac01ea792dbb1a335e04062c72a49a80b931f58a65fe67f449c830fa98b3d3fd2cfd01000007fb525ca1d4001976a914aab9af3fbee0ab4e5c00d53e92f66d4bcb44f1bd88ac01ea792dbb1a335e04062c72a49a80b931f58a65fe67f449c830fa98b3d3fd2cfd010000000000001388000000000000'
+
+    def _balance_from_history(self, wallet, address, asset=None):
+        received, sent = wallet.get_addr_io(address)
+        c = u = 0
+        for txo, (tx_height, v, a, is_cb) in received.items():
+            if asset is not None and a != asset:
+                continue
+            if tx_height > 0:
+                c += v
+            else:
+                u += v
+            if txo in sent:
+                if sent[txo] > 0:
+                    c -= v
+                else:
+                    u -= v
+        return c, u, 0
+
+    def _check_utxo_index(self, wallet):
+        for address in wallet.get_addresses():
+            self.assertEqual(self._balance_from_history(wallet, address), wallet.get_addr_balance(address))
+            received, sent = wallet.get_addr_io(address)
+            self.assertEqual(set(received) - set(sent), set(wallet.get_addr_utxo(address)))
+            assets = {a for height, v, a, is_cb in received.values()}
+            asset_balance = wallet.get_addr_asset_balance(address)
+            for asset in assets:
+                self.assertEqual(self._balance_from_history(wallet, address, asset),
+                                 asset_balance.get(asset, (0, 0, 0)))
+                utxos = wallet.get_addr_utxo(address, asset)
+                self.assertEqual({txo for txo, x in received.items() if x[2] == asset} - set(sent), set(utxos))
+                self.assertTrue(all(x['asset'] == asset for x in utxos.values()))
+        balance = [sum(b[i] for b in wallet.get_asset_balance().values()) for i in range(3)]
+        self.assertEqual(wallet.get_balance(), tuple(balance))
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_utxo_index_follows_heights_and_removals(self, mock_write):
+        funding_tx = Transaction(self.funding_tx)
+        spending_tx = Transaction(self.spending_tx)
+        funding_txid = funding_tx.txid()
+        spending_txid = spending_tx.txid()
+        wallet = WalletIntegrityHelper.create_imported_wallet()
+        wallet.import_address(funding_tx.get_outputs()[0][0])
+        wallet.import_address(spending_tx.get_outputs()[1][0])
+
+        wallet.receive_tx_callback(funding_txid, funding_tx, TX_HEIGHT_UNCONFIRMED)
+        self._check_utxo_index(wallet)
+        self.assertEqual((0, 9999299986360, 0), wallet.get_balance())
+        self.assertEqual(2, len(wallet.get_utxos()))
+        self.assertEqual(2, len(wallet.get_asset_balance()))
+
+        wallet.receive_tx_callback(spending_txid, spending_tx, TX_HEIGHT_UNCONFIRMED)
+        self._check_utxo_index(wallet)
+        self.assertEqual((0, 9999299731360, 0), wallet.get_balance())
+        self.assertEqual({spending_txid}, {x['prevout_hash'] for x in wallet.get_utxos()})
+
+        # confirming a tx moves its effect to the confirmed bucket
+        wallet.add_unverified_tx(funding_txid, 100)
+        self._check_utxo_index(wallet)
+        self.assertEqual((9999299986360, -255000, 0), wallet.get_balance())
+        wallet.add_unverified_tx(spending_txid, 101)
+        self._check_utxo_index(wallet)
+        self.assertEqual((9999299731360, 0, 0), wallet.get_balance())
+
+        # removing the spending tx makes its inputs unspent again
+        wallet.remove_transaction(spending_txid)
+        self._check_utxo_index(wallet)
+        self.assertEqual((9999299986360, 0, 0), wallet.get_balance())
+        self.assertEqual({funding_txid}, {x['prevout_hash'] for x in wallet.get_utxos()})
+
+        # adding the spending tx back before its parent is known
+        wallet.remove_transaction(funding_txid)
+        wallet.receive_tx_callback(spending_txid, spending_tx, TX_HEIGHT_UNCONFIRMED)
+        wallet.receive_tx_callback(funding_txid, funding_tx, 100)
+        self._check_utxo_index(wallet)
+        self.assertEqual((9999299986360, -255000, 0), wallet.get_balance())
+
+        # rebuilding the index from txi/txo gives the same result
+        balance = wallet.get_balance()
+        wallet.load_utxo_index()
+        self._check_utxo_index(wallet)
+        self.assertEqual(balance, wallet.get_balance())
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_transactions_loaded_lazily(self, mock_write):
+        funding_tx = Transaction(self.funding_tx)
+        spending_tx = Transaction(self.spending_tx)
+        funding_txid = funding_tx.txid()
+        spending_txid = spending_tx.txid()
+        wallet = WalletIntegrityHelper.create_imported_wallet()
+        wallet.import_address(funding_tx.get_outputs()[0][0])
+        wallet.import_address(spending_tx.get_outputs()[1][0])
+        wallet.network = mock.Mock(**{"get_local_height.return_value": 200})
+        for height, (txid, tx) in enumerate([(funding_txid, funding_tx), (spending_txid, spending_tx)], 100):
+            wallet.receive_tx_callback(txid, tx, height)
+            wallet.add_verified_tx(txid, VerifiedTxInfo(height, 0, 1, '00' * 32))
+        wallet.save_transactions()
+        wallet.save_verified_tx()
+
+        # opening the wallet only needs txi/txo, no tx is parsed
+        wallet2 = Imported_Wallet(wallet.storage)
+        self.assertEqual(0, len(wallet2.transactions._cache))
+        self.assertEqual(wallet.get_balance(), wallet2.get_balance())
+        self.assertEqual({spending_txid}, wallet2.get_depending_transactions(funding_txid))
+        self.assertEqual(0, len(wallet2.transactions._cache))
+        self.assertEqual(spending_txid, wallet2.transactions[spending_txid].txid())
+        self.assertEqual(1, len(wallet2.transactions._cache))
+
+        # at most TX_CACHE_SIZE transactions are kept
+        with mock.patch('electrum.address_synchronizer.TX_CACHE_SIZE', 1):
+            self.assertEqual(funding_txid, wallet2.transactions.get(funding_txid).txid())
+            self.assertEqual([funding_txid], list(wallet2.transactions._cache))
+        self.assertEqual({funding_txid, spending_txid}, set(wallet2.transactions.keys()))
+        self.assertEqual(str(funding_tx), wallet2.transactions.get_raw(funding_txid))
+        self.assertIsNone(wallet2.transactions.get('00' * 32))
+
+
+class TestWalletPolicyTxs(SequentialTestCase):
+
+    h160s = [bytes([i]) * 20 for i in (1, 2)]
+
+    def _ratx(self, txtype, *h160s):
+        # p2pkh addresses without pubkeys
+        data = b''.join(b'\x03' + h160 for h160 in h160s)
+        txid = bh2u(bitcoin.sha256(txtype.encode() + data))
+        return mock.Mock(**{'is_whitelist.return_value': True, 'txid.return_value': txid}), (txtype, data)
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_parse_policy_txs_saves_once(self, mock_write):
+        wallet = WalletIntegrityHelper.create_imported_wallet()
+        addrs = [bitcoin.hash160_to_b58_address(h160, constants.net.ADDRTYPE_P2PKH) for h160 in self.h160s]
+        for addr in addrs:
+            wallet.import_address(addr)
+        wallet.set_pending_state(addrs, True)
+        txs = dict([self._ratx('registeraddress_v1', *self.h160s),
+                    self._ratx('deregisteraddress_v1', self.h160s[1]),
+                    (mock.Mock(**{'is_whitelist.return_value': False}), (None, None))])
+        with mock.patch.object(wallet, 'get_registeraddress_payload', side_effect=lambda tx: txs[tx]), \
+                mock.patch.object(wallet.storage, 'put', wraps=wallet.storage.put) as put:
+            self.assertEqual(2, wallet.parse_policy_txs(list(txs)))
+        self.assertEqual({addrs[0]}, wallet.registered_addresses)
+        self.assertEqual(set(), wallet.pending_addresses)
+        self.assertEqual(['parsed_policy_txids', 'pending_addresses', 'registered_addresses'],
+                         sorted(args[0] for args, kwargs in put.call_args_list))
+        self.assertEqual([addrs[0]], wallet.storage.get('registered_addresses'))
+
+    @mock.patch.object(storage.WalletStorage, '_write')
+    def test_policy_txs_replayed_to_wallet_loaded_later(self, mock_write):
+        addrs = [bitcoin.hash160_to_b58_address(h160, constants.net.ADDRTYPE_P2PKH) for h160 in self.h160s]
+        txs = dict([self._ratx('registeraddress_v1', *self.h160s),
+                    self._ratx('deregisteraddress_v1', self.h160s[1])])
+        # the tracker passed these to the wallets loaded before this one
+        network = mock.Mock(**{'policy_tracker.get_policy_txs.return_value': list(txs),
+                               'get_local_height.return_value': 200})
+        wallet = WalletIntegrityHelper.create_imported_wallet()
+        for addr in addrs:
+            wallet.import_address(addr)
+        with mock.patch.object(wallet, 'get_registeraddress_payload', side_effect=lambda tx: txs[tx]):
+            wallet.start_threads(network)
+        self.assertEqual({addrs[0]}, wallet.registered_addresses)
+        self.assertEqual(set(tx.txid() for tx in txs), wallet.parsed_policy_txids)
+        self.assertEqual([], wallet.get_policy_txs_to_replay())
+        wallet.stop_threads()
+
+
 # class TestWalletOfflineSigning(TestCaseForTestnet):
 
 #     @classmethod
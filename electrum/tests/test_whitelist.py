@@ -0,0 +1,66 @@
+from electrum import constants
+from electrum.bitcoin import hash160_to_b58_address
+from electrum.whitelist import WhitelistSet
+
+from . import SequentialTestCase
+
+
+TXID1 = '11' * 32
+TXID2 = '22' * 32
+
+
+def address(i, addrtype=None):
+    if addrtype is None:
+        addrtype = constants.net.ADDRTYPE_P2PKH
+    return hash160_to_b58_address(i.to_bytes(4, 'big') * 5, addrtype)
+
+
+class TestWhitelistSet(SequentialTestCase):
+
+    def test_add_and_spend_outputs(self):
+        for bloom_bits in (0, 16):
+            s = WhitelistSet(bloom_bits)
+            self.assertTrue(s.add_output(TXID1, 0, address(1)))
+            self.assertFalse(s.add_output(TXID1, 1, address(1)))
+            self.assertTrue(s.add_output(TXID2, 0, address(2)))
+            # the same output twice
+            self.assertFalse(s.add_output(TXID2, 0, address(3)))
+            self.assertEqual(2, len(s))
+            self.assertIn(address(1), s)
+            self.assertIn(address(2), s)
+            self.assertNotIn(address(3), s)
+            self.assertNotIn(address(1, constants.net.ADDRTYPE_P2SH), s)
+            self.assertNotIn('not an address', s)
+            # whitelisted until its last whitelist output is spent
+            self.assertIsNone(s.spend_output(TXID1, 0))
+            self.assertIn(address(1), s)
+            self.assertIsNone(s.spend_output(TXID1, 0))
+            self.assertEqual(address(1), s.spend_output(TXID1, 1))
+            self.assertNotIn(address(1), s)
+            self.assertEqual([address(2)], list(s))
+
+    def test_bloom_filter(self):
+        s = WhitelistSet()
+        addrs = [address(i) for i in range(1, 1000)]
+        for i, addr in enumerate(addrs):
+            s.add_output(TXID1, i, addr)
+            if i % 100 == 0:
+                self.assertIn(addr, s)
+        self.assertTrue(all(addr in s for addr in addrs))
+        self.assertGreaterEqual(len(s.bloom) * 8, len(s) * s.bloom_bits)
+        self.assertFalse(any(address(i) in s for i in range(1000, 2000)))
+
+    def test_serialization(self):
+        s = WhitelistSet()
+        for i in range(1, 50):
+            s.add_output(TXID1, i, address(i % 20 + 1))
+        raw = s.to_bytes()
+        s2 = WhitelistSet.from_bytes(raw)
+        self.assertEqual(raw, s2.to_bytes())
+        self.assertEqual(sorted(s), sorted(s2))
+        # address(2) received outputs 1, 21 and 41
+        self.assertEqual([None, None, address(2)], [s2.spend_output(TXID1, n) for n in (1, 21, 41)])
+        with self.assertRaises(ValueError):
+            WhitelistSet.from_bytes(raw[:-1])
+        with self.assertRaises(ValueError):
+            WhitelistSet.from_bytes(b'')
@@ -0,0 +1,123 @@
+# Electrum - lightweight Ocean client
+# Copyright (C) 2018 The Electrum Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# The token ratio is the fine mass (oz) of one token at a block height.
+# It is the zero ratio deflated by an inflation rate that is compounded
+# every hour, with intermediate rounding, so it cannot be computed in
+# closed form. The ratio of every elapsed hour is kept in a table that is
+# only extended as the chain grows, and appended to a file in the config
+# directory.
+
+import struct
+import threading
+from array import array
+
+from .util import PrintError
+
+
+# yearly inflation rate (not the demurrage rate)
+RATE = 0.010101010101010101
+# hourly inflation rate
+HOURLY_RATE = (1.0 + RATE) ** (1.0 / (365.0 * 3.0))
+# token ratio at time zero
+ZERO_RATIO = 0.1
+BLOCKS_PER_HOUR = 480
+
+
+class TokenRatios(PrintError):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.path = None
+        # compounded inflation after each hour
+        self.table = array('d', [1.0])
+        self.saved = 1
+
+    def load(self, path):
+        """Reads the table saved at path, and saves new entries there."""
+        with self.lock:
+            self.path = path
+            try:
+                with open(path, 'rb') as f:
+                    raw = f.read()
+            except FileNotFoundError:
+                raw = b''
+            # the file starts with the hourly rate it was computed with
+            if len(raw) < 8 or len(raw) % 8 or struct.unpack('d', raw[:8])[0] != HOURLY_RATE:
+                self.saved = 0
+                return
+            table = array('d')
+            table.frombytes(raw[8:])
+            if table[:1] != array('d', [1.0]):
+                self.saved = 0
+                return
+            if len(table) > len(self.table):
+                self.table = table
+            self.saved = len(table)
+
+    def _save(self):
+        if self.path is None or self.saved == len(self.table):
+            return
+        try:
+            if self.saved == 0:
+                with open(self.path, 'wb') as f:
+                    f.write(struct.pack('d', HOURLY_RATE))
+                    self.table.tofile(f)
+            else:
+                with open(self.path, 'ab') as f:
+                    self.table[self.saved:].tofile(f)
+        except OSError as e:
+            self.print_error('cannot save token ratios', e)
+            self.path = None
+            return
+        self.saved = len(self.table)
+
+    def _extend(self, hours):
+        # same steps and rounding as the original iteration
+        with self.lock:
+            table = self.table
+            ratio = table[-1]
+            for it in range(len(table), hours + 1):
+                ratio += round(ratio*HOURLY_RATE - ratio, 12)
+                table.append(ratio)
+            self._save()
+
+    def get(self, blockheight):
+        hours = max(int(blockheight), 0) // BLOCKS_PER_HOUR
+        if hours >= len(self.table):
+            self._extend(hours)
+        return round(ZERO_RATIO/self.table[hours], 13)
+
+
+token_ratios = TokenRatios()
+
+
+def token_ratio(blockheight):
+    """Fine mass of one token at blockheight."""
+    return token_ratios.get(blockheight)
+
+
+def token_mass(amounts, blockheight):
+    """Fine mass of each amount (in satoshis) at blockheight."""
+    tr = token_ratio(blockheight)
+    return [float(x)*tr/1.0E+8 for x in amounts]
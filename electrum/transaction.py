@@ -28,6 +28,9 @@
 # Note: The deserialization code originally comes from ABE.
 
 from typing import Sequence, Union, NamedTuple
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
 
 from .util import print_error, profiler
 
@@ -47,6 +50,43 @@ from .keystore import xpubkey_to_address, xpubkey_to_pubkey
 NO_SIGNATURE = 'ff'
 PARTIAL_TXN_HEADER_MAGIC = b'EPTF\xff'
 
+# transactions with fewer inputs to sign are always signed serially
+PARALLEL_SIGN_MIN_INPUTS = 20
+
+# process pool shared by all parallel signing, created on first use
+_sign_pool = None
+_sign_pool_workers = 0
+_sign_pool_lock = threading.Lock()
+
+
+def get_sign_pool(num_workers):
+    """Returns the signing pool, or None if processes cannot be used here.
+
+    Workers are spawned rather than forked, as forking would copy a
+    process running network and GUI threads. Frozen builds sign serially:
+    spawning would start the bundled application again."""
+    global _sign_pool, _sign_pool_workers
+    if getattr(sys, 'frozen', False) or sys.version_info < (3, 7):
+        # mp_context needs Python 3.7
+        return None
+    with _sign_pool_lock:
+        if _sign_pool is not None and _sign_pool_workers != num_workers:
+            _sign_pool.shutdown()
+            _sign_pool = None
+        if _sign_pool is None:
+            _sign_pool = ProcessPoolExecutor(max_workers=num_workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+            _sign_pool_workers = num_workers
+        return _sign_pool
+
+
+def shutdown_sign_pool():
+    global _sign_pool
+    with _sign_pool_lock:
+        if _sign_pool is not None:
+            _sign_pool.shutdown()
+            _sign_pool = None
+
 OUTPOINT_ISSUANCE_FLAG = (1 << 31)
 OUTPOINT_INDEX_MASK = 0x3fffffff
 WITNESS_SCALE_FACTOR = 4
@@ -737,6 +777,8 @@ class Transaction:
             raise Exception("cannot initialize transaction", raw)
         self._inputs = None
         self._outputs = None
+        self._ser_cache = {}
+        self._sighash_cache = {}
         self.locktime = 0
         self.version = 1
         # by default we assume this is a partial txn;
@@ -744,6 +786,24 @@ class Transaction:
         self.is_partial_originally = True
         self._segwit_ser = None  # None means "don't know"
 
+    @property
+    def locktime(self):
+        return self._locktime
+
+    @locktime.setter
+    def locktime(self, locktime):
+        self._locktime = locktime
+        self.invalidate_ser_cache()
+
+    @property
+    def version(self):
+        return self._version
+
+    @version.setter
+    def version(self, version):
+        self._version = version
+        self.invalidate_ser_cache()
+
     def update(self, raw):
         self.raw = raw
         self._inputs = None
@@ -784,12 +844,13 @@ class Transaction:
             return
         if len(self.inputs()) != len(signatures):
             raise Exception('expected {} signatures; got {}'.format(len(self.inputs()), len(signatures)))
+        self.invalidate_sighash_cache()
         for i, txin in enumerate(self.inputs()):
             pubkeys, x_pubkeys = self.get_sorted_pubkeys(txin)
             sig = signatures[i]
             if sig in txin.get('signatures'):
                 continue
-            pre_hash = Hash(bfh(self.serialize_preimage(i)))
+            pre_hash = self.pre_hash(i)
             sig_string = ecc.sig_string_from_der_sig(bfh(sig[:-2]))
             for recid in range(4):
                 try:
@@ -818,6 +879,7 @@ class Transaction:
         txin['scriptSig'] = None  # force re-serialization
         txin['witness'] = None    # force re-serialization
         self.raw = None
+        self.invalidate_ser_cache()
 
     def deserialize(self, force_full_parse=False):
         if self.raw is None:
@@ -827,6 +889,8 @@ class Transaction:
             return
         d = deserialize(self.raw, force_full_parse)
         self._inputs = d['inputs']
+        self.invalidate_sighash_cache()
+        self.invalidate_ser_cache()
         self._outputs = [TxOutput(x['type'], x['address'], x['value'], x['value_version'], x['asset'], x['asset_version'], x['nonce'], x['nonce_version'], x['surjection_proof'], x['range_proof'], x['scriptPubKey']) for x in d['outputs']]
         self.locktime = d['lockTime']
         self.version = d['version']
@@ -840,6 +904,8 @@ class Transaction:
         self._inputs = inputs
         self._outputs = outputs
         self.locktime = locktime
+        self.invalidate_sighash_cache()
+        self.invalidate_ser_cache()
         return self
 
     @classmethod
@@ -1093,12 +1159,16 @@ class Transaction:
         nSequence = 0xffffffff - (2 if rbf else 1)
         for txin in self.inputs():
             txin['sequence'] = nSequence
+        self.invalidate_sighash_cache()
+        self.invalidate_ser_cache()
 
     def BIP_LI01_sort(self):
         # See https://github.com/kristovatlas/rfc/blob/master/bips/bip-li01.mediawiki
         self._inputs.sort(key = lambda i: (i['prevout_hash'], i['prevout_n']))
         # leave the fee output last always
         self._outputs[::-1].sort(key = lambda o: (o[2], self.pay_script(o[0], o[1])))
+        self.invalidate_sighash_cache()
+        self.invalidate_ser_cache()
 
     def serialize_output(self, output):
         s = int_to_hex(output.vasset, 1)
@@ -1118,27 +1188,60 @@ class Transaction:
         s += script
         return s
 
+    def invalidate_ser_cache(self):
+        """Must be called whenever the transaction is modified."""
+        self._ser_cache = {}
+
+    def invalidate_sighash_cache(self):
+        """Must be called whenever inputs or outputs are modified."""
+        self._sighash_cache = {}
+
+    def get_sighash_cache(self, segwit):
+        """The parts of the signature preimage that are the same for every
+        input, serialized once per transaction instead of once per input."""
+        key = 'segwit' if segwit else 'legacy'
+        parts = self._sighash_cache.get(key)
+        if parts is None:
+            inputs = self.inputs()
+            outputs = self.outputs()
+            txouts = b''.join(bfh(self.serialize_output(o)) for o in outputs)
+            if segwit:
+                outpoints = [bfh(self.serialize_outpoint(txin)) for txin in inputs]
+                hashPrevouts = Hash(b''.join(outpoints))
+                hashSequence = Hash(b''.join(bfh(int_to_hex(txin.get('sequence', 0xffffffff - 1), 4)) for txin in inputs))
+                hashOutputs = Hash(txouts)
+                parts = outpoints, hashPrevouts, hashSequence, hashOutputs
+            else:
+                # every input with an empty script; input i gets its
+                # preimage script spliced in at offsets[i]:offsets[i+1]
+                txins = [bfh(self.serialize_input(txin, '')) for txin in inputs]
+                offsets = [0]
+                for txin in txins:
+                    offsets.append(offsets[-1] + len(txin))
+                parts = b''.join(txins), offsets, bfh(var_int(len(outputs))) + txouts
+            self._sighash_cache[key] = parts
+        return parts
+
     def serialize_preimage(self, i):
-        nVersion = int_to_hex(self.version, 4)
-        nHashType = int_to_hex(1, 4)
-        nLocktime = int_to_hex(self.locktime, 4)
+        return bh2u(self.serialize_preimage_bytes(i))
+
+    def serialize_preimage_bytes(self, i):
+        nVersion = bfh(int_to_hex(self.version, 4))
+        nHashType = bfh(int_to_hex(1, 4))
+        nLocktime = bfh(int_to_hex(self.locktime, 4))
         inputs = self.inputs()
-        outputs = self.outputs()
         txin = inputs[i]
-        # TODO: py3 hex
         if self.is_segwit_input(txin):
-            hashPrevouts = bh2u(Hash(bfh(''.join(self.serialize_outpoint(txin) for txin in inputs))))
-            hashSequence = bh2u(Hash(bfh(''.join(int_to_hex(txin.get('sequence', 0xffffffff - 1), 4) for txin in inputs))))
-            hashOutputs = bh2u(Hash(bfh(''.join(self.serialize_output(o) for o in outputs))))
-            outpoint = self.serialize_outpoint(txin)
+            outpoints, hashPrevouts, hashSequence, hashOutputs = self.get_sighash_cache(True)
             preimage_script = self.get_preimage_script(txin)
-            scriptCode = var_int(len(preimage_script) // 2) + preimage_script
-            amount = int_to_hex(txin['value'], 8)
-            nSequence = int_to_hex(txin.get('sequence', 0xffffffff - 1), 4)
-            preimage = nVersion + hashPrevouts + hashSequence + outpoint + scriptCode + amount + nSequence + hashOutputs + nLocktime + nHashType
+            scriptCode = bfh(var_int(len(preimage_script) // 2) + preimage_script)
+            amount = bfh(int_to_hex(txin['value'], 8))
+            nSequence = bfh(int_to_hex(txin.get('sequence', 0xffffffff - 1), 4))
+            preimage = nVersion + hashPrevouts + hashSequence + outpoints[i] + scriptCode + amount + nSequence + hashOutputs + nLocktime + nHashType
         else:
-            txins = var_int(len(inputs)) + ''.join(self.serialize_input(txin, self.get_preimage_script(txin) if i==k else '') for k, txin in enumerate(inputs))
-            txouts = var_int(len(outputs)) + ''.join(self.serialize_output(o) for o in outputs)
+            txins, offsets, txouts = self.get_sighash_cache(False)
+            txin_ser = bfh(self.serialize_input(txin, self.get_preimage_script(txin)))
+            txins = bfh(var_int(len(inputs))) + txins[:offsets[i]] + txin_ser + txins[offsets[i+1]:]
             preimage = nVersion + txins + txouts + nLocktime + nHashType
         return preimage
 
@@ -1158,6 +1261,18 @@ class Transaction:
             return network_ser
 
     def serialize_to_network(self, estimate_size=False, witness=False):
+        # Transactions that were final when parsed only change through the
+        # methods that invalidate the cache. Partial ones also have their
+        # input dicts filled in by the wallet, so they are not cached.
+        if estimate_size or self.is_partial_originally:
+            return self._serialize_to_network(estimate_size, witness)
+        key = 'network_witness' if witness else 'network'
+        ser = self._ser_cache.get(key)
+        if ser is None:
+            ser = self._ser_cache[key] = self._serialize_to_network(estimate_size, witness)
+        return ser
+
+    def _serialize_to_network(self, estimate_size=False, witness=False):
         nVersion = int_to_hex(self.version, 4)
         nLocktime = int_to_hex(self.locktime, 4)
         inputs = self.inputs()
@@ -1178,22 +1293,36 @@ class Transaction:
 
     def txid(self):
         self.deserialize()
+        txid = self._ser_cache.get('txid')
+        if txid is not None:
+            return txid
         all_segwit = all(self.is_segwit_input(x) for x in self.inputs())
         if not all_segwit and not self.is_complete():
             return None
         ser = self.serialize_to_network(witness=False)
-        return bh2u(Hash(bfh(ser))[::-1])
+        txid = bh2u(Hash(bfh(ser))[::-1])
+        if not self.is_partial_originally:
+            self._ser_cache['txid'] = txid
+        return txid
 
     def wtxid(self):
         self.deserialize()
+        wtxid = self._ser_cache.get('wtxid')
+        if wtxid is not None:
+            return wtxid
         if not self.is_complete():
             return None
         ser = self.serialize_to_network(witness=False)
-        return bh2u(Hash(bfh(ser))[::-1])
+        wtxid = bh2u(Hash(bfh(ser))[::-1])
+        if not self.is_partial_originally:
+            self._ser_cache['wtxid'] = wtxid
+        return wtxid
 
     def add_outputs(self, outputs):
         self._outputs.extend(outputs)
         self.raw = None
+        self.invalidate_sighash_cache()
+        self.invalidate_ser_cache()
 
     def input_value(self):
         return sum(x['value'] for x in self.inputs())
@@ -1298,12 +1427,19 @@ class Transaction:
         s, r = self.signature_count()
         return r == s
 
-    def sign(self, keypairs) -> None:
+    def sign(self, keypairs, num_workers=0) -> None:
         # keypairs:  (x_)pubkey -> secret_bytes
+        # num_workers: if > 1, large transactions are signed in a process pool
+        self.invalidate_sighash_cache()
+        jobs = []
         for i, txin in enumerate(self.inputs()):
             pubkeys, x_pubkeys = self.get_sorted_pubkeys(txin)
+            if self.is_txin_complete(txin):
+                continue
+            # signatures are only added once all of them are made
+            missing = txin.get('num_sig', 1) - len(list(filter(None, txin['signatures'])))
             for j, (pubkey, x_pubkey) in enumerate(zip(pubkeys, x_pubkeys)):
-                if self.is_txin_complete(txin):
+                if missing <= 0:
                     break
                 if pubkey in keypairs:
                     _pubkey = pubkey
@@ -1311,25 +1447,49 @@ class Transaction:
                     _pubkey = x_pubkey
                 else:
                     continue
-                print_error("adding signature for", _pubkey)
                 sec, compressed = keypairs.get(_pubkey)
-                sig = self.sign_txin(i, sec)
-                self.add_signature_to_txin(i, j, sig)
+                jobs.append((i, j, _pubkey, sec))
+                missing -= 1
+
+        if num_workers > 1 and len(jobs) >= PARALLEL_SIGN_MIN_INPUTS:
+            try:
+                sigs = self._sign_parallel(jobs, num_workers)
+            except Exception as e:
+                print_error("parallel signing failed, signing serially:", repr(e))
+                # a broken pool is not reused
+                shutdown_sign_pool()
+                sigs = None
+        else:
+            sigs = None
+        if sigs is None:
+            sigs = []
+            for i, j, _pubkey, sec in jobs:
+                print_error("adding signature for", _pubkey)
+                sigs.append(self.sign_txin(i, sec))
+        for (i, j, _pubkey, sec), sig in zip(jobs, sigs):
+            self.add_signature_to_txin(i, j, sig)
 
         print_error("is_complete", self.is_complete())
         self.raw = self.serialize()
 
+    def _sign_parallel(self, jobs, num_workers):
+        # preimages come from the sighash cache and are hashed here;
+        # only the ECDSA signing, the expensive part, is sent to the pool
+        executor = get_sign_pool(num_workers)
+        if executor is None:
+            return None
+        work = [(self.pre_hash(i), sec) for i, j, _pubkey, sec in jobs]
+        print_error("signing {} inputs with {} workers".format(len(work), num_workers))
+        return list(executor.map(sign_pre_hash, work, chunksize=max(1, len(work) // (4 * num_workers))))
+
     def pre_hash(self, txin_index):
-        preimage=self.serialize_preimage(txin_index)
-        pre_hash = Hash(bfh(preimage))
+        preimage=self.serialize_preimage_bytes(txin_index)
+        pre_hash = Hash(preimage)
         return pre_hash
         
     def sign_txin(self, txin_index, privkey_bytes) -> str:
         pre_hash=self.pre_hash(txin_index)
-        privkey = ecc.ECPrivkey(privkey_bytes)
-        sig = privkey.sign_transaction(pre_hash)
-        sig = bh2u(sig) + '01'
-        return sig
+        return sign_pre_hash((pre_hash, privkey_bytes))
 
     def get_outputs(self):
         """convert pubkeys to addresses"""
@@ -1366,6 +1526,15 @@ class Transaction:
         return out
 
 
+def sign_pre_hash(args) -> str:
+    # module level so that it can be run in worker processes
+    pre_hash, privkey_bytes = args
+    privkey = ecc.ECPrivkey(privkey_bytes)
+    sig = privkey.sign_transaction(pre_hash)
+    sig = bh2u(sig) + '01'
+    return sig
+
+
 def tx_from_str(txt):
     "json or raw hexadecimal"
     import json
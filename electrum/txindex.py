@@ -0,0 +1,366 @@
+# Electrum - lightweight Bitcoin client
+# Copyright (C) 2018 The Electrum Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Compact in-memory forms of the txi, txo and spent_outpoints indexes
+# of AddressSynchronizer.
+#
+# Each input or output is a fixed size struct record, txids are kept as
+# 32 raw bytes, and addresses, assets and scripts are stored once per
+# wallet in an InternTable and referred to by their index. Lookups
+# return the same nested dicts as before, built from the records.
+
+import struct
+import threading
+
+from .util import bh2u
+
+
+# address, n, value, asset, flags, scriptPubKey
+TXO_RECORD = struct.Struct('<IIQIBI')
+# address, prevout_hash, prevout_n, value, asset, flags
+TXI_RECORD = struct.Struct('<I32sIQIB')
+# prevout_n, spending txid
+SPENT_RECORD = struct.Struct('<I32s')
+# prevout_hash, prevout_n
+OUTPOINT_RECORD = struct.Struct('<32sI')
+
+# record flags
+IS_COINBASE = 1
+VALUE_INTERNED = 2  # not a plain amount (e.g. a blinded value), index into the table
+
+
+def txid_to_bytes(txid):
+    try:
+        return bytes.fromhex(txid)
+    except (TypeError, ValueError):
+        return None
+
+
+class InternTable:
+    """Keeps one copy of each value and refers to it by a small int."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def add(self, value) -> int:
+        i = self.index.get(value)
+        if i is None:
+            with self.lock:
+                i = self.index.get(value)
+                if i is None:
+                    i = len(self.values)
+                    self.values.append(value)
+                    self.index[value] = i
+        return i
+
+    def pack_value(self, v):
+        if type(v) is int and 0 <= v < 1 << 64:
+            return v, 0
+        return self.add(v), VALUE_INTERNED
+
+
+class TxRecords:
+    """txid -> {address: [entries]}, stored as one bytes object per txid.
+    A txid mapped to {} is kept, as b''."""
+
+    def __init__(self, table: InternTable, d=None):
+        self.table = table
+        self._records = {}  # txid bytes -> packed records
+        for txid, dd in (d or {}).items():
+            self[txid] = dd
+
+    def __contains__(self, txid):
+        return txid_to_bytes(txid) in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [bh2u(k) for k in list(self._records)]
+
+    def get(self, txid, default=None):
+        rec = self._records.get(txid_to_bytes(txid))
+        if rec is None:
+            return default
+        return self.decode(rec)
+
+    def __getitem__(self, txid):
+        rec = self._records[txid_to_bytes(txid)]
+        return self.decode(rec)
+
+    def __setitem__(self, txid, d):
+        self._records[bytes.fromhex(txid)] = self.encode(d)
+
+    def pop(self, txid, default=None):
+        rec = self._records.pop(txid_to_bytes(txid), None)
+        if rec is None:
+            return default
+        return self.decode(rec)
+
+    def items(self):
+        for k, rec in list(self._records.items()):
+            yield bh2u(k), self.decode(rec)
+
+    def encode(self, d) -> bytes:
+        raise NotImplementedError()
+
+    def decode(self, rec: bytes) -> dict:
+        raise NotImplementedError()
+
+    def to_json(self):
+        """The dict saved in storage, with plain lists as entries."""
+        return {txid: {addr: sorted((list(x) for x in entries), key=lambda x: x[0])
+                       for addr, entries in d.items()}
+                for txid, d in self.items()}
+
+
+class TxoIndex(TxRecords):
+    """txid -> {address: [(n, value, asset, is_coinbase, scriptPubKey)]}
+    The records of a tx are sorted by n, so that get_output can bisect."""
+
+    def encode(self, d):
+        t = self.table
+        out = []
+        for addr, outputs in d.items():
+            a = t.add(addr)
+            for n, v, asset, is_cb, spk in outputs:
+                v, flags = t.pack_value(v)
+                if is_cb:
+                    flags |= IS_COINBASE
+                out.append((n, TXO_RECORD.pack(a, n, v, t.add(asset), flags, t.add(spk))))
+        return b''.join(rec for n, rec in sorted(out))
+
+    def get_output(self, txid, n):
+        """Returns (address, value, asset, is_coinbase, scriptPubKey)
+        of output n of txid, or None if it is not in the index."""
+        rec = self._records.get(txid_to_bytes(txid))
+        if not rec:
+            return None
+        lo, hi = 0, len(rec) // TXO_RECORD.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            a, m, v, asset, flags, spk = TXO_RECORD.unpack_from(rec, mid * TXO_RECORD.size)
+            if m < n:
+                lo = mid + 1
+            elif m > n:
+                hi = mid
+            else:
+                t = self.table.values
+                v = t[v] if flags & VALUE_INTERNED else v
+                return t[a], v, t[asset], bool(flags & IS_COINBASE), t[spk]
+        return None
+
+    def decode(self, rec):
+        t = self.table.values
+        d = {}
+        for a, n, v, asset, flags, spk in TXO_RECORD.iter_unpack(rec):
+            v = t[v] if flags & VALUE_INTERNED else v
+            d.setdefault(t[a], []).append((n, v, t[asset], bool(flags & IS_COINBASE), t[spk]))
+        return d
+
+
+class TxiIndex(TxRecords):
+    """txid -> {address: set((prevout_hash:n, value, asset))}"""
+
+    def _pack(self, a, ser, v, asset):
+        prevout_hash, prevout_n = ser.split(':')
+        v, flags = self.table.pack_value(v)
+        return TXI_RECORD.pack(a, bytes.fromhex(prevout_hash), int(prevout_n), v,
+                               self.table.add(asset), flags)
+
+    def encode(self, d):
+        out = []
+        for addr, inputs in d.items():
+            a = self.table.add(addr)
+            for ser, v, asset in inputs:
+                out.append(self._pack(a, ser, v, asset))
+        return b''.join(out)
+
+    def decode(self, rec):
+        t = self.table.values
+        d = {}
+        for a, prevout_hash, prevout_n, v, asset, flags in TXI_RECORD.iter_unpack(rec):
+            v = t[v] if flags & VALUE_INTERNED else v
+            ser = bh2u(prevout_hash) + ':%d' % prevout_n
+            d.setdefault(t[a], set()).add((ser, v, t[asset]))
+        return d
+
+    def add(self, txid, addr, ser, v, asset) -> bool:
+        """Adds an input of txid, which must be in the index.
+        Returns False if it was there already."""
+        k = bytes.fromhex(txid)
+        rec = self._pack(self.table.add(addr), ser, v, asset)
+        records = self._records[k]
+        for i in range(0, len(records), TXI_RECORD.size):
+            if records[i:i + TXI_RECORD.size] == rec:
+                return False
+        self._records[k] = records + rec
+        return True
+
+
+class SpentOutpoints:
+    """prevout_hash -> {prevout_n: spending txid}, with binary txids.
+    The spends of the outputs of one tx are packed in a single bytes
+    object, sorted by prevout_n, so that lookups and updates bisect and
+    splice it; outpoints whose spending txs were all removed are dropped.
+    The outpoints spent by each tx are kept too, sorted by record bytes,
+    so that a tx can be removed without scanning."""
+
+    def __init__(self, d=None):
+        self._spent = {}  # prevout_hash bytes -> packed (prevout_n, txid) records
+        self._spent_by = {}  # txid bytes -> packed (prevout_hash, prevout_n) records
+        for prevout_hash, dd in (d or {}).items():
+            for prevout_n, txid in dd.items():
+                self.add(prevout_hash, int(prevout_n), txid)
+
+    def __contains__(self, prevout_hash):
+        return txid_to_bytes(prevout_hash) in self._spent
+
+    def __len__(self):
+        return len(self._spent)
+
+    @staticmethod
+    def _find_n(records, prevout_n):
+        """Returns the offset of prevout_n in records, or of the record it
+        goes before, and the spending txid if found."""
+        size = SPENT_RECORD.size
+        lo, hi = 0, len(records) // size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            n, txid = SPENT_RECORD.unpack_from(records, mid * size)
+            if n < prevout_n:
+                lo = mid + 1
+            elif n > prevout_n:
+                hi = mid
+            else:
+                return mid * size, txid
+        return lo * size, None
+
+    @staticmethod
+    def _find_outpoint(records, rec):
+        """Returns the offset of rec in records, or of the record it goes
+        before, and whether it was found."""
+        size = OUTPOINT_RECORD.size
+        lo, hi = 0, len(records) // size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if records[mid * size:mid * size + size] < rec:
+                lo = mid + 1
+            else:
+                hi = mid
+        i = lo * size
+        return i, records[i:i + size] == rec
+
+    def _add_spent_by(self, txid, k, prevout_n):
+        records = self._spent_by.get(txid, b'')
+        rec = OUTPOINT_RECORD.pack(k, prevout_n)
+        i, found = self._find_outpoint(records, rec)
+        if not found:
+            self._spent_by[txid] = records[:i] + rec + records[i:]
+
+    def _remove_spent_by(self, txid, k, prevout_n):
+        records = self._spent_by.get(txid)
+        if records is None:
+            return
+        i, found = self._find_outpoint(records, OUTPOINT_RECORD.pack(k, prevout_n))
+        if not found:
+            return
+        records = records[:i] + records[i + OUTPOINT_RECORD.size:]
+        if records:
+            self._spent_by[txid] = records
+        else:
+            self._spent_by.pop(txid)
+
+    def _remove_spent(self, k, i):
+        records = self._spent[k]
+        records = records[:i] + records[i + SPENT_RECORD.size:]
+        if records:
+            self._spent[k] = records
+        else:
+            self._spent.pop(k)
+
+    def get(self, prevout_hash, prevout_n):
+        records = self._spent.get(txid_to_bytes(prevout_hash))
+        if not records:
+            return None
+        i, txid = self._find_n(records, prevout_n)
+        return bh2u(txid) if txid is not None else None
+
+    def add(self, prevout_hash, prevout_n, txid):
+        k = bytes.fromhex(prevout_hash)
+        txid = bytes.fromhex(txid)
+        records = self._spent.get(k, b'')
+        i, old = self._find_n(records, prevout_n)
+        rec = SPENT_RECORD.pack(prevout_n, txid)
+        if old is None:
+            self._spent[k] = records[:i] + rec + records[i:]
+        elif old != txid:
+            self._remove_spent_by(old, k, prevout_n)
+            self._spent[k] = records[:i] + rec + records[i + SPENT_RECORD.size:]
+        self._add_spent_by(txid, k, prevout_n)
+
+    def remove(self, prevout_hash, prevout_n):
+        k = txid_to_bytes(prevout_hash)
+        records = self._spent.get(k)
+        if not records:
+            return
+        i, txid = self._find_n(records, prevout_n)
+        if txid is not None:
+            self._remove_spent(k, i)
+            self._remove_spent_by(txid, k, prevout_n)
+
+    def remove_spender(self, txid):
+        """Removes every spend by txid."""
+        txid = bytes.fromhex(txid)
+        for k, prevout_n in OUTPOINT_RECORD.iter_unpack(self._spent_by.pop(txid, b'')):
+            records = self._spent.get(k)
+            if not records:
+                continue
+            i, spender = self._find_n(records, prevout_n)
+            if spender == txid:
+                self._remove_spent(k, i)
+
+    def spenders(self, prevout_hash) -> set:
+        """txids spending outputs of prevout_hash"""
+        records = self._spent.get(txid_to_bytes(prevout_hash), b'')
+        return set(bh2u(txid) for n, txid in SPENT_RECORD.iter_unpack(records))
+
+    def spent_by(self, txid) -> list:
+        """(prevout_hash, prevout_n) of the outpoints spent by txid"""
+        return [(bh2u(k), n) for k, n in OUTPOINT_RECORD.iter_unpack(self._spent_by.get(txid_to_bytes(txid), b''))]
+
+    def to_json(self):
+        # keys as read back from the wallet file
+        return {bh2u(k): {str(n): bh2u(txid) for n, txid in SPENT_RECORD.iter_unpack(records)}
+                for k, records in list(self._spent.items())}
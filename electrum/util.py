@@ -23,7 +23,7 @@
 from . import constants as cnstnts
 import binascii
 import os, sys, re, json
-from collections import defaultdict
+from collections import defaultdict, deque
 from typing import NamedTuple
 from datetime import datetime
 import decimal
@@ -775,16 +775,37 @@ builtin_raw_input = builtins.input
 builtins.input = raw_input
 
 
-def parse_json(message):
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_wire_encode(obj) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # e.g. integers beyond 64 bits
+            pass
+    return json.dumps(obj).encode('utf8')
+
+
+def json_wire_decode(data: bytes):
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            pass
+    return json.loads(data.decode('utf8'))
+
+
+def parse_json(line):
     # TODO: check \r\n pattern
-    n = message.find(b'\n')
-    if n==-1:
-        return None, message
     try:
-        j = json.loads(message[0:n].decode('utf8'))
+        return json_wire_decode(line)
     except:
-        j = None
-    return j, message[n+1:]
+        return None
 
 
 class timeout(Exception):
@@ -799,7 +820,8 @@ import time
 class SocketPipe:
     def __init__(self, socket):
         self.socket = socket
-        self.message = b''
+        self.message = b''  # incomplete last line
+        self.lines = deque()  # complete lines not parsed yet
         self.set_timeout(0.1)
         self.recv_time = time.time()
 
@@ -811,11 +833,12 @@ class SocketPipe:
 
     def get(self):
         while True:
-            response, self.message = parse_json(self.message)
-            if response is not None:
-                return response
+            while self.lines:
+                response = parse_json(self.lines.popleft())
+                if response is not None:
+                    return response
             try:
-                data = self.socket.recv(1024)
+                data = self.socket.recv(65536)
             except socket.timeout:
                 raise timeout
             except ssl.SSLError:
@@ -836,16 +859,17 @@ class SocketPipe:
 
             if not data:  # Connection closed remotely
                 return None
-            self.message += data
+            lines = (self.message + data).split(b'\n')
+            self.message = lines.pop()
+            self.lines.extend(lines)
             self.recv_time = time.time()
 
     def send(self, request):
-        out = json.dumps(request) + '\n'
-        out = out.encode('utf8')
+        out = json_wire_encode(request) + b'\n'
         self._send(out)
 
     def send_all(self, requests):
-        out = b''.join(map(lambda x: (json.dumps(x) + '\n').encode('utf8'), requests))
+        out = b''.join(map(lambda x: json_wire_encode(x) + b'\n', requests))
         self._send(out)
 
     def _send(self, out):
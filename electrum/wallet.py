@@ -59,6 +59,7 @@ from .plugin import run_hook
 from .address_synchronizer import (AddressSynchronizer, TX_HEIGHT_LOCAL,
                                    TX_HEIGHT_UNCONF_PARENT, TX_HEIGHT_UNCONFIRMED)
 
+from .policy_tracker import get_kyc_pubkeys, get_registeraddress_payload
 from .paymentrequest import PR_PAID, PR_UNPAID, PR_UNKNOWN, PR_EXPIRED
 from .paymentrequest import InvoiceStore
 from .contacts import Contacts
@@ -182,6 +183,10 @@ class Abstract_Wallet(AddressSynchronizer):
         self.frozen_addresses      = set(storage.get('frozen_addresses',[]))
         self.registered_addresses  = set(storage.get('registered_addresses', []))
         self.pending_addresses     = set(storage.get('pending_addresses', []))
+        # address -> (private key, ECDH cache), to decrypt policy transactions
+        self.policy_keys = {}
+        # register-address and onboarding transactions parsed by this wallet
+        self.parsed_policy_txids   = set(storage.get('parsed_policy_txids', []))
         self.fiat_value            = storage.get('fiat_value', {})
         self.receive_requests      = storage.get('payment_requests', {})
         self.contracts             = storage.get('contracts', [])
@@ -202,6 +207,8 @@ class Abstract_Wallet(AddressSynchronizer):
 
     def load_and_cleanup(self):
         self.load_keystore()
+        # address -> contract hash its keys are tweaked with, '' for none
+        self.address_contracts = self.storage.get('address_contracts', {})
         self.load_addresses()
         self.test_addresses_sanity()
         super().load_and_cleanup()
@@ -234,6 +241,11 @@ class Abstract_Wallet(AddressSynchronizer):
             if not bitcoin.is_address(addrs[0]):
                 raise WalletFileException('The addresses in this wallet are not bitcoin addresses.')
 
+    def start_threads(self, network):
+        AddressSynchronizer.start_threads(self, network)
+        if network is not None:
+            self.replay_policy_txs()
+
     def synchronize(self):
         pass
 
@@ -551,7 +563,6 @@ class Abstract_Wallet(AddressSynchronizer):
     def dust_threshold(self):
         return dust_threshold(self.network)
 
-
     def make_unsigned_transaction(self, inputs, outputs, config, fixed_fee=None,
                                   change_addr=None, is_sweep=False, b_allow_zerospend: bool = False):
         # check outputs
@@ -648,7 +659,7 @@ class Abstract_Wallet(AddressSynchronizer):
     def mktx(self, outputs, password, config, fee=None, change_addr=None, domain=None):
         coins = self.get_spendable_coins(domain, config)
         tx = self.make_unsigned_transaction(coins, outputs, config, fee, change_addr)
-        self.sign_transaction(tx, password)
+        self.sign_transaction(tx, password, config)
         return tx
 
     def is_frozen(self, addr):
@@ -685,6 +696,27 @@ class Abstract_Wallet(AddressSynchronizer):
             return True
         return False
 
+    def set_registered_states(self, registrations):
+        '''Applies [(addrs, registered)] in order, and clears the pending
+        state of addrs, with one update of each list in storage'''
+        if not registrations:
+            return
+        with self.lock:
+            registered = set(self.registered_addresses)
+            pending = set(self.pending_addresses)
+            for addrs, reg in registrations:
+                if not all(self.is_mine(addr) for addr in addrs):
+                    continue
+                pending -= set(addrs)
+                if reg:
+                    registered |= set(addrs)
+                else:
+                    registered -= set(addrs)
+            self.registered_addresses = registered
+            self.pending_addresses = pending
+            self.storage.put('registered_addresses', list(registered))
+            self.storage.put('pending_addresses', list(pending))
+
     def set_pending_state(self, addrs, pend: bool):
         '''Set pending state of the addresses to STATE, True or False'''
         if all(self.is_mine(addr) for addr in addrs):
@@ -804,9 +836,7 @@ class Abstract_Wallet(AddressSynchronizer):
             txin['type'] = self.get_txin_type(address)
             # segwit needs value to sign
             if txin.get('value') is None and Transaction.is_input_value_needed(txin):
-                received, spent = self.get_addr_io(address)
-                item = received.get(txin['prevout_hash']+':%d'%txin['prevout_n'])
-                tx_height, value, asset, is_cb = item
+                addr, value, asset, is_cb, scriptPubKey = self.txo.get_output(txin['prevout_hash'], txin['prevout_n'])
                 txin['value'] = value
             self.add_input_sig_info(txin, address)
 
@@ -860,9 +890,11 @@ class Abstract_Wallet(AddressSynchronizer):
                 info[addr] = index, sorted_xpubs, self.m if isinstance(self, Multisig_Wallet) else None
         tx.output_info = info
 
-    def sign_transaction(self, tx, password):
+    def sign_transaction(self, tx, password, config=None):
         if self.is_watching_only():
             return
+        # opt-in: sign large transactions in this many worker processes
+        num_workers = config.get('sign_workers', 0) if config else 0
         self.add_input_info_to_all_inputs(tx)
         # hardware wallets require extra info
         if any([(isinstance(k, Hardware_KeyStore) and k.can_sign(tx)) for k in self.get_keystores()]):
@@ -879,7 +911,7 @@ class Abstract_Wallet(AddressSynchronizer):
                         keypairs = k.get_tx_derivations(tx)
                         for x_pubkey, (derivation, address) in keypairs.items():
                             keypairs[x_pubkey] = self.get_tweaked_private_key(address, derivation, password, self.get_txin_type(address))
-                        k.sign_transaction(tx, keypairs)
+                        k.sign_transaction(tx, keypairs, num_workers)
             except UserCancelled:
                 continue
         return tx
@@ -1149,17 +1181,34 @@ class Abstract_Wallet(AddressSynchronizer):
 
         self.storage.write()
 
+    def get_address_contracts(self, address):
+        """Contract hashes to try when tweaking the keys of address.
+        The one the address is known to use comes first."""
+        contracts = self.contracts + [None]
+        if address in self.address_contracts:
+            contract_hash = self.address_contracts[address] or None
+            if contract_hash in contracts:
+                contracts.remove(contract_hash)
+            contracts.insert(0, contract_hash)
+        return contracts
+
+    def set_address_contract(self, address, contract_hash):
+        if self.address_contracts.get(address) != (contract_hash or ''):
+            self.address_contracts[address] = contract_hash or ''
+            self.storage.put('address_contracts', self.address_contracts)
+
     def get_tweaked_private_key(self, address, sequence, password, aType='p2pkh'):
         if aType == 'p2pkh':
-            for contract_hash in self.contracts + [None]:
+            for contract_hash in self.get_address_contracts(address):
                 pk, compressed = self.keystore.get_private_key(sequence, password, contract_hash)
                 pubkey_from_priv = ecc.ECPrivkey(pk).get_public_key_hex(compressed=compressed)
                 if address == self.pubkeys_to_address(pubkey_from_priv):
+                    self.set_address_contract(address, contract_hash)
                     return pk, compressed
         #May need to somehow modify this code to check p2sh validity in the case where there are several contracts
         #TODO: if multiple contracts are used this code needs to be changed to verify that the private key is valid instead of returning the first one
         elif aType == 'p2sh':
-            for contract_hash in self.contracts + [None]:
+            for contract_hash in self.get_address_contracts(address):
                 pk, compressed = self.keystore.get_private_key(sequence, password, contract_hash)
                 return pk, compressed
         # This exception will probably never be thrown since we allow
@@ -1170,20 +1219,22 @@ class Abstract_Wallet(AddressSynchronizer):
             'address might have been derived without tweaking or incorrect tweaking.')
 
     def get_tweaked_public_key(self, address, pubkey):
-        for contract_hash in self.contracts + [None]:
+        for contract_hash in self.get_address_contracts(address):
             tweaked_pubkey = self.tweak_pubkeys(pubkey, contract_hash)
             if address == self.pubkeys_to_address(tweaked_pubkey):
+                self.set_address_contract(address, contract_hash)
                 return tweaked_pubkey
         raise WalletFileException('Public key not found. The corresponding '
         'address might have been derived without tweaking or incorrect tweaking.')
 
     def get_tweaked_multi_public_keys(self, address, pubkeys, m, shouldSort = True):
-        for contract_hash in self.contracts + [None]:
+        for contract_hash in self.get_address_contracts(address):
             unsorted_tweaked_pubkeys = self.tweak_pubkeys(pubkeys, contract_hash)
             tweaked_pubkeys = sorted(unsorted_tweaked_pubkeys)
             redeem_script = multisig_script(tweaked_pubkeys, m) 
             tempAddr = bitcoin.hash160_to_p2sh(hash_160(bfh(redeem_script)))
             if tempAddr == address:
+                self.set_address_contract(address, contract_hash)
                 if shouldSort:
                     return tweaked_pubkeys
                 #Return unsorted pubkeys
@@ -1205,23 +1256,15 @@ class Abstract_Wallet(AddressSynchronizer):
     def get_depending_transactions(self, tx_hash):
         """Returns all (grand-)children of tx_hash in this wallet."""
         children = set()
-        # TODO rewrite this to use self.spent_outpoints
-        for other_hash, tx in self.transactions.items():
-            for input in (tx.inputs()):
-                if input["prevout_hash"] == tx_hash:
-                    children.add(other_hash)
-                    children |= self.get_depending_transactions(other_hash)
+        for other_hash in self.spent_outpoints.spenders(tx_hash):
+            children.add(other_hash)
+            children |= self.get_depending_transactions(other_hash)
         return children
 
     def txin_value(self, txin):
-        txid = txin['prevout_hash']
-        prev_n = txin['prevout_n']
-        for address, d in self.txo.get(txid, {}).items():
-            for n, v, a, cb in d:
-                if n == prev_n:
-                    return v
-        # may occur if wallet is not synchronized
-        return None
+        prevout = self.txo.get_output(txin['prevout_hash'], txin['prevout_n'])
+        # may be missing if wallet is not synchronized
+        return prevout[1] if prevout else None
 
     def price_at_timestamp(self, txid, price_func):
         """Returns fiat price of bitcoin at the time tx got confirmed."""
@@ -1273,14 +1316,101 @@ class Abstract_Wallet(AddressSynchronizer):
         # overloaded for TrustedCoin wallets
         return False
 
-    def parse_policy_tx(self, tx: transaction.Transaction, parent_window):
+    def is_policy_tx(self, tx: transaction.Transaction):
         if not tx.is_whitelist():
             return False
-        if self.parse_registeraddress_tx(tx, parent_window):
+        if self.get_registeraddress_payload(tx)[0] is not None:
             return True
-        if self.parse_whitelist_tx(tx):
-            return True
-        return False
+        # KYC pubkeys are tracked by the network
+        return any(True for key, n in get_kyc_pubkeys(tx))
+
+    def get_policy_key_addresses(self, txs):
+        """Addresses whose private keys decrypt the register-address and
+        onboarding payloads of txs."""
+        addrs = set()
+        if not constants.net.ENCRYPTED_WHITELIST:
+            return addrs
+        for tx in txs:
+            if not tx.is_whitelist():
+                continue
+            txtype, data = self.get_registeraddress_payload(tx)
+            if txtype != 'registeraddress_v0':
+                continue
+            onboardAddress = self.get_onboard_address(data)
+            if onboardAddress is not None:
+                addrs.add(onboardAddress)
+            else:
+                addrs |= set(filter(self.is_mine, self.get_from_addresses(tx)))
+        return addrs
+
+    def policy_txs_need_password(self, txs):
+        if not self.has_keystore_encryption():
+            return False
+        return bool(self.get_policy_key_addresses(txs) - set(self.policy_keys))
+
+    def unlock_policy_keys(self, addrs, password):
+        # kept for the session, with the ECDH keys derived from them
+        for address in addrs:
+            if address in self.policy_keys:
+                continue
+            try:
+                serialized, redeem_script = self.export_private_key(address, password, includeRedeemScript=False)
+                txin_type, secret_bytes, compressed = bitcoin.deserialize_privkey(serialized)
+            except InvalidPassword:
+                raise
+            except Exception:
+                continue
+            self.policy_keys[address] = (ecc.ECPrivkey(secret_bytes), {})
+
+    def parse_policy_txs(self, txs, password=None):
+        """Parses policy transactions in order. Returns the number of
+        policy transactions.
+
+        The keys needed to decrypt their payloads are unlocked once, so
+        this can run off the GUI thread; check policy_txs_need_password
+        first. The registered addresses are saved once for the batch."""
+        self.unlock_policy_keys(self.get_policy_key_addresses(txs), password)
+        registrations = []
+        n = 0
+        parsed = set()
+        for tx in txs:
+            if not self.is_policy_tx(tx):
+                continue
+            if self.parse_registeraddress_tx(tx, registrations):
+                parsed.add(tx.txid())
+            n += 1
+        self.set_registered_states(registrations)
+        if parsed - self.parsed_policy_txids:
+            with self.lock:
+                self.parsed_policy_txids |= parsed
+                self.storage.put('parsed_policy_txids', list(self.parsed_policy_txids))
+        return n
+
+    def parse_policy_tx(self, tx: transaction.Transaction, password=None):
+        return self.parse_policy_txs([tx], password) > 0
+
+    def get_policy_txs_to_replay(self):
+        """Register-address and onboarding transactions of the network
+        not parsed by this wallet yet, in order.
+
+        The network passes each policy transaction to the wallets once,
+        when it is received, so wallets loaded later replay them."""
+        if not self.network:
+            return []
+        return [tx for tx in self.network.policy_tracker.get_policy_txs()
+                if tx.txid() not in self.parsed_policy_txids]
+
+    def replay_policy_txs(self):
+        """Parses the policy transactions to replay, up to the first one
+        that needs the password; the GUI asks for it and parses the
+        rest. Returns the transactions left."""
+        txs = self.get_policy_txs_to_replay()
+        i = 0
+        while i < len(txs) and not self.policy_txs_need_password(txs[i:i+1]):
+            i += 1
+        if i:
+            self.parse_policy_txs(txs[:i])
+        return txs[i:]
 
     #Get the address the transaction fee was paid from
     def get_from_addresses(self, tx):
@@ -1323,98 +1453,54 @@ class Abstract_Wallet(AddressSynchronizer):
             print(e)
             return None
 
-    def parse_registeraddress_data(self, data, tx, parent_window):
+    def parse_registeraddress_data(self, data, tx, registrations):
         # We must have already been assigned a kyc public key
         if self.kyc_pubkey == None:
             return False
+        # the payload is encrypted to the key of one of our inputs
+        for address in sorted(self.get_from_addresses(tx) & set(self.policy_keys)):
+            key, ecdh_cache = self.policy_keys[address]
+            try:
+                plaintext = key.decrypt_message(data, ephemeral_pubkey_bytes=bfh(self.kyc_pubkey),
+                                                decode=binascii.unhexlify, ecdh_cache=ecdh_cache)
+            except Exception:
+                continue
+            self.parse_ratx_addresses(plaintext, registrations)
+            return True
+        return False
 
-        fromAddresses = self.get_from_addresses(tx)
-        if fromAddresses == None:
-            return False
-
-        fromAddress=None
-        for address in fromAddresses:
-            if self.is_mine(address):
-                fromAddress=address
-                break
-
-        if fromAddress == None:
-            return False
-
-
-
-        password=None
-        if self.storage.is_encrypted() or self.storage.get('use_encryption'):
-            if self.storage.is_encrypted_with_hw_device():
-                #TODO - sort out what to do for encrypted wallets.
-                return False
-            else:
-                if self.has_keystore_encryption():
-                    msg = _('Received encrypted address whitelist registration transaction.') + '\n' + _('Please enter your password to update wallet whitelist status.')
-                    password = parent_window.password_dialog(msg, parent=parent_window.top_level_window())
-                    if not password:
-                        return False
-
-        try:
-            fromKey_serialized, redeem_script=self.export_private_key(fromAddress, password=password)
-            txin_type, secret_bytes, compressed = bitcoin.deserialize_privkey(fromKey_serialized)
-            fromKey=ecc.ECPrivkey(secret_bytes)
-        except Exception:
-            return False
-
-        try:
-            plaintext=fromKey.decrypt_message(data, ephemeral_pubkey_bytes=bfh(self.kyc_pubkey), decode=binascii.unhexlify)
-        except Exception:
-            return False
-
-
-        self.parse_ratx_addresses(plaintext)
-
-        return True
-
-    def parse_onboard_data(self, data, parent_window):
+    def get_onboard_address(self, data):
+        """Returns the address of the user onboard pubkey of an onboarding
+        payload, if it is ours."""
         pubKeySize=33
-        addressSize=20
         minPayloadSize=2
-
-        i1=0
-        i2=33
-        if(len(data)<2*pubKeySize+minPayloadSize):
-            return False
-
-        kyc_pubkey=data[i1:i2]
-        #Check if this is a onboarding TX
-        try:
-            _kyc_pubkey=ecc.ECPubkey(kyc_pubkey)
-        except ecc.InvalidECPointException:
-            return False
-        except ValueError:
-            return False
-        i1=i2
-        i2+=33
-        userOnboardPubKey = data[i1:i2]
+        if len(data) < 2*pubKeySize+minPayloadSize:
+            return None
         try:
-            _userOnboardPubKey=ecc.ECPubkey(userOnboardPubKey)
-        except InvalidECPointException:
-            return False
-        except ValueError:
-            return False
-        #Check that this wallet holds the onboard user private key
-        onboardAddress=bitcoin.public_key_to_p2pkh(userOnboardPubKey)
-        _onboardUserKey = self.derive_onboard_priv_key(onboardAddress, parent_window)
-        if _onboardUserKey is None:
-            print('Failed to retrieve the onboarding private key from the address')
+            ecc.ECPubkey(data[:pubKeySize])
+            userOnboardPubKey = data[pubKeySize:2*pubKeySize]
+            ecc.ECPubkey(userOnboardPubKey)
+        except (ecc.InvalidECPointException, ValueError):
+            return None
+        onboardAddress = bitcoin.public_key_to_p2pkh(userOnboardPubKey)
+        return onboardAddress if self.is_mine(onboardAddress) else None
+
+    def parse_onboard_data(self, data, registrations):
+        onboardAddress = self.get_onboard_address(data)
+        if onboardAddress is None or onboardAddress not in self.policy_keys:
             return False
-        i1=i2
-        ciphertext=data[i1:]
+        kyc_pubkey = data[:33]
+        _onboardUserKey, ecdh_cache = self.policy_keys[onboardAddress]
+        ciphertext = data[66:]
         try:
-            plaintext, ephemeral=_onboardUserKey.decrypt_message(ciphertext, get_ephemeral=True, decode=binascii.unhexlify)
+            plaintext, ephemeral = _onboardUserKey.decrypt_message(ciphertext, get_ephemeral=True,
+                                                                   decode=binascii.unhexlify, ecdh_cache=ecdh_cache)
         except Exception:
             return False
         #Confirm that this was encrypted by the kyc private key owner
-        if not ephemeral == _kyc_pubkey:
+        if not ephemeral == ecc.ECPubkey(kyc_pubkey):
             return False
-        self.parse_ratx_addresses(plaintext)
+        self.parse_ratx_addresses(plaintext, registrations)
 
         self.set_kyc_pubkey(bh2u(kyc_pubkey))
         self.set_onboard_address(onboardAddress)
@@ -1526,7 +1612,7 @@ class Abstract_Wallet(AddressSynchronizer):
         return addr, i1
 
 
-    def parse_ratx_addresses(self, data, txtype='registeraddress_v0'):
+    def parse_ratx_addresses(self, data, registrations, txtype='registeraddress_v0'):
         #To do: parse version 1 transactions
         if txtype == 'registeraddress_v1' or txtype == 'deregisteraddress_v1':
             addrs = self.parse_ratx_addresses_v1(data)
@@ -1535,43 +1621,30 @@ class Abstract_Wallet(AddressSynchronizer):
             
         if not addrs or len(addrs) == 0:
             return
-            
-        self.set_pending_state(addrs, False)
 
-        if txtype == 'registeraddress_v1' or txtype == 'registeraddress_v0':
-            registered_state=True
-        else:
-            registered_state=False
-            
-        self.set_registered_state(addrs, registered_state)
+        registered_state = txtype == 'registeraddress_v1' or txtype == 'registeraddress_v0'
+        registrations.append((addrs, registered_state))
 
     def get_zero_address(self):
         return hash160_to_b58_address(bytearray.fromhex('0'*40) , constants.net.ADDRTYPE_P2PKH)
 
-    def parse_registeraddress_tx(self, tx: transaction.Transaction, parent_window):
-        decoded=dict()
-        data=None
-        outputs = tx.outputs()
-        for output in outputs:
-            transaction.parse_whitelistScriptSig(decoded, bfh(output.scriptPubKey))
-            if len(decoded) is not 0:
-                txtype=decoded['type']
-                if txtype == 'registeraddress_v1' or txtype == 'deregisteraddress_v1' or txtype == 'registeraddress_v0' or txtype == 'deregisteraddress_v0':
-                    data=decoded['data']
-                    break
-                else:
-                    decoded=[]
+    def get_registeraddress_payload(self, tx: transaction.Transaction):
+        """Returns (txtype, data) of a register-address transaction, or
+        (None, None)."""
+        return get_registeraddress_payload(tx)
 
+    def parse_registeraddress_tx(self, tx: transaction.Transaction, registrations):
+        txtype, data = self.get_registeraddress_payload(tx)
         if data is None:
             return False
 
         if  txtype == 'registeraddress_v0' and constants.net.ENCRYPTED_WHITELIST:
-            if self.parse_onboard_data(data, parent_window):
+            if self.parse_onboard_data(data, registrations):
                 return True
-            if self.parse_registeraddress_data(data, tx, parent_window):
+            if self.parse_registeraddress_data(data, tx, registrations):
                 return True
         else:
-            self.parse_ratx_addresses(data, txtype)
+            self.parse_ratx_addresses(data, registrations, txtype)
 
         return True
 
@@ -1864,6 +1937,9 @@ class Deterministic_Wallet(Abstract_Wallet):
             self._addr_to_addr_index[addr] = (True, False, i)
 
     def create_new_address(self, for_change:bool=False, for_encryption:bool=False):
+        return self.create_new_addresses(for_change, 1, for_encryption)[0]
+
+    def create_new_addresses(self, for_change:bool=False, count:int=1, for_encryption:bool=False):
         with self.lock:
             if for_encryption:
                 for_change=False
@@ -1874,18 +1950,29 @@ class Deterministic_Wallet(Abstract_Wallet):
             else:
                 addr_list=self.receiving_addresses
             n = len(addr_list)
-            x = self.derive_pubkeys(for_change, n, for_encryption)
-            if self.contracts:
-                x = self.tweak_pubkeys(x, self.contracts[-1])
-            address = self.pubkeys_to_address(x)
-            addr_list.append(address)
-            if for_encryption:
-                self._addr_to_addr_index[address] = (for_encryption, for_change, n)
-            else:
-                self._addr_to_addr_index[address] = (for_change, n)
+            contract_hash = self.contracts[-1] if self.contracts else None
+            pubkeys = self.derive_pubkeys_range(for_change, n, n + count, for_encryption, contract_hash)
+            addresses = []
+            for i, x in enumerate(pubkeys, n):
+                address = self.pubkeys_to_address(x)
+                addr_list.append(address)
+                self.address_contracts[address] = contract_hash or ''
+                if for_encryption:
+                    self._addr_to_addr_index[address] = (for_encryption, for_change, i)
+                else:
+                    self._addr_to_addr_index[address] = (for_change, i)
+                addresses.append(address)
+            self.storage.put('address_contracts', self.address_contracts)
             self.save_addresses()
-            self.add_address(address)
-            return address
+            for address in addresses:
+                self.add_address(address)
+            return addresses
+
+    def derive_pubkeys_range(self, c, start, end, e=False, tweak=None):
+        pubkeys = [self.derive_pubkeys(c, i, e) for i in range(start, end)]
+        if tweak:
+            pubkeys = [self.tweak_pubkeys(x, tweak) for x in pubkeys]
+        return pubkeys
 
     def synchronize_sequence(self, for_change, for_encryption=False):
         limit = self.gap_limit_for_change if for_change else self.gap_limit
@@ -1898,12 +1985,16 @@ class Deterministic_Wallet(Abstract_Wallet):
                 addresses = self.get_receiving_addresses()
 
             if len(addresses) < limit:
-                self.create_new_address(for_change, for_encryption)
+                self.create_new_addresses(for_change, limit - len(addresses), for_encryption)
                 continue
-            if list(map(lambda a: self.address_is_old(a), addresses[-limit:] )) == limit*[False]:
+            k = 0
+            for a in addresses[:-limit-1:-1]:
+                if self.address_is_old(a):
+                    break
+                k += 1
+            if k == limit:
                 break
-            else:
-                self.create_new_address(for_change, for_encryption)
+            self.create_new_addresses(for_change, limit - k, for_encryption)
 
     def synchronize(self):
         with self.lock:
@@ -1995,6 +2086,9 @@ class Simple_Deterministic_Wallet(Simple_Wallet, Deterministic_Wallet):
     def derive_pubkeys(self, c, i, e=False):
         return self.keystore.derive_pubkey(c, i, e)
 
+    def derive_pubkeys_range(self, c, start, end, e=False, tweak=None):
+        return self.keystore.derive_pubkey_range(c, start, end, e, tweak)
+
     def tweak_pubkeys(self, c, t):
         return self.keystore.tweak_pubkey(c, t)
 
@@ -2205,6 +2299,17 @@ class Multisig_Wallet(Deterministic_Wallet):
         #Not for encryption
         return [k.derive_pubkey(c, i, e) for k in self.get_keystores()]
 
+    def derive_pubkeys_range(self, c, start, end, e=False, tweak=None):
+        if e:
+            pubkeys = [[x] for x in self.keystore.derive_pubkey_range(c, start, end, e)]
+        else:
+            ranges = [k.derive_pubkey_range(c, start, end, e) for k in self.get_keystores()]
+            pubkeys = [list(x) for x in zip(*ranges)]
+        if tweak:
+            # all cosigner keys are tweaked by the first keystore, see tweak_pubkeys
+            pubkeys = [self.tweak_pubkeys(x, tweak) for x in pubkeys]
+        return pubkeys
+
     def tweak_pubkeys(self, c, t):
         #Only a single pubkey is passed (string)
         if len(c) >= 33 :
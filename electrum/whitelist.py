@@ -0,0 +1,213 @@
+# Electrum - lightweight Ocean client
+# Copyright (C) 2018 The Electrum Developers
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation files
+# (the "Software"), to deal in the Software without restriction,
+# including without limitation the rights to use, copy, modify, merge,
+# publish, distribute, sublicense, and/or sell copies of the Software,
+# and to permit persons to whom the Software is furnished to do so,
+# subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Membership set of the addresses holding the whitelist asset.
+#
+# An address is in the set while it holds at least one unspent output
+# of the whitelist asset. Addresses registered with encrypted
+# register-address or onboarding transactions are not in it. Addresses and whitelist outputs are fixed size
+# records in two bytearrays sorted by key, so the set costs a few dozen
+# bytes per address whatever the size of the whitelist, and is saved as
+# is. An optional Bloom filter answers most lookups of addresses that
+# are not whitelisted without searching the records.
+
+import struct
+import threading
+
+from . import bitcoin
+from .txindex import OUTPOINT_RECORD, txid_to_bytes
+
+
+# hash160, address type, number of whitelist outputs
+ADDRESS_RECORD = struct.Struct('<20sBI')
+# prevout_hash, prevout_n, hash160
+OUTPUT_RECORD = struct.Struct('<32sI20s')
+# magic, number of addresses, number of outputs
+FILE_HEADER = struct.Struct('<4sII')
+FILE_MAGIC = b'OWL1'
+
+
+class SortedRecords:
+    """Fixed size records in a bytearray, sorted by their first key_size bytes."""
+
+    def __init__(self, record, key_size, data=b''):
+        self.record = record
+        self.key_size = key_size
+        self.buf = bytearray(data)
+
+    def __len__(self):
+        return len(self.buf) // self.record.size
+
+    def __iter__(self):
+        return self.record.iter_unpack(bytes(self.buf))
+
+    def find(self, key):
+        """Returns the offset of key, or of the record it goes before, and
+        whether it was found."""
+        size, buf = self.record.size, self.buf
+        lo, hi = 0, len(buf) // size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if buf[mid*size:mid*size+self.key_size] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        i = lo * size
+        return i, buf[i:i+self.key_size] == key
+
+    def get(self, key):
+        i, found = self.find(key)
+        return self.record.unpack_from(self.buf, i) if found else None
+
+    def put(self, *values):
+        rec = self.record.pack(*values)
+        i, found = self.find(rec[:self.key_size])
+        if found:
+            self.buf[i:i+self.record.size] = rec
+        else:
+            self.buf[i:i] = rec
+
+    def remove(self, key):
+        i, found = self.find(key)
+        if found:
+            del self.buf[i:i+self.record.size]
+        return found
+
+
+class WhitelistSet:
+
+    def __init__(self, bloom_bits=16):
+        """bloom_bits is the size of the Bloom filter in bits per address,
+        0 for none."""
+        self.lock = threading.Lock()
+        self.addresses = SortedRecords(ADDRESS_RECORD, 20)
+        self.outputs = SortedRecords(OUTPUT_RECORD, 36)
+        self.bloom_bits = bloom_bits
+        self.bloom = None
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __iter__(self):
+        for h160, addrtype, count in self.addresses:
+            yield bitcoin.hash160_to_b58_address(h160, addrtype)
+
+    def __contains__(self, address):
+        try:
+            addrtype, h160 = bitcoin.b58_address_to_hash160(address)
+        except Exception:
+            return False
+        with self.lock:
+            if self.bloom_bits:
+                if self.bloom is None:
+                    self._build_bloom()
+                if not self._bloom_test(h160):
+                    return False
+            rec = self.addresses.get(h160)
+        return rec is not None and rec[1] == addrtype
+
+    def _bloom_positions(self, h160):
+        # hash160s are uniform already; use their 32 bit words as hashes
+        m = len(self.bloom) * 8
+        for k in range(4):
+            yield int.from_bytes(h160[4*k:4*k+4], 'little') % m
+
+    def _bloom_test(self, h160):
+        bloom = self.bloom
+        return all(bloom[i >> 3] & (1 << (i & 7)) for i in self._bloom_positions(h160))
+
+    def _bloom_add(self, h160):
+        for i in self._bloom_positions(h160):
+            self.bloom[i >> 3] |= 1 << (i & 7)
+
+    def _build_bloom(self):
+        # sized for twice the current number of addresses
+        self.bloom = bytearray(max(64, 2 * len(self.addresses) * self.bloom_bits // 8))
+        for h160, addrtype, count in self.addresses:
+            self._bloom_add(h160)
+
+    def add_output(self, txid, n, address):
+        """Adds a whitelist asset output. Returns True if address was not
+        whitelisted before."""
+        try:
+            addrtype, h160 = bitcoin.b58_address_to_hash160(address)
+        except Exception:
+            return False
+        prevout_hash = txid_to_bytes(txid)
+        if prevout_hash is None:
+            return False
+        with self.lock:
+            if self.outputs.get(OUTPOINT_RECORD.pack(prevout_hash, n)):
+                return False
+            self.outputs.put(prevout_hash, n, h160)
+            rec = self.addresses.get(h160)
+            count = rec[2] if rec else 0
+            self.addresses.put(h160, addrtype, count + 1)
+            if self.bloom is not None:
+                if len(self.bloom) * 8 < len(self.addresses) * self.bloom_bits:
+                    self.bloom = None
+                else:
+                    self._bloom_add(h160)
+            return rec is None
+
+    def spend_output(self, txid, n):
+        """Removes a whitelist asset output, if known. Returns the address
+        if it is no longer whitelisted."""
+        prevout_hash = txid_to_bytes(txid)
+        if prevout_hash is None:
+            return None
+        key = OUTPOINT_RECORD.pack(prevout_hash, n)
+        with self.lock:
+            rec = self.outputs.get(key)
+            if rec is None:
+                return None
+            self.outputs.remove(key)
+            h160, addrtype, count = self.addresses.get(rec[2])
+            if count > 1:
+                self.addresses.put(h160, addrtype, count - 1)
+                return None
+            self.addresses.remove(h160)
+            # rebuilt without it on the next lookup
+            self.bloom = None
+            return bitcoin.hash160_to_b58_address(h160, addrtype)
+
+    def to_bytes(self):
+        with self.lock:
+            return (FILE_HEADER.pack(FILE_MAGIC, len(self.addresses), len(self.outputs))
+                    + self.addresses.buf + self.outputs.buf)
+
+    @classmethod
+    def from_bytes(cls, raw, bloom_bits=16):
+        """Raises ValueError if raw was not written by to_bytes."""
+        try:
+            magic, n_addresses, n_outputs = FILE_HEADER.unpack_from(raw)
+        except struct.error:
+            raise ValueError('truncated whitelist')
+        i = FILE_HEADER.size
+        j = i + n_addresses * ADDRESS_RECORD.size
+        if magic != FILE_MAGIC or len(raw) != j + n_outputs * OUTPUT_RECORD.size:
+            raise ValueError('invalid whitelist')
+        s = cls(bloom_bits)
+        s.addresses.buf[:] = raw[i:j]
+        s.outputs.buf[:] = raw[j:]
+        return s
@@ -43,6 +43,8 @@ if platform.system() in ['Linux', 'FreeBSD', 'DragonFly']:
 extras_require = {
     'hardware': requirements_hw,
     'fast': ['pycryptodomex'],
+    # faster JSON on the server connections; needs Python 3.6+
+    'orjson': ['orjson'],
 }
 extras_require['full'] = extras_require['hardware'] + extras_require['fast']
 